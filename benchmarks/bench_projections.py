@@ -0,0 +1,66 @@
+"""Compare le coût mémoire / temps des listes : entités ORM complètes vs projections de colonnes.
+
+Usage : python -m benchmarks.bench_projections [nombre_de_lignes]
+(les variables DATABASE_URL et ENCRYPTION_KEY du .env doivent être définies)
+"""
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from crm.models import Base, Client, Contract, Event
+from crm.projections import event_rows
+
+
+def populate(engine, rows):
+    with engine.begin() as connection:
+        connection.execute(insert(Client), [{"id": 1, "name": "Client", "email": "c@example.com"}])
+        connection.execute(insert(Contract), [{
+            "id": 1, "unique_id": str(uuid.uuid4()), "client_id": 1,
+            "amount_total": 1000, "amount_remaining": 0, "status": "signed",
+        }])
+        start = datetime(2026, 1, 1)
+        connection.execute(insert(Event), [{
+            "contract_id": 1, "client_name": f"Client {i}", "client_contact": "0102030405 | c@example.com",
+            "event_date_start": start + timedelta(hours=i), "event_date_end": start + timedelta(hours=i + 2),
+            "support_contact": "Support", "location": "Paris", "attendees": 10, "notes": "Notes " * 10,
+        } for i in range(rows)])
+
+
+def orm_listing(session):
+    return [(e.id, e.client_name, e.event_date_start, e.location) for e in session.query(Event).all()]
+
+
+def projection_listing(session):
+    return [(e.id, e.client_name, e.event_date_start, e.location) for e in event_rows(session)]
+
+
+def measure(Session, listing):
+    session = Session()
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = len(listing(session))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    session.close()
+    return count, elapsed, peak
+
+
+def main(rows=100_000):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    populate(engine, rows)
+    Session = sessionmaker(bind=engine)
+
+    print(f"{'Méthode':<12} {'Lignes':>8} {'Temps (s)':>10} {'Pic mémoire (Mo)':>17} {'par 100k (s)':>13}")
+    for name, listing in (("ORM", orm_listing), ("Projection", projection_listing)):
+        count, elapsed, peak = measure(Session, listing)
+        per_100k = elapsed * 100_000 / max(count, 1)
+        print(f"{name:<12} {count:>8} {elapsed:>10.3f} {peak / 1024 / 1024:>17.1f} {per_100k:>13.3f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
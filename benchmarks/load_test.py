@@ -0,0 +1,441 @@
+"""Test de charge : plusieurs processus simulent des commerciaux et gestionnaires simultanés.
+
+Chaque processus se connecte avec `authenticate_user`, puis enchaîne un mélange
+pondéré des opérations des commandes add-client, update-contract, add-event et
+des listes, sur une base Postgres locale ou un fichier SQLite en mode WAL.
+
+Usage :
+    python -m benchmarks.load_test --database-url sqlite:///loadtest.db --workers 50 --duration 60
+    python -m benchmarks.load_test --database-url postgresql://user:pw@localhost/crm_load --json resultats.json
+
+(ENCRYPTION_KEY doit être définie dans le .env ; la base est préparée au
+premier lancement : schéma, rôles, utilisateurs de test, clients et contrats.)
+
+Rapport : débit, percentiles de latence par opération, taux d'erreur (conflits
+de version, verrous expirés, interblocages) et attentes de verrous. Sous
+Postgres, les requêtes en attente de verrou sont relevées dans
+pg_stat_activity ; sous SQLite, le temps passé dans les écritures (où l'on
+attend le verrou d'écriture) est mesuré dans chaque processus.
+"""
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+import click
+import numpy as np
+
+
+PASSWORD = "LoadTest123!"
+EMAIL = "loadtest-{role}-{index}@example.com"
+DEFAULT_MIX = "add-client=2,update-contract=3,add-event=1,list-contracts=3,list-events=2,list-all=1"
+PERCENTILES = (50, 90, 99)
+LOCK_SAMPLE_SECONDS = 0.25
+# Délai maximal de démarrage des processus (import, connexion)
+STARTUP_TIMEOUT = 300
+
+
+def parse_mix(spec):
+    """ "add-client=2,list-all=1" -> {"add-client": 2.0, "list-all": 1.0}"""
+    mix = {}
+    for part in (p.strip() for p in spec.split(",") if p.strip()):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise click.BadParameter(f"Opération inconnue : {name} (parmi {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def classify(error):
+    """Catégorie d'erreur d'une opération"""
+    from sqlalchemy.orm.exc import StaleDataError
+    if isinstance(error, StaleDataError):
+        return "conflit_version"
+    message = str(error).lower()
+    if "deadlock" in message:
+        return "interblocage"
+    if "database is locked" in message or "lock timeout" in message or "lock_timeout" in message:
+        return "verrou_expiré"
+    return type(error).__name__
+
+
+# === Opérations : fonctions de crm/services.py appelées par les commandes CLI, sans saisie ===
+def op_add_client(session, user, rng):
+    from crm import services
+    services.create_client(session, user, f"Client {uuid.uuid4().hex[:8]}",
+                           f"{uuid.uuid4().hex}@loadtest.example.com", f"06{rng.randrange(10 ** 8):08d}", "LoadTest")
+    session.commit()
+    return True
+
+
+def op_update_contract(session, user, rng):
+    from crm import services
+    from crm.projections import contract_rows
+    scope = services.contract_scope(user)
+    contracts = list(contract_rows(session, *([scope] if scope is not None else [])))
+    if not contracts:
+        return False
+    try:
+        contract = services.editable_contract(session, user, rng.choice(contracts).id)
+    except ValueError:
+        return False
+    changes = services.contract_changes(amount_remaining=round(rng.uniform(0, contract.amount_total), 2),
+                                        status=rng.choice(["new", "pending", "signed"]))
+    services.apply_changes(session, contract, changes)
+    session.commit()
+    return True
+
+
+def op_add_event(session, user, rng):
+    from crm import services
+    from crm.cache import reference_cache
+    contracts = services.contracts_without_event(session, user)
+    if not contracts:
+        return False
+    support_users = reference_cache.users_with_role("support")
+    start = datetime.utcnow() + timedelta(days=rng.randint(1, 90))
+    services.create_event(
+        session, user, rng.choice(contracts).id,
+        start=start,
+        end=start + timedelta(hours=rng.randint(2, 48)),
+        support_contact=rng.choice(support_users).name if support_users else None,
+        location="Paris",
+        attendees=rng.randint(10, 500),
+        notes="Test de charge",
+    )
+    session.commit()
+    return True
+
+
+def op_list_contracts(session, user, rng):
+    from sqlalchemy import or_
+    from crm.models import Contract
+    from crm.projections import contract_rows
+    from crm.services import contract_scope
+    scope = contract_scope(user)
+    criteria = [or_(Contract.status != "signed", Contract.amount_remaining > 0)]
+    list(contract_rows(session, *criteria, *([scope] if scope is not None else [])))
+    return True
+
+
+def op_list_events(session, user, rng):
+    from crm.models import Event
+    from crm.projections import event_rows
+    list(event_rows(session, Event.support_contact.is_(None)))
+    return True
+
+
+def op_list_all(session, user, rng):
+    from sqlalchemy import select
+    from crm.models import Role
+    from crm.projections import client_rows, contract_rows, event_rows
+    list(client_rows(session))
+    list(contract_rows(session))
+    list(event_rows(session))
+    session.execute(select(Role.id, Role.name).order_by(Role.id)).all()
+    return True
+
+
+# Opération -> (fonction, rôles autorisés, comme @require_role)
+OPERATIONS = {
+    "add-client": (op_add_client, ("commercial",)),
+    "update-contract": (op_update_contract, ("gestion", "commercial")),
+    "add-event": (op_add_event, ("commercial",)),
+    "list-contracts": (op_list_contracts, ("gestion", "commercial", "support")),
+    "list-events": (op_list_events, ("gestion", "commercial", "support")),
+    "list-all": (op_list_all, ("gestion", "commercial", "support")),
+}
+
+
+# === Préparation de la base ===
+def prepare(commercials, managers, supports=3, clients_per_commercial=5, contracts_per_client=2):
+    """Schéma, rôles, utilisateurs de test et jeu de clients/contrats (rejouable)"""
+    from sqlalchemy import select
+    from crm import services
+    from crm.database import Base, engine
+    from crm.models import Role, User, ph
+    from crm.sharding import SessionLocal
+
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+    Base.metadata.create_all(engine)
+
+    session = SessionLocal()
+    roles = {}
+    for name in ("gestion", "commercial", "support"):
+        roles[name] = session.query(Role).filter_by(name=name).first() or Role(name=name)
+        session.add(roles[name])
+    session.commit()
+
+    hashed = ph.hash(PASSWORD)
+    accounts = [("commercial", i) for i in range(commercials)] + [("gestion", i) for i in range(managers)]
+    accounts += [("support", i) for i in range(supports)]
+    existing = set(session.execute(select(User.email)).scalars())
+    created = []
+    for role, index in accounts:
+        email = EMAIL.format(role=role, index=index)
+        if email in existing:
+            continue
+        user = User(employee_number=f"LT-{role[:3].upper()}-{index:04d}", name=f"Load {role} {index}",
+                    email=email, hashed_password=hashed, role=roles[role])
+        session.add(user)
+        if role == "commercial":
+            created.append(user)
+    session.commit()
+
+    # last_updated : horloge du serveur (valeur par défaut du modèle), comme en production
+    for user in created:
+        owner = {"name": user.name, "role": "commercial"}
+        for _ in range(clients_per_commercial):
+            client = services.create_client(session, owner, f"Client {uuid.uuid4().hex[:8]}",
+                                            f"{uuid.uuid4().hex}@loadtest.example.com", "0601020304", "LoadTest")
+            for _ in range(contracts_per_client):
+                services.create_contract(session, owner, client.id, 10000, 5000, "signed")
+    session.commit()
+    session.close()
+
+
+# === Processus de charge ===
+def _record(stats, name, elapsed_ms, write_ms, outcome):
+    entry = stats.setdefault(name, {"latencies": [], "write_ms": [], "errors": Counter(), "skipped": 0})
+    if outcome is None:
+        entry["latencies"].append(elapsed_ms)
+        entry["write_ms"].append(write_ms)
+    elif outcome == "vide":
+        entry["skipped"] += 1
+    else:
+        entry["errors"][outcome] += 1
+
+
+def _write_clock(engine):
+    """Temps passé dans les écritures de ce processus (attente du verrou d'écriture comprise)"""
+    from sqlalchemy import event
+    clock = {"ms": 0.0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["loadtest_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("loadtest_started", None)
+        if started is not None and statement.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+            clock["ms"] += (time.perf_counter() - started) * 1000
+
+    return clock
+
+
+def worker(index, role, mix, duration, think_time, seed, barrier, results):
+    from crm import auth
+    from crm.database import engine
+    from crm.sharding import SessionLocal
+
+    auth.TOKEN_FILE = os.path.join(tempfile.gettempdir(), f".token-loadtest-{os.getpid()}")
+    rng = random.Random(seed + index)
+    stats = {}
+    clock = _write_clock(engine)
+    user = None
+    started = time.perf_counter()
+    try:
+        token = auth.authenticate_user(EMAIL.format(role=role, index=index), PASSWORD)
+        user = auth.decode_token(token)
+        _record(stats, "login", (time.perf_counter() - started) * 1000, 0.0, None)
+    except Exception as e:
+        _record(stats, "login", (time.perf_counter() - started) * 1000, 0.0, classify(e))
+    finally:
+        if os.path.exists(auth.TOKEN_FILE):
+            os.remove(auth.TOKEN_FILE)
+    barrier.wait()
+
+    allowed = [(name, weight) for name, weight in mix.items() if user and user["role"] in OPERATIONS[name][1]]
+    deadline = time.monotonic() + duration
+    while allowed and time.monotonic() < deadline:
+        name = rng.choices([n for n, _ in allowed], [w for _, w in allowed])[0]
+        session = SessionLocal()
+        clock["ms"] = 0.0
+        started = time.perf_counter()
+        try:
+            outcome = None if OPERATIONS[name][0](session, user, rng) else "vide"
+        except Exception as e:
+            session.rollback()
+            outcome = classify(e)
+        finally:
+            session.close()
+        _record(stats, name, (time.perf_counter() - started) * 1000, clock["ms"], outcome)
+        if think_time:
+            time.sleep(rng.expovariate(1 / think_time))
+    results.put((index, role, stats))
+
+
+class LockMonitor(threading.Thread):
+    """Relève périodiquement les sessions Postgres en attente de verrou et leurs requêtes"""
+
+    QUERY = (
+        "SELECT left(regexp_replace(query, '\\s+', ' ', 'g'), 120) AS query, count(*) "
+        "FROM pg_stat_activity WHERE wait_event_type = 'Lock' AND datname = current_database() "
+        "GROUP BY 1"
+    )
+
+    def __init__(self, engine, interval=LOCK_SAMPLE_SECONDS):
+        super().__init__(name="lock-monitor", daemon=True)
+        self.engine = engine
+        self.interval = interval
+        self.samples = []
+        self.statements = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        from sqlalchemy import text
+        with self.engine.connect() as connection:
+            while not self._stop_event.wait(self.interval):
+                rows = connection.execute(text(self.QUERY)).all()
+                connection.rollback()
+                self.samples.append(sum(count for _, count in rows))
+                for query, count in rows:
+                    self.statements[query] += count
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def report(self):
+        samples = np.array(self.samples or [0])
+        return {
+            "samples": len(self.samples),
+            "waiting_mean": round(float(samples.mean()), 2),
+            "waiting_max": int(samples.max()),
+            "share_with_waits": round(float((samples > 0).mean()), 4),
+            "hotspots": [{"query": q, "samples": n} for q, n in self.statements.most_common(5)],
+        }
+
+
+def summarize(worker_stats, wall_seconds):
+    """Agrège les mesures des processus : débit, percentiles, erreurs"""
+    merged = {}
+    for stats in worker_stats:
+        for name, entry in stats.items():
+            target = merged.setdefault(name, {"latencies": [], "write_ms": [], "errors": Counter(), "skipped": 0})
+            target["latencies"] += entry["latencies"]
+            target["write_ms"] += entry["write_ms"]
+            target["errors"].update(entry["errors"])
+            target["skipped"] += entry["skipped"]
+
+    operations = {}
+    for name, entry in sorted(merged.items()):
+        latencies = np.array(entry["latencies"] or [np.nan])
+        writes = np.array(entry["write_ms"] or [np.nan])
+        ok = len(entry["latencies"])
+        errors = sum(entry["errors"].values())
+        operations[name] = {
+            "ok": ok,
+            "errors": dict(entry["errors"]),
+            "skipped": entry["skipped"],
+            "error_rate": round(errors / max(ok + errors, 1), 4),
+            "throughput_per_s": round(ok / wall_seconds, 2) if wall_seconds else None,
+            "latency_ms": {f"p{p}": _round(np.nanpercentile(latencies, p)) for p in PERCENTILES},
+            "write_ms": {f"p{p}": _round(np.nanpercentile(writes, p)) for p in PERCENTILES},
+        }
+    total_ok = sum(op["ok"] for name, op in operations.items() if name != "login")
+    total_errors = sum(sum(op["errors"].values()) for name, op in operations.items() if name != "login")
+    return {
+        "wall_seconds": round(wall_seconds, 2),
+        "throughput_per_s": round(total_ok / wall_seconds, 2) if wall_seconds else None,
+        "error_rate": round(total_errors / max(total_ok + total_errors, 1), 4),
+        "operations": operations,
+    }
+
+
+def _round(value):
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+def format_summary(summary):
+    lines = [
+        f"\n📊 {summary['wall_seconds']} s | {summary['throughput_per_s']} op/s | "
+        f"erreurs : {summary['error_rate']:.2%}",
+        f"{'Opération':<16} {'OK':>7} {'Err.':>6} {'Vide':>6} {'op/s':>8} "
+        + " ".join(f"{'p' + str(p) + ' ms':>9}" for p in PERCENTILES) + f" {'écrit. p90':>11}",
+    ]
+    for name, op in summary["operations"].items():
+        latency = " ".join(f"{op['latency_ms'][f'p{p}'] if op['latency_ms'][f'p{p}'] is not None else '-':>9}"
+                           for p in PERCENTILES)
+        write = op["write_ms"]["p90"] if op["write_ms"]["p90"] is not None else "-"
+        lines.append(f"{name:<16} {op['ok']:>7} {sum(op['errors'].values()):>6} {op['skipped']:>6} "
+                     f"{op['throughput_per_s'] or 0:>8} {latency} {write:>11}")
+        for error, count in op["errors"].items():
+            lines.append(f"{'':<16}   ↳ {error} : {count}")
+    locks = summary.get("locks")
+    if locks:
+        lines.append(f"\n🔒 Attentes de verrou : {locks['share_with_waits']:.0%} des relevés, "
+                     f"moyenne {locks['waiting_mean']}, max {locks['waiting_max']} session(s)")
+        lines += [f"    {h['samples']:>6}  {h['query']}" for h in locks["hotspots"]]
+    return "\n".join(lines)
+
+
+@click.command()
+@click.option("--database-url", required=True, help="Base de test (postgresql://... ou sqlite:///fichier.db)")
+@click.option("--workers", default=50, show_default=True, help="Nombre de processus (utilisateurs simultanés)")
+@click.option("--managers", default=10, show_default=True, help="Dont gestionnaires (les autres sont commerciaux)")
+@click.option("--duration", default=60.0, show_default=True, help="Durée de la charge (secondes)")
+@click.option("--think-time", default=0.0, show_default=True, help="Pause moyenne entre deux opérations (s)")
+@click.option("--mix", default=DEFAULT_MIX, show_default=True, help="Pondération des opérations")
+@click.option("--seed", default=0, help="Graine des tirages aléatoires")
+@click.option("--json", "json_path", type=click.Path(dir_okay=False), help="Écrire le rapport en JSON")
+def main(database_url, workers, managers, duration, think_time, mix, seed, json_path):
+    """Lance la charge et affiche le rapport"""
+    if database_url.startswith("sqlite") and database_url.rstrip("/") in ("sqlite:", "sqlite:/", "sqlite:/:memory:"):
+        raise click.BadParameter("SQLite en mémoire n'est pas partagé entre processus : indiquez un fichier.")
+    mix = parse_mix(mix)
+    managers = min(managers, workers)
+    # Lu à l'import de crm.database, ici et dans les processus lancés
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("SLOW_QUERY_LOG", "")
+
+    click.echo("🛠️ Préparation de la base...")
+    prepare(commercials=workers - managers, managers=managers)
+
+    from crm.database import engine
+    monitor = LockMonitor(engine) if engine.dialect.name == "postgresql" else None
+
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(workers + 1)
+    results = ctx.Queue()
+    roles = ["gestion"] * managers + ["commercial"] * (workers - managers)
+    indexes = list(range(managers)) + list(range(workers - managers))
+    processes = [
+        ctx.Process(target=worker, args=(i, role, mix, duration, think_time, seed, barrier, results))
+        for i, role in zip(indexes, roles)
+    ]
+    for process in processes:
+        process.start()
+    click.echo(f"🚀 {workers} utilisateur(s) ({managers} gestion) pendant {duration} s...")
+    barrier.wait(timeout=STARTUP_TIMEOUT)
+    started = time.perf_counter()
+    if monitor:
+        monitor.start()
+
+    collected = [results.get(timeout=duration + STARTUP_TIMEOUT) for _ in processes]
+    wall = time.perf_counter() - started
+    for process in processes:
+        process.join()
+    if monitor:
+        monitor.stop()
+
+    summary = summarize([stats for _, _, stats in collected], wall)
+    summary.update(workers=workers, managers=managers, dialect=engine.dialect.name,
+                   locks=monitor.report() if monitor else None)
+    click.echo(format_summary(summary))
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        click.echo(f"✅ Rapport écrit dans {json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,38 @@
-from crm.database import SessionLocal
-from crm.models import User, Client, Role, Event, Contract
+import sys
+from crm.sharding import SessionLocal
+from crm.retention import run_retention, RetentionSettingsChanged, RETENTION_DAYS
+from crm.audit import audit
 
+# Usage : python cleanup_base.py [jours de rétention] [--include-unpaid]
+include_unpaid = "--include-unpaid" in sys.argv
+args = [arg for arg in sys.argv[1:] if arg != "--include-unpaid"]
+days = int(args[0]) if args else RETENTION_DAYS
+
+
+def progress(checkpoint):
+    print(f"  … contrat #{checkpoint.last_contract_id} | "
+          f"{checkpoint.contracts_archived} contrats, {checkpoint.events_archived} événements archivés")
+
+
+# Même fabrique que la CLI : sous SHARD_URLS, l'archivage parcourt tous les shards
 session = SessionLocal()
 
 try:
-    deleted_events = session.query(Event).filter(Event.id > 1000).delete(synchronize_session=False)
-    deleted_contracts = session.query(Contract).filter(Contract.id > 1000).delete(synchronize_session=False)
-    deleted_users = session.query(User).filter(User.id > 1000).delete(synchronize_session=False)
-    deleted_clients = session.query(Client).filter(Client.id > 1000).delete(synchronize_session=False)
-    deleted_roles = session.query(Role).filter(Role.id > 3).delete(synchronize_session=False)
+    checkpoint = run_retention(session, days=days, include_unpaid=include_unpaid, progress=progress)
+    audit("cleanup_base", "retention.run", None, None, cutoff=checkpoint.cutoff,
+          contracts=checkpoint.contracts_archived, events=checkpoint.events_archived)
 
-    session.commit()
+    print(f"✅ Archivage effectué (avant le {checkpoint.cutoff:%Y-%m-%d}) :\n"
+          f"  - {checkpoint.contracts_archived} contrats archivés\n"
+          f"  - {checkpoint.events_archived} événements archivés")
 
-    print(f"✅ Nettoyage effectué :\n"
-          f"  - {deleted_contracts} contrats supprimés\n"
-          f"  - {deleted_events} événements supprimés\n"
-          f"  - {deleted_users} utilisateurs supprimés\n"
-          f"  - {deleted_clients} clients supprimés\n"
-          f"  - {deleted_roles} rôles supprimés")
+except RetentionSettingsChanged as e:
+    session.rollback()
+    print(f"❌ {e} (commande `archive --restart`)")
 
 except Exception as e:
     session.rollback()
-    print(f"❌ Erreur pendant la suppression : {e}")
+    print(f"❌ Erreur pendant l'archivage (relancer pour reprendre) : {e}")
 
 finally:
     session.close()
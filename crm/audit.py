@@ -0,0 +1,212 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+import click
+import sentry_sdk
+from sqlalchemy import event, insert
+from .database import engine
+from .models import AuditLog
+
+
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", 200))
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", 10000))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", 1.0))
+# Base indisponible : nouvelles tentatives, puis entrées conservées dans un fichier local
+AUDIT_RETRIES = int(os.getenv("AUDIT_RETRIES", 3))
+AUDIT_SPOOL_FILE = os.getenv("AUDIT_SPOOL_FILE", ".audit_spool.jsonl")
+
+_STOP = object()
+
+
+class AuditWriter:
+    """Écrit le journal d'audit en tâche de fond, par lots d'INSERT.
+
+    Les actions utilisateur ne font que déposer une entrée dans une file bornée.
+    Si la file est pleine (base lente ou indisponible), l'appelant attend au plus
+    `put_timeout` secondes puis écrit lui-même son entrée : on ralentit plutôt
+    que de perdre la trace d'audit.
+
+    Un lot refusé par la base est retenté `retries` fois, puis ajouté au fichier
+    `spool_path` ; le fichier est rejoué à la première écriture réussie (y compris
+    par un autre processus). Les entrées non écrites sont signalées à la fermeture.
+    """
+
+    def __init__(self, bind, batch_size=AUDIT_BATCH_SIZE, max_queue=AUDIT_QUEUE_SIZE,
+                 flush_interval=AUDIT_FLUSH_INTERVAL, put_timeout=0.5, retries=AUDIT_RETRIES,
+                 retry_delay=0.2, spool_path=AUDIT_SPOOL_FILE):
+        self.bind = bind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.spool_path = spool_path
+        self.spooled = 0
+        self.lost = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    def log(self, actor, action, entity=None, entity_id=None, **details):
+        """Ajoute une entrée au journal sans attendre l'écriture en base"""
+        entry = {
+            "created_at": datetime.utcnow(),
+            "actor": actor,
+            "action": action,
+            "entity": entity,
+            "entity_id": entity_id,
+            "details": json.dumps(details, default=str, ensure_ascii=False) if details else None,
+        }
+        self.start()
+        try:
+            self._queue.put(entry, timeout=self.put_timeout)
+        except queue.Full:
+            self._write([entry])
+
+    def flush(self):
+        """Attend que toutes les entrées en file soient écrites"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def close(self):
+        """Vide la file, arrête le thread d'écriture et signale les entrées non écrites en base"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        if self.spooled:
+            click.echo(f"⚠️ Journal d'audit : {self.spooled} entrée(s) non écrite(s) en base, conservée(s) dans "
+                       f"{self.spool_path} (rejouée(s) à la prochaine écriture réussie)", err=True)
+        if self.lost:
+            click.echo(f"❌ Journal d'audit : {self.lost} entrée(s) perdue(s) (base et fichier local indisponibles)",
+                       err=True)
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(entry is _STOP for entry in batch)
+            entries = [entry for entry in batch if entry is not _STOP]
+            if entries:
+                self._write(entries)
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _insert(self, entries):
+        with self.bind.begin() as connection:
+            connection.execute(insert(AuditLog), entries)
+
+    def _write(self, entries):
+        for attempt in range(self.retries + 1):
+            try:
+                self._insert(entries)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    sentry_sdk.capture_exception(e)
+                    if self._spool(entries):
+                        self.spooled += len(entries)
+                    else:
+                        self.lost += len(entries)
+                    return
+                time.sleep(self.retry_delay * 2 ** attempt)
+        self._replay_spool()
+
+    def _spool(self, entries):
+        try:
+            with self._spool_lock, open(self.spool_path, "a") as f:
+                for entry in entries:
+                    f.write(json.dumps({**entry, "created_at": entry["created_at"].isoformat()},
+                                       ensure_ascii=False) + "\n")
+            return True
+        except OSError as e:
+            sentry_sdk.capture_exception(e)
+            return False
+
+    def _replay_spool(self):
+        """Réécrit en base les entrées du fichier local ; le fichier est d'abord renommé,
+        pour qu'un seul processus le rejoue"""
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return
+        claimed = f"{self.spool_path}.{os.getpid()}"
+        try:
+            with self._spool_lock:
+                os.replace(self.spool_path, claimed)
+            with open(claimed, "r") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError):
+            return
+        for entry in entries:
+            entry["created_at"] = datetime.fromisoformat(entry["created_at"])
+        try:
+            if entries:
+                self._insert(entries)
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+            if not self._spool(entries):
+                return
+        else:
+            self.spooled = max(0, self.spooled - len(entries))
+        os.remove(claimed)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Retourne l'écrivain d'audit du processus (vidé automatiquement à la sortie)"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AuditWriter(engine)
+            atexit.register(_writer.close)
+    return _writer
+
+
+def audit(actor, action, entity=None, entity_id=None, **details):
+    """Journalise une action sensible"""
+    get_writer().log(actor, action, entity=entity, entity_id=entity_id, **details)
+
+
+def query_audit_log(session, actor=None, entity=None, entity_id=None, since=None, until=None, limit=100):
+    """Recherche dans le journal d'audit, du plus récent au plus ancien"""
+    query = session.query(AuditLog)
+    if actor is not None:
+        query = query.filter(AuditLog.actor == actor)
+    if entity is not None:
+        query = query.filter(AuditLog.entity == entity)
+    if entity_id is not None:
+        query = query.filter(AuditLog.entity_id == entity_id)
+    if since is not None:
+        query = query.filter(AuditLog.created_at >= since)
+    if until is not None:
+        query = query.filter(AuditLog.created_at < until)
+    return query.order_by(AuditLog.created_at.desc(), AuditLog.id.desc()).limit(limit).all()
+
+
+# Le journal est en ajout seul : l'ORM refuse de modifier ou supprimer une entrée
+@event.listens_for(AuditLog, "before_update")
+@event.listens_for(AuditLog, "before_delete")
+def _append_only(mapper, connection, target):
+    raise RuntimeError("Le journal d'audit ne peut pas être modifié.")
@@ -4,6 +4,8 @@ from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from argon2 import PasswordHasher
 from crm.database import SessionLocal
+from crm.sessions import session_scope
+from crm.metrics import count_crypto
 from crm.models import User
 from sqlalchemy.orm import joinedload
 import functools
@@ -23,11 +25,13 @@ fernet = Fernet(ENCRYPTION_KEY.encode())
 
 def encrypt_data(plain_text: str) -> str:
     """Chiffre une chaîne de caractères"""
+    count_crypto("encrypt")
     return fernet.encrypt(plain_text.encode()).decode()
 
 
 def decrypt_data(cipher_text: str) -> str:
     """Déchiffre une chaîne de caractères"""
+    count_crypto("decrypt")
     return fernet.decrypt(cipher_text.encode()).decode()
 
 
@@ -41,28 +45,22 @@ TOKEN_FILE = ".token"
 
 def authenticate_user(email: str, password: str):
     """Authentifie l'utilisateur et génère un token JWT"""
-    session = SessionLocal()
-    user = session.query(User).options(joinedload(User.role)).filter_by(email=email).first()
-
-    if not user:
-        session.close()
-        raise click.ClickException("❌ Utilisateur non trouvé")
-
-    try:
-        ph.verify(user.hashed_password, password)
-    except Exception:
-        session.close()
-        raise click.ClickException("❌ Mot de passe incorrect")
-
-    payload = {
-        "sub": str(user.id),
-        "name": user.name,
-        "role": user.role.name if user.role else None,
-        "department": user.role.name if user.role else None,
-        "exp": datetime.utcnow() + timedelta(minutes=JWT_EXPIRATION_MINUTES)
-    }
-
-    session.close()
+    with session_scope(SessionLocal) as session:
+        user = session.query(User).options(joinedload(User.role)).filter_by(email=email).first()
+
+        if not user:
+            raise click.ClickException("❌ Utilisateur non trouvé")
+
+        if not user.verify_password(password):
+            raise click.ClickException("❌ Mot de passe incorrect")
+
+        payload = {
+            "sub": str(user.id),
+            "name": user.name,
+            "role": user.role.name if user.role else None,
+            "department": user.role.name if user.role else None,
+            "exp": datetime.utcnow() + timedelta(minutes=JWT_EXPIRATION_MINUTES)
+        }
 
     token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGO)
     save_token(token)
@@ -0,0 +1,95 @@
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.engine import Engine
+from .models import BackfillCheckpoint
+
+
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", 1000))
+# Débit maximum (lignes par seconde, 0 = sans limite)
+BACKFILL_ROWS_PER_SECOND = float(os.getenv("BACKFILL_ROWS_PER_SECOND", 5000))
+
+checkpoints = BackfillCheckpoint.__table__
+
+
+@contextmanager
+def _chunk(bind):
+    """Transaction d'un lot.
+
+    Engine : une connexion et une transaction par lot. Connexion en AUTOCOMMIT
+    (bloc `op.get_context().autocommit_block()` d'Alembic) : chaque instruction
+    est déjà validée. Autre connexion : commit à la fin du lot.
+    """
+    if isinstance(bind, Engine):
+        with bind.begin() as connection:
+            yield connection
+        return
+    yield bind
+    if bind.get_execution_options().get("isolation_level") != "AUTOCOMMIT" and bind.in_transaction():
+        bind.commit()
+
+
+def _checkpoint(connection, name, table_name):
+    row = connection.execute(select(checkpoints).where(checkpoints.c.name == name)).first()
+    if row is None:
+        now = datetime.utcnow()
+        connection.execute(insert(checkpoints).values(name=name, table_name=table_name, last_key=0, rows_done=0,
+                                                      started_at=now, updated_at=now))
+        row = connection.execute(select(checkpoints).where(checkpoints.c.name == name)).first()
+    return row
+
+
+def run_backfill(bind, name, table, values=None, apply=None, where=(), key="id",
+                 batch_size=BACKFILL_BATCH_SIZE, rows_per_second=BACKFILL_ROWS_PER_SECOND,
+                 max_batches=None, progress=None, repeat=False):
+    """Reprise de données par lots ordonnés sur la clé, un commit par lot.
+
+    - `values` : colonnes à mettre à jour (UPDATE ... WHERE key IN (lot)),
+      ou `apply(connection, keys)` pour un traitement libre ;
+    - `where` : critères des lignes à traiter ;
+    - l'avancement (dernière clé traitée) est enregistré dans backfill_checkpoints
+      sous le nom `name` : une exécution interrompue reprend au lot suivant ;
+    - le débit est limité à `rows_per_second` pour ménager la base en production.
+
+    Le traitement doit être idempotent (un lot peut être rejoué après une coupure).
+    `repeat` : une reprise terminée repart du début (traitements périodiques).
+    Retourne le nombre de lignes traitées au total.
+    """
+    if (values is None) == (apply is None):
+        raise ValueError("Indiquez soit `values`, soit `apply`.")
+    key_column = table.c[key]
+    with _chunk(bind) as connection:
+        state = _checkpoint(connection, name, table.name)
+        if state.finished_at is not None and repeat:
+            connection.execute(delete(checkpoints).where(checkpoints.c.name == name))
+            state = _checkpoint(connection, name, table.name)
+    if state.finished_at is not None:
+        return state.rows_done
+    last_key, rows_done, batches = state.last_key, state.rows_done, 0
+
+    while max_batches is None or batches < max_batches:
+        started = time.perf_counter()
+        with _chunk(bind) as connection:
+            keys = connection.execute(
+                select(key_column).where(key_column > last_key, *where).order_by(key_column).limit(batch_size)
+            ).scalars().all()
+            now = datetime.utcnow()
+            if not keys:
+                connection.execute(update(checkpoints).where(checkpoints.c.name == name)
+                                   .values(finished_at=now, updated_at=now))
+                break
+            if values is not None:
+                connection.execute(update(table).where(key_column.in_(keys)).values(**values))
+            else:
+                apply(connection, keys)
+            last_key, rows_done = keys[-1], rows_done + len(keys)
+            connection.execute(update(checkpoints).where(checkpoints.c.name == name)
+                               .values(last_key=last_key, rows_done=rows_done, updated_at=now))
+        batches += 1
+        if progress:
+            progress(name, last_key, rows_done)
+        if rows_per_second:
+            time.sleep(max(0.0, len(keys) / rows_per_second - (time.perf_counter() - started)))
+    return rows_done
@@ -0,0 +1,233 @@
+import json
+import os
+from datetime import datetime
+from sqlalchemy.exc import SQLAlchemyError
+from . import services
+from .audit import audit
+
+
+# Opérations par transaction (chaque opération a son propre savepoint)
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 500))
+
+
+class OperationError(Exception):
+    """Opération refusée ou invalide : annulée seule, le lot continue"""
+
+
+# Nom -> (fonction, rôles autorisés, comme @require_role)
+OPERATIONS = {}
+
+
+def operation(name, roles):
+    def decorator(func):
+        OPERATIONS[name] = (func, tuple(roles))
+        return func
+    return decorator
+
+
+def read_operations(lines):
+    """Opérations d'un fichier JSONL : (numéro de ligne, dict) ; lignes vides et # ignorées"""
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            op = json.loads(line)
+        except ValueError as e:
+            op = {"op": None, "_invalid": f"JSON invalide : {e}"}
+        else:
+            if not isinstance(op, dict):
+                op = {"op": None, "_invalid": f"Objet JSON attendu, reçu : {type(op).__name__}"}
+        yield line_no, op
+
+
+def _field(data, name, required=True):
+    value = data.get(name)
+    if value is None or value == "":
+        if required:
+            raise OperationError(f"Champ manquant : {name}")
+        return None
+    return value
+
+
+def _date(data, name, required=True):
+    value = _field(data, name, required=required)
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        raise OperationError(f"Date invalide ({name}) : {value}")
+
+
+# === Opérations : mêmes fonctions (crm/services.py) que les commandes interactives ===
+@operation("create_client", ["commercial"])
+def create_client(session, user, data):
+    client = services.create_client(session, user, _field(data, "name"), _field(data, "email"),
+                                    _field(data, "phone"), _field(data, "company"))
+    return {"id": client.id}
+
+
+@operation("update_client", ["commercial"])
+def update_client(session, user, data):
+    client = services.own_client(session, user, _field(data, "id"))
+    entered = [_field(data, field, required=False) for field in ("name", "email", "phone", "company")]
+    changes = services.client_changes(client, *entered)
+    services.apply_changes(session, client, changes)
+    return {"id": client.id}
+
+
+@operation("create_contract", ["gestion"])
+def create_contract(session, user, data):
+    contract = services.create_contract(session, user, _field(data, "client_id"), _field(data, "amount_total"),
+                                        _field(data, "amount_remaining"), _field(data, "status"))
+    return {"id": contract.id, "audit": services.contract_audit("contract.create", contract)}
+
+
+@operation("update_contract", ["gestion", "commercial"])
+def update_contract(session, user, data):
+    contract = services.editable_contract(session, user, _field(data, "id"))
+    entered = [_field(data, field, required=False) for field in ("amount_total", "amount_remaining", "status")]
+    changes = services.contract_changes(*entered)
+    services.apply_changes(session, contract, changes)
+    return {"id": contract.id, "audit": services.contract_audit("contract.update", contract)}
+
+
+@operation("create_event", ["commercial"])
+def create_event(session, user, data):
+    event = services.create_event(
+        session, user, _field(data, "contract_id"),
+        start=_date(data, "start"),
+        end=_date(data, "end"),
+        support_contact=services.support_name(data.get("support_id"), data.get("support_name")),
+        location=data.get("location"),
+        attendees=_field(data, "attendees", required=False),
+        notes=data.get("notes"),
+    )
+    return {"id": event.id}
+
+
+@operation("assign_support", ["gestion"])
+def assign_support(session, user, data):
+    event = services.assign_support(session, user, _field(data, "event_id"),
+                                    data.get("support_id"), data.get("support_name"))
+    return {"id": event.id, "support_contact": event.support_contact}
+
+
+@operation("update_event", ["gestion", "support"])
+def update_event(session, user, data):
+    event = services.editable_event(session, user, _field(data, "id"))
+    changes = services.event_changes(
+        event,
+        start=_date(data, "start", required=False),
+        end=_date(data, "end", required=False),
+        location=data.get("location"),
+        attendees=_field(data, "attendees", required=False),
+        notes=data.get("notes"),
+    )
+    services.apply_changes(session, event, changes)
+    return {"id": event.id}
+
+
+# === Exécution ===
+def _begin(session):
+    """pysqlite n'ouvre la transaction qu'à la première écriture : un SAVEPOINT émis avant
+    deviendrait la transaction elle-même (son RELEASE validerait tout). On l'ouvre explicitement."""
+    if session.bind is None or session.bind.dialect.name != "sqlite":
+        return
+    connection = session.connection()
+    if not connection.connection.driver_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN")
+
+
+def _resolve(data, refs):
+    """Les valeurs "$nom" désignent l'ID créé par une opération précédente ("ref": "nom") ;
+    une référence créée dans un lot annulé vaut None et n'est plus utilisable"""
+    resolved = {}
+    for key, value in data.items():
+        if isinstance(value, str) and value.startswith("$"):
+            if value[1:] not in refs:
+                raise OperationError(f"Référence inconnue : {value}")
+            if refs[value[1:]] is None:
+                raise OperationError(f"Référence annulée : {value} (lot non validé)")
+            value = refs[value[1:]]
+        resolved[key] = value
+    return resolved
+
+
+def execute(session, user, op, refs):
+    """Exécute une opération dans un savepoint ; retourne son résultat ou lève OperationError"""
+    if op.get("_invalid"):
+        raise OperationError(op["_invalid"])
+    name = op.get("op")
+    if name not in OPERATIONS:
+        raise OperationError(f"Opération inconnue : {name}")
+    func, roles = OPERATIONS[name]
+    if user.get('role') not in roles:
+        raise OperationError(f"⛔ Accès refusé pour le rôle : {user.get('role')}")
+    data = _resolve({k: v for k, v in op.items() if k not in ("op", "ref")}, refs)
+    _begin(session)
+    try:
+        with session.begin_nested():
+            return func(session, user, data)
+    except (ValueError, TypeError, SQLAlchemyError) as e:
+        raise OperationError(str(e).splitlines()[0])
+
+
+def run_batch(session, user, operations, batch_size=BATCH_SIZE, stop_on_error=False, dry_run=False):
+    """Exécute les opérations par transactions de `batch_size`, avec un savepoint par opération.
+
+    Une opération en erreur est annulée seule ; les autres opérations du lot
+    sont validées ensemble. Les résultats (un dict par opération, dans l'ordre)
+    sont produits après la validation de leur lot. `dry_run` annule chaque lot.
+    Les références ("ref") d'un lot annulé ne désignent plus rien : sur SQLite, leurs
+    ID peuvent être réattribués à d'autres lignes.
+    """
+    refs, pending, audits = {}, [], []
+    stopped = False
+
+    def finish():
+        rolled_back = dry_run
+        if dry_run:
+            session.rollback()
+        else:
+            try:
+                session.commit()
+            except SQLAlchemyError as e:
+                session.rollback()
+                rolled_back = True
+                for result in pending:
+                    if result["status"] == "ok":
+                        result.update(status="error", error=f"Lot annulé : {str(e).splitlines()[0]}")
+        if rolled_back:
+            audits.clear()
+            for result in pending:
+                if result.get("ref"):
+                    refs[result["ref"]] = None
+        for action, entity, entity_id, details in audits:
+            audit(user.get('name'), action, entity, entity_id, **details)
+        done = list(pending)
+        pending.clear()
+        audits.clear()
+        return done
+
+    for line_no, op in operations:
+        result = {"line": line_no, "op": op.get("op")}
+        try:
+            outcome = execute(session, user, op, refs) or {}
+            entry = outcome.pop("audit", None)
+            if entry:
+                audits.append(entry)
+            if op.get("ref") and "id" in outcome:
+                refs[op["ref"]] = outcome["id"]
+                result["ref"] = op["ref"]
+            result.update(status="ok", **outcome)
+        except OperationError as e:
+            result.update(status="error", error=str(e))
+            stopped = stop_on_error
+        pending.append(result)
+        if len(pending) >= batch_size or stopped:
+            yield from finish()
+        if stopped:
+            break
+    yield from finish()
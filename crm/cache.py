@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+import weakref
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import joinedload
+from .database import SessionLocal
+from .models import ReferenceVersion, Role, User
+
+
+# Délai pendant lequel le cache est utilisé sans revérifier les versions en base (en secondes)
+CACHE_REVALIDATE_SECONDS = float(os.getenv("CACHE_REVALIDATE_SECONDS", 5))
+
+# Caches du processus, invalidés à chaque écriture locale sur Role/User
+_caches = weakref.WeakSet()
+
+
+class ReferenceCache:
+    """Cache des données de référence (rôles, utilisateurs par rôle) pour le processus.
+
+    Chaque écriture sur Role/User incrémente un numéro de version en base
+    (table reference_versions). Le cache ne recharge ses données que si ces
+    versions ont changé, et ne relit les versions qu'au plus toutes les
+    `revalidate_seconds` secondes : une simple lecture de clé primaire.
+    """
+
+    def __init__(self, session_factory=SessionLocal, revalidate_seconds=CACHE_REVALIDATE_SECONDS):
+        self.session_factory = session_factory
+        self.revalidate_seconds = revalidate_seconds
+        self.hits = 0
+        self.misses = 0
+        self._versions = None
+        self._checked_at = None
+        self._roles = {}
+        self._users_by_role = {}
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def invalidate(self):
+        """Force la revalidation à la prochaine lecture"""
+        self._checked_at = None
+
+    def _revalidate(self):
+        if self._checked_at is not None and time.monotonic() - self._checked_at < self.revalidate_seconds:
+            return
+        with self._lock:
+            session = self.session_factory()
+            try:
+                versions = dict(session.execute(select(ReferenceVersion.name, ReferenceVersion.version)).all())
+                if versions != self._versions:
+                    roles = session.query(Role).all()
+                    users = session.query(User).options(joinedload(User.role)).all()
+                    self._roles = {r.name: r for r in roles}
+                    users_by_role = {}
+                    for u in users:
+                        users_by_role.setdefault(u.role.name if u.role else None, []).append(u)
+                    self._users_by_role = users_by_role
+                    self._versions = versions
+            finally:
+                session.close()
+            self._checked_at = time.monotonic()
+
+    def roles(self):
+        """Liste des rôles (objets détachés, en lecture seule)"""
+        self._revalidate()
+        return sorted(self._roles.values(), key=lambda r: r.id)
+
+    def role(self, session, name):
+        """Rôle par son nom, rattaché à `session` sans requête SQL"""
+        self._revalidate()
+        role = self._roles.get(name)
+        if role is None:
+            # Les absences ne sont pas mises en cache : on interroge la base
+            self.misses += 1
+            return session.query(Role).filter_by(name=name).first()
+        self.hits += 1
+        return session.merge(role, load=False)
+
+    def users_with_role(self, role_name):
+        """Utilisateurs d'un rôle (objets détachés, en lecture seule)"""
+        self._revalidate()
+        self.hits += 1
+        return list(self._users_by_role.get(role_name, []))
+
+
+reference_cache = ReferenceCache()
+
+
+def bump_version(connection, name):
+    """Incrémente la version d'une donnée de référence dans la transaction en cours"""
+    result = connection.execute(
+        update(ReferenceVersion)
+        .where(ReferenceVersion.name == name)
+        .values(version=ReferenceVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(ReferenceVersion).values(name=name, version=1))
+
+
+@event.listens_for(Role, "after_insert")
+@event.listens_for(Role, "after_update")
+@event.listens_for(Role, "after_delete")
+def _role_changed(mapper, connection, target):
+    bump_version(connection, "roles")
+    for cache in list(_caches):
+        cache.invalidate()
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    bump_version(connection, "users")
+    for cache in list(_caches):
+        cache.invalidate()
@@ -0,0 +1,121 @@
+from datetime import datetime
+from sqlalchemy import event, func, inspect, insert, select
+from sqlalchemy.orm import object_session
+from .database import directory_connection
+from .models import ChangeLog, Client, Contract, Event
+
+
+# Entités suivies et leur table
+TRACKED = {"client": Client, "contract": Contract, "event": Event}
+ENTITY_NAMES = {model: entity for entity, model in TRACKED.items()}
+CHANGE_CHUNK_SIZE = 1000
+# Verrou consultatif (PostgreSQL) qui ordonne les numéros de séquence comme les commits
+CHANGE_LOG_LOCK_KEY = 0x63686C67
+
+
+def _lock_sequence(connection):
+    """Sous PostgreSQL, une séquence est attribuée à l'INSERT mais visible au COMMIT : sans
+    précaution, une transaction lente peut valider le n° 10 après qu'un lecteur a déjà
+    avancé son curseur au n° 11. Le verrou, pris avant l'attribution et rendu au commit,
+    garantit qu'un numéro n'apparaît jamais derrière un numéro déjà visible.
+
+    SQLite n'a qu'un écrivain à la fois : l'ordre est déjà celui des commits.
+    """
+    if connection.dialect.name == "postgresql":
+        connection.execute(select(func.pg_advisory_xact_lock(CHANGE_LOG_LOCK_KEY)))
+
+
+def record_changes(connection, entity, ids, operation):
+    """Enregistre dans change_log les écritures faites hors ORM (UPDATE/DELETE en masse).
+
+    `connection` est celle de la base principale (`database.directory_connection(session)`) :
+    sous sharding, le flux et sa séquence restent uniques pour tous les shards.
+    """
+    now = datetime.utcnow()
+    rows = [{"changed_at": now, "entity": entity, "entity_id": entity_id, "operation": operation}
+            for entity_id in ids]
+    if rows:
+        _lock_sequence(connection)
+        connection.execute(insert(ChangeLog), rows)
+
+
+def changes_since(session, cursor=0, limit=None, entities=None):
+    """Itère, dans l'ordre de la séquence, sur les modifications postérieures au curseur.
+
+    Chaque modification est accompagnée de l'état actuel de la ligne (None si
+    elle a été supprimée). Les données chiffrées sont renvoyées telles quelles.
+    Le coût dépend du nombre de modifications, pas de la taille des tables.
+
+    Garantie : les numéros visibles sont attribués dans l'ordre des commits (voir
+    `_lock_sequence`), donc une modification validée après une lecture a toujours un
+    numéro supérieur au dernier curseur renvoyé. La séquence peut avoir des trous
+    (transactions annulées) : ils ne seront jamais comblés.
+    """
+    criteria = [ChangeLog.entity.in_(entities)] if entities else []
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = CHANGE_CHUNK_SIZE if remaining is None else min(CHANGE_CHUNK_SIZE, remaining)
+        changes = session.execute(
+            select(ChangeLog).where(ChangeLog.seq > cursor, *criteria).order_by(ChangeLog.seq).limit(size)
+        ).scalars().all()
+        if not changes:
+            return
+
+        # Un SELECT par entité pour tout le paquet
+        current = {}
+        for entity, model in TRACKED.items():
+            ids = {c.entity_id for c in changes if c.entity == entity}
+            if ids:
+                table = model.__table__
+                for row in session.execute(select(table).where(table.c.id.in_(ids))):
+                    current[entity, row.id] = dict(row._mapping)
+
+        for change in changes:
+            yield {
+                "seq": change.seq,
+                "changed_at": change.changed_at,
+                "entity": change.entity,
+                "id": change.entity_id,
+                "op": change.operation,
+                "data": current.get((change.entity, change.entity_id)),
+            }
+        cursor = changes[-1].seq
+        if remaining is not None:
+            remaining -= len(changes)
+
+
+# === Écritures ORM : une ligne de change_log dans la même transaction ===
+def _has_column_changes(target):
+    state = inspect(target)
+    return any(state.attrs[attr.key].history.has_changes() for attr in state.mapper.column_attrs)
+
+
+def _entity(mapper):
+    return ENTITY_NAMES[mapper.class_]
+
+
+def _change_log(target):
+    # Connexion de flush = shard de l'objet ; change_log est sur la base principale
+    return directory_connection(object_session(target))
+
+
+@event.listens_for(Client, "after_insert")
+@event.listens_for(Contract, "after_insert")
+@event.listens_for(Event, "after_insert")
+def _record_insert(mapper, connection, target):
+    record_changes(_change_log(target), _entity(mapper), [target.id], "insert")
+
+
+@event.listens_for(Client, "after_update")
+@event.listens_for(Contract, "after_update")
+@event.listens_for(Event, "after_update")
+def _record_update(mapper, connection, target):
+    if _has_column_changes(target):
+        record_changes(_change_log(target), _entity(mapper), [target.id], "update")
+
+
+@event.listens_for(Client, "after_delete")
+@event.listens_for(Contract, "after_delete")
+@event.listens_for(Event, "after_delete")
+def _record_delete(mapper, connection, target):
+    record_changes(_change_log(target), _entity(mapper), [target.id], "delete")
@@ -1,15 +1,40 @@
-import uuid
+import json
+import operator
 from datetime import datetime, timedelta
 import click
-from .database import SessionLocal, Base, engine
+from .database import Base, engine
 from .models import Client, Contract, Event, User, Role
 from argon2 import PasswordHasher
 from crm.auth import authenticate_user, get_current_user, require_role, require_auth
-from sqlalchemy import or_
+from sqlalchemy import func, or_, select
+from sqlalchemy.exc import InvalidRequestError, SQLAlchemyError
+from sqlalchemy.orm.exc import StaleDataError
 from tests.validators import check_email, check_phone, check_role, check_company
 from tests.validators import check_number, check_status, check_amount
-import sentry_sdk
-from .auth import encrypt_data, decrypt_data
+from .auth import decrypt_data
+from . import search as search_index
+from . import services
+from .audit import audit, query_audit_log
+from .cache import reference_cache
+from .propagation import resync_all_events
+from .partitioning import ensure_partitions, date_range_criteria, PARTITION_MONTHS_AHEAD
+from .projections import user_rows, client_rows, contract_rows, event_rows
+from .retention import run_retention, RetentionSettingsChanged, RETENTION_DAYS, RETENTION_BATCH_SIZE
+from .retention import RETENTION_SLEEP_SECONDS
+from . import local_replica
+from .changefeed import changes_since as iter_changes, TRACKED
+from . import reporting
+from .forecasting import cached_forecast, FORECAST_MONTHS
+from . import reminders as event_reminders
+from . import sharding
+from .sharding import SessionLocal
+from . import profiling
+from . import slowlog
+from . import dedup
+from . import batch
+from . import metrics
+from . import sessions
+from .sessions import session_scope
 
 ph = PasswordHasher()
 
@@ -18,10 +43,25 @@ ph = PasswordHasher()
 Base.metadata.create_all(engine)
 
 
-@click.group()
-def cli():
+@click.group(cls=profiling.CRMGroup)
+@click.option("--profile-mem", is_flag=True, help="Mesurer la mémoire de la commande (tracemalloc)")
+@click.option("--profile-mem-json", type=click.Path(dir_okay=False), help="Fichier JSONL des rapports mémoire")
+@click.option("--profile-cpu", is_flag=True, help="Profiler le temps CPU de la commande (piles repliées + top)")
+@click.option("--profile-cpu-dir", type=click.Path(file_okay=False), help="Dossier des fichiers .folded")
+@click.option("--debug-sessions", is_flag=True, help="Signaler les sessions non fermées et l'état des pools")
+@click.option("--metrics-file", type=click.Path(dir_okay=False),
+              help="Fichier de métriques Prometheus (textfile collector de node_exporter)")
+def cli(profile_mem, profile_mem_json, profile_cpu, profile_cpu_dir, debug_sessions, metrics_file):
     """CRM CLI - Gérer Clients, Contrats, Evénements"""
-    pass
+    if profile_mem or profile_mem_json:
+        profiling.enable_memory_profiling(profile_mem_json)
+    if profile_cpu or profile_cpu_dir:
+        profiling.enable_cpu_profiling(profile_cpu_dir or profiling.PROFILE_CPU_DIR)
+    if debug_sessions:
+        sessions.enable_session_debug()
+    if metrics_file:
+        metrics.METRICS_FILE = metrics_file
+        metrics.enable_metrics()
 
 
 # === LOGIN ===
@@ -65,23 +105,84 @@ def prompt_until_valid(prompt_text, validator_func, error_msg="Entrée invalide.
         click.echo(f"❌ {error_msg}")
 
 
+def same_plaintext(a, b):
+    """Égalité des valeurs en clair : deux chiffrés Fernet d'une même valeur sont différents"""
+    return search_index._plain(a) == search_index._plain(b)
+
+
+def commit_with_conflict_resolution(session, obj, changes, label, display=str, same=operator.eq):
+    """Applique les modifications et valide, avec verrouillage optimiste.
+
+    Si l'objet a été modifié par quelqu'un d'autre pendant la saisie, on affiche
+    les différences et on propose d'écraser, de fusionner ou d'annuler.
+    `same` compare deux valeurs d'un champ (ex: same_plaintext pour les champs chiffrés).
+    Retourne True si les modifications ont été enregistrées.
+    """
+    original = {field: getattr(obj, field) for field in changes}
+    pending = dict(changes)
+    while True:
+        for field, value in pending.items():
+            setattr(obj, field, value)
+        try:
+            session.commit()
+            return True
+        except StaleDataError:
+            session.rollback()
+        try:
+            session.refresh(obj)
+        except InvalidRequestError:
+            click.echo(f"❌ Ce {label} a été supprimé entre-temps.")
+            return False
+
+        current = {field: getattr(obj, field) for field in changes}
+        click.echo(f"\n⚠️ Ce {label} a été modifié par un autre utilisateur pendant votre saisie :")
+        for field in changes:
+            if not same(current[field], original[field]):
+                click.echo(f"  {field} : {display(current[field])} (votre saisie : {display(changes[field])})")
+        choice = click.prompt("Écraser (e), fusionner (f) ou annuler (a)",
+                              type=click.Choice(["e", "f", "a"]), default="f")
+        if choice == "a":
+            click.echo("❌ Modification annulée.")
+            return False
+        if choice == "e":
+            pending = dict(changes)
+        else:
+            # Fusion : on garde les champs modifiés par l'autre utilisateur, sauf choix contraire
+            pending = {}
+            for field, mine in changes.items():
+                if same(mine, original[field]) or same(mine, current[field]):
+                    continue
+                if same(current[field], original[field]) or click.confirm(
+                        f"  {field} modifié des deux côtés : garder votre valeur ({display(mine)}) ?", default=True):
+                    pending[field] = mine
+        original = current
+
+
+def read_session(local=False):
+    """Session de lecture : copie locale (--local) ou base principale, fermée en sortie de bloc"""
+    return session_scope(local_replica.local_session if local else SessionLocal)
+
+
+local_option = click.option("--local", "local", is_flag=True,
+                            help="Lire la copie locale (voir `sync`) au lieu de la base principale")
+
+
 # === Commande : Créer un Role ===
 @cli.command()
 @require_auth
 @require_role(["gestion"])
 def add_role(name):
     """Créer un nouveau rôle"""
-    session = SessionLocal()
-    roles = session.query(Role).all()
-    click.echo("\n📄 Liste des roles :")
-    for r in roles:
-        click.echo(f"- {r.id}: {r.name}")
-    role_name = prompt_until_valid("Role", check_role, "Role invalide")
-    role = Role(name=role_name)
-    session.add(role)
-    session.commit()
-    click.echo(f"✅ Rôle créé : {role}")
-    session.close()
+    with session_scope(SessionLocal) as session:
+        roles = reference_cache.roles()
+        click.echo("\n📄 Liste des roles :")
+        for r in roles:
+            click.echo(f"- {r.id}: {r.name}")
+        role_name = prompt_until_valid("Role", check_role, "Role invalide")
+        role = Role(name=role_name)
+        session.add(role)
+        session.commit()
+        click.echo(f"✅ Rôle créé : {role}")
 
 
 # === Commande : Créer un Utilisateur ===
@@ -90,35 +191,32 @@ def add_role(name):
 @require_role(["gestion"])
 def add_user(user):
     """Créer un nouvel utilisateur"""
-    session = SessionLocal()
-
-    users = session.query(User).all()
-    click.echo("\n📄 Liste des utilisateurs :")
-    for u in users:
-        click.echo(f"  ID: {u.id} | N°: {u.employee_number} | Nom: {u.name} | Rôle: {u.role.name} | Email: {u.email}")
-
-    employee_number = generate_next_employee_number(session)
-    name = click.prompt("Nom")
-    email = prompt_until_valid("Email", check_email, "Email invalide")
-    password = click.prompt("Mot de passe", hide_input=True, confirmation_prompt=True)
-    role_name = prompt_until_valid("Role commercial/gestion/support", check_role, "Role invalide")
-    role = session.query(Role).filter_by(name=role_name).first()
-    if not role:
-        click.echo(f"❌ Rôle '{role_name}' introuvable.")
-        return
+    with session_scope(SessionLocal) as session:
+        click.echo("\n📄 Liste des utilisateurs :")
+        for u in user_rows(session):
+            click.echo(f"  ID: {u.id} | N°: {u.employee_number} | Nom: {u.name} | Rôle: {u.role} | Email: {u.email}")
+
+        employee_number = generate_next_employee_number(session)
+        name = click.prompt("Nom")
+        email = prompt_until_valid("Email", check_email, "Email invalide")
+        password = click.prompt("Mot de passe", hide_input=True, confirmation_prompt=True)
+        role_name = prompt_until_valid("Role commercial/gestion/support", check_role, "Role invalide")
+        role = reference_cache.role(session, role_name)
+        if not role:
+            click.echo(f"❌ Rôle '{role_name}' introuvable.")
+            return
 
-    user = User(
-        employee_number=employee_number,
-        name=name,
-        email=email,
-        role=role
-    )
-    user.set_password(password)
-    session.add(user)
-    session.commit()
-    sentry_sdk.capture_message(f"✅ Utilisateur créé : {user.name} (ID: {user.id})")
-    click.echo(f"✅ Utilisateur créé : {user}")
-    session.close()
+        new_user = User(
+            employee_number=employee_number,
+            name=name,
+            email=email,
+            role=role
+        )
+        new_user.set_password(password)
+        session.add(new_user)
+        session.commit()
+        audit(user.get('name'), "user.create", "user", new_user.id, name=new_user.name, role=role_name)
+        click.echo(f"✅ Utilisateur créé : {new_user}")
 
 
 # === Commande : Modifier un Utilisateur ===
@@ -127,44 +225,41 @@ def add_user(user):
 @require_role(["gestion"])
 def update_user(user):
     """Modifier un utilisateur"""
-    session = SessionLocal()
-
-    users = session.query(User).all()
-    click.echo("\n📄 Liste des utilisateurs :")
-    for u in users:
-        click.echo(f"  ID: {u.id} | Numéro: {u.employee_number} | Nom: {u.name} | Rôle: {u.role.name}")
-
-    user_id = prompt_until_valid("ID de l'utilisateur à modifier", check_number, "ID invalide")
-    target_user = session.get(User, user_id)
-    if not target_user:
-        click.echo("❌ Utilisateur non trouvé")
-        return
-
-    # Prompts optionnels : laisser vide pour ne pas modifier
-    # new_email = click.prompt("Nouveau email ", default="", show_default=False)
-    new_email = prompt_until_valid("Email", check_email, "Email invalide")
-    new_name = click.prompt("Nouveau nom ", default="", show_default=False)
-    role_name = prompt_until_valid("Role", check_role, "Role invalide")
-    new_password = click.prompt("Nouveau mot de passe ",
-                                hide_input=True, confirmation_prompt=True, default="", show_default=False)
-
-    if new_email:
-        target_user.email = new_email
-    if new_name:
-        target_user.name = new_name
-    if role_name:
-        role = session.query(Role).filter_by(name=role_name).first()
-        if not role:
-            click.echo("❌ Rôle introuvable.")
+    with session_scope(SessionLocal) as session:
+        click.echo("\n📄 Liste des utilisateurs :")
+        for u in user_rows(session):
+            click.echo(f"  ID: {u.id} | Numéro: {u.employee_number} | Nom: {u.name} | Rôle: {u.role}")
+
+        user_id = prompt_until_valid("ID de l'utilisateur à modifier", check_number, "ID invalide")
+        target_user = session.get(User, user_id)
+        if not target_user:
+            click.echo("❌ Utilisateur non trouvé")
             return
-        target_user.role = role
-    if new_password:
-        target_user.set_password(new_password)
 
-    session.commit()
-    sentry_sdk.capture_message(f"✅ Utilisateur modifié : {user.name} (ID: {user.id})")
-    click.echo(f"✅ Utilisateur modifié : {target_user}")
-    session.close()
+        # Prompts optionnels : laisser vide pour ne pas modifier
+        # new_email = click.prompt("Nouveau email ", default="", show_default=False)
+        new_email = prompt_until_valid("Email", check_email, "Email invalide")
+        new_name = click.prompt("Nouveau nom ", default="", show_default=False)
+        role_name = prompt_until_valid("Role", check_role, "Role invalide")
+        new_password = click.prompt("Nouveau mot de passe ",
+                                    hide_input=True, confirmation_prompt=True, default="", show_default=False)
+
+        if new_email:
+            target_user.email = new_email
+        if new_name:
+            target_user.name = new_name
+        if role_name:
+            role = reference_cache.role(session, role_name)
+            if not role:
+                click.echo("❌ Rôle introuvable.")
+                return
+            target_user.role = role
+        if new_password:
+            target_user.set_password(new_password)
+
+        session.commit()
+        audit(user.get('name'), "user.update", "user", target_user.id, name=target_user.name, role=role_name)
+        click.echo(f"✅ Utilisateur modifié : {target_user}")
 
 
 # === Commande : Supprimer un Utilisateur ===
@@ -173,26 +268,25 @@ def update_user(user):
 @require_role(["gestion"])
 def delete_user(user):
     """Supprimer un user """
-    session = SessionLocal()
-    users = session.query(User).all()
-    click.echo("\n📄 Liste des utilisateurs :")
-    for u in users:
-        click.echo(f"  ID: {u.id} | Numéro: {u.employee_number} | Nom: {u.name} | Rôle: {u.role.name}")
-
-    user_id = prompt_until_valid("ID de l'utilisateur à supprimer", check_number, "ID invalide")
-    target_user = session.get(User, user_id)
-    if not target_user:
-        click.echo("❌ Utilisateur non trouvé")
-        return
+    with session_scope(SessionLocal) as session:
+        click.echo("\n📄 Liste des utilisateurs :")
+        for u in user_rows(session):
+            click.echo(f"  ID: {u.id} | Numéro: {u.employee_number} | Nom: {u.name} | Rôle: {u.role}")
+
+        user_id = prompt_until_valid("ID de l'utilisateur à supprimer", check_number, "ID invalide")
+        target_user = session.get(User, user_id)
+        if not target_user:
+            click.echo("❌ Utilisateur non trouvé")
+            return
 
-    if not click.confirm(f"⚠️ Êtes-vous sûr de vouloir supprimer l'utilisateur '{target_user.name}' ?", default=False):
-        click.echo("❌ Suppression annulée.")
-        return
+        if not click.confirm(f"⚠️ Êtes-vous sûr de vouloir supprimer l'utilisateur '{target_user.name}' ?",
+                             default=False):
+            click.echo("❌ Suppression annulée.")
+            return
 
-    session.delete(target_user)
-    session.commit()
-    click.echo(f"✅ Utilisateur supprimé : {target_user}")
-    session.close()
+        session.delete(target_user)
+        session.commit()
+        click.echo(f"✅ Utilisateur supprimé : {target_user}")
 
 
 # === Commande : Créer un Client ===
@@ -206,20 +300,14 @@ def add_client(user):
     email = prompt_until_valid("Email", check_email, "Email invalide")
     phone = prompt_until_valid("Téléphone", check_phone, "Téléphone invalide")
     company = prompt_until_valid("Entreprise", check_company, "Entreprise invalide")
-    session = SessionLocal()
-    client = Client(
-        name=encrypt_data(name),
-        email=encrypt_data(email),
-        phone=encrypt_data(str(phone)),
-        company=company,
-        created_at=datetime.utcnow(),
-        last_updated=datetime.utcnow(),
-        sales_contact=user['name']
-    )
-    session.add(client)
-    session.commit()
-    click.echo(f"✅ Client créé : {decrypt_data(client)}")
-    session.close()
+    with session_scope(SessionLocal) as session:
+        try:
+            client = services.create_client(session, user, name, email, phone, company)
+        except ValueError as e:
+            click.echo(f"❌ {e}")
+            return
+        session.commit()
+        click.echo(f"✅ Client créé : {decrypt_data(client)}")
 
 
 # === Commande : Modifier un Client ===
@@ -228,47 +316,44 @@ def add_client(user):
 @require_role(["commercial"])
 def update_client(user):
     """Modifier un client existant (commercial = uniquement les siens)"""
-    session = SessionLocal()
-    clients = session.query(Client).filter_by(sales_contact=user.get('name')).all()
-
-    if not clients:
-        click.echo("❌ Aucun client ne vous est assigné.")
-        session.close()
-        return
+    with session_scope(SessionLocal) as session:
+        clients = list(client_rows(session, Client.sales_contact == user.get('name')))
 
-    click.echo("\n📋 Liste de vos clients :")
-    for c in clients:
-        click.echo(
-            f"  ID: {c.id} | "
-            f"Nom: {decrypt_data(c.name)} | "
-            f"Email: {decrypt_data(c.email)} | "
-            f"Téléphone: {decrypt_data(c.phone)}"
-        )
-
-    client_id = prompt_until_valid("ID du client à modifier", check_number, "ID invalide")
-    client = session.query(Client).filter_by(id=client_id, sales_contact=user.get('name')).first()
-
-    if not client:
-        click.echo("❌ Client introuvable ou non autorisé.")
-        session.close()
-        return
+        if not clients:
+            click.echo("❌ Aucun client ne vous est assigné.")
+            return
 
-    click.echo(f"\n🔧 Modification du client : {decrypt_data(client.name)}")
-    new_name = click.prompt("Nom", default=decrypt_data(client.name), show_default=True)
-    new_email = prompt_until_valid("Email", check_email, "Email invalide")
-    new_phone = prompt_until_valid("Téléphone", check_phone, "Téléphone invalide")
-    new_company = prompt_until_valid("Entreprise", check_company, "Entreprise invalide")
+        click.echo("\n📋 Liste de vos clients :")
+        for c in clients:
+            click.echo(
+                f"  ID: {c.id} | "
+                f"Nom: {decrypt_data(c.name)} | "
+                f"Email: {decrypt_data(c.email)} | "
+                f"Téléphone: {decrypt_data(c.phone)}"
+            )
 
-    client.name = encrypt_data(new_name)
-    client.email = encrypt_data(new_email)
-    client.phone = encrypt_data(new_phone)
-    client.company = encrypt_data(new_company)
+        client_id = prompt_until_valid("ID du client à modifier", check_number, "ID invalide")
+        try:
+            client = services.own_client(session, user, client_id)
+        except ValueError as e:
+            click.echo(f"❌ {e}")
+            return
 
-    client.last_updated = datetime.utcnow()
+        click.echo(f"\n🔧 Modification du client : {decrypt_data(client.name)}")
+        new_name = click.prompt("Nom", default=decrypt_data(client.name), show_default=True)
+        new_email = prompt_until_valid("Email", check_email, "Email invalide")
+        new_phone = prompt_until_valid("Téléphone", check_phone, "Téléphone invalide")
+        new_company = prompt_until_valid("Entreprise", check_company, "Entreprise invalide")
 
-    session.commit()
-    click.echo(f"✅ Client mis à jour : {decrypt_data(client.name)}")
-    session.close()
+        # Seuls les champs réellement modifiés sont rechiffrés et écrits
+        changes = services.client_changes(client, new_name, new_email, new_phone, new_company)
+        if not changes:
+            click.echo("ℹ️ Aucune modification.")
+            return
+        saved = commit_with_conflict_resolution(session, client, changes, "client",
+                                                display=search_index._plain, same=same_plaintext)
+        if saved:
+            click.echo(f"✅ Client mis à jour : {decrypt_data(client.name)}")
 
 
 # === Commande : Créer un Contrat ===
@@ -277,40 +362,29 @@ def update_client(user):
 @require_role(["gestion"])
 def add_contract(user):
     """Ajouter un contrat pour un client existant"""
-    session = SessionLocal()
-    clients = session.query(Client).all()
-    click.echo("\n=== Clients ===")
-    for c in clients:
-        click.echo(
-            f"  ID: {c.id} | "
-            f"Nom: {decrypt_data(c.name)} | "
-            f"Email: {decrypt_data(c.email)} | "
-        )
-
-    client_id = prompt_until_valid("ID du client", check_number, "ID invalide")
-    amount_total = prompt_until_valid("Montant total", check_amount, "Montant invalide")
-    amount_remaining = prompt_until_valid("Montant restant", check_amount, "Montant invalide")
-    status = prompt_until_valid("Statut (ex: signed, pending)", check_status, "Statut invalide")
+    with session_scope(SessionLocal) as session:
+        click.echo("\n=== Clients ===")
+        for c in client_rows(session):
+            click.echo(
+                f"  ID: {c.id} | "
+                f"Nom: {decrypt_data(c.name)} | "
+                f"Email: {decrypt_data(c.email)} | "
+            )
+
+        client_id = prompt_until_valid("ID du client", check_number, "ID invalide")
+        amount_total = prompt_until_valid("Montant total", check_amount, "Montant invalide")
+        amount_remaining = prompt_until_valid("Montant restant", check_amount, "Montant invalide")
+        status = prompt_until_valid("Statut (ex: signed, pending)", check_status, "Statut invalide")
 
-    client = session.get(Client, client_id)
-    if not client:
-        click.echo("❌ Client non trouvé.")
-        return
-
-    contract = Contract(
-        unique_id=str(uuid.uuid4()),
-        client_id=client.id,
-        sales_contact=client.sales_contact,
-        amount_total=amount_total,
-        amount_remaining=amount_remaining,
-        created_at=datetime.utcnow(),
-        status=status
-    )
-    session.add(contract)
-    session.commit()
-    sentry_sdk.capture_message(f"📝 Contrat créé pour client {contract.client.name} (ID: {contract.id})")
-    click.echo(f"✅ Contrat créé : {contract}")
-    session.close()
+        try:
+            contract = services.create_contract(session, user, client_id, amount_total, amount_remaining, status)
+        except ValueError as e:
+            click.echo(f"❌ {e}")
+            return
+        session.commit()
+        action, entity, entity_id, details = services.contract_audit("contract.create", contract)
+        audit(user.get('name'), action, entity, entity_id, **details)
+        click.echo(f"✅ Contrat créé : {contract}")
 
 
 # === Commande : Modifier un de ses Contrats (commercial) ou Tous (gestion)===
@@ -319,90 +393,135 @@ def add_contract(user):
 @require_role(["gestion", "commercial"])
 def update_contract(user):
     """Modifier un contrat existant (gestion = tous, commercial = uniquement les siens)"""
-    session = SessionLocal()
-    user_role = user.get('role')
-
-    if user_role == "gestion":
-        contracts = session.query(Contract).all()
-    elif user_role == "commercial":
-        contracts = session.query(Contract).filter_by(sales_contact=user.get('name')).all()
-    else:
-        click.echo("❌ Vous n'avez pas les droits pour modifier les contrats.")
-        return
+    with session_scope(SessionLocal) as session:
+        user_role = user.get('role')
+
+        if user_role == "gestion":
+            contracts = list(contract_rows(session))
+        elif user_role == "commercial":
+            contracts = list(contract_rows(session, Contract.sales_contact == user.get('name')))
+        else:
+            click.echo("❌ Vous n'avez pas les droits pour modifier les contrats.")
+            return
 
-    if not contracts:
-        click.echo("❌ Aucun contrat trouvé.")
-        return
+        if not contracts:
+            click.echo("❌ Aucun contrat trouvé.")
+            return
 
-    click.echo("\n📄 Liste des contrats :")
-    for c in contracts:
-        click.echo(f"  ID: {c.id} | Client ID: {c.client_id} | Montant: {c.amount_total} | Statut: {c.status}")
+        click.echo("\n📄 Liste des contrats :")
+        for c in contracts:
+            click.echo(f"  ID: {c.id} | Client ID: {c.client_id} | Montant: {c.amount_total} | Statut: {c.status}")
 
-    contract_id = prompt_until_valid("ID du contrat à modifier", check_number, "ID invalide")
+        contract_id = prompt_until_valid("ID du contrat à modifier", check_number, "ID invalide")
 
-    contract = session.get(Contract, contract_id)
-    if not contract:
-        click.echo("❌ Contrat non trouvé")
-        return
+        # Pour les commerciaux, vérifier qu'ils ne modifient que leurs contrats
+        try:
+            contract = services.editable_contract(session, user, contract_id)
+        except ValueError as e:
+            click.echo(f"❌ {e}")
+            return
+
+        click.echo(f"📌 Statuts disponibles : {', '.join(services.VALID_STATUSES)}")
+        click.echo(f"🔎 Contrat actuel : {contract}")
+        new_amount_total = prompt_until_valid("Nouveau montant total", check_amount, "Montant invalide")
+        new_amount_remaining = prompt_until_valid("Nouveau montant restant", check_amount, "Montant invalide")
+
+        while True:
+            new_status = click.prompt("Nouveau statut", default=contract.status, show_default=True)
+            if new_status in services.VALID_STATUSES:
+                break
+            click.echo("❌ Statut invalide. Choisissez parmi : " + ", ".join(services.VALID_STATUSES))
 
-    # Pour les commerciaux, vérifier qu'ils ne modifient que leurs contrats
-    if user_role == "commercial" and contract.sales_contact != user.get('name'):
-        click.echo("❌ Vous ne pouvez modifier que vos propres contrats.")
+        changes = services.contract_changes(new_amount_total, new_amount_remaining, new_status)
+        if not commit_with_conflict_resolution(session, contract, changes, "contrat"):
+            return
+        action, entity, entity_id, details = services.contract_audit("contract.update", contract)
+        audit(user.get('name'), action, entity, entity_id, **details)
+        click.echo(f"✅ Contrat mis à jour : {contract}")
+
+
+# === Commande : Modifier des contrats en masse ===
+@cli.command()
+@click.option("--owner", help="Commercial en charge des contrats")
+@click.option("--status", help="Statut actuel des contrats")
+@click.option("--client-id", type=int, help="ID du client")
+@click.option("--ids", help="Liste d'ID de contrats séparés par des virgules")
+@click.option("--ids-file", type=click.Path(exists=True, dir_okay=False), help="Fichier d'ID de contrats")
+@click.option("--set-status", "new_status", help="Nouveau statut")
+@click.option("--set-total", "new_amount_total", type=float, help="Nouveau montant total")
+@click.option("--set-remaining", "new_amount_remaining", type=float, help="Nouveau montant restant")
+@click.option("--yes", is_flag=True, help="Ne pas demander de confirmation")
+@require_auth
+@require_role(["gestion", "commercial"])
+def bulk_update_contracts(user, owner, status, client_id, ids, ids_file, new_status,
+                          new_amount_total, new_amount_remaining, yes):
+    """Modifier en une requête tous les contrats d'un filtre (gestion = tous, commercial = les siens)"""
+    if new_status is not None and not check_status(new_status):
+        click.echo("❌ Statut invalide. Choisissez parmi : new, pending, signed, cancelled")
+        return
+    if new_status is None and new_amount_total is None and new_amount_remaining is None:
+        click.echo("❌ Indiquez au moins --set-status, --set-total ou --set-remaining.")
         return
 
-    VALID_STATUSES = ["new", "pending", "signed", "cancelled"]
-    click.echo(f"📌 Statuts disponibles : {', '.join(VALID_STATUSES)}")
-    click.echo(f"🔎 Contrat actuel : {contract}")
-    new_amount_total = prompt_until_valid("Nouveau montant total", check_amount, "Montant invalide")
-    new_amount_remaining = prompt_until_valid("Nouveau montant restant", check_amount, "Montant invalide")
+    contract_ids = None
+    if ids or ids_file:
+        try:
+            contract_ids = [int(i) for i in ids.split(",") if i.strip()] if ids else []
+            if ids_file:
+                contract_ids += services.read_ids_file(ids_file)
+        except ValueError:
+            click.echo("❌ Liste d'ID invalide.")
+            return
 
-    while True:
-        new_status = click.prompt("Nouveau statut", default=contract.status, show_default=True)
-        if new_status in VALID_STATUSES:
-            break
-        click.echo("❌ Statut invalide. Choisissez parmi : " + ", ".join(VALID_STATUSES))
+    if not yes and not click.confirm("⚠️ Appliquer la modification à tous les contrats du filtre ?", default=False):
+        click.echo("❌ Modification annulée.")
+        return
 
-    contract.amount_total = float(new_amount_total)
-    contract.amount_remaining = float(new_amount_remaining)
-    contract.status = new_status
-    contract.last_updated = datetime.utcnow()
+    with session_scope(SessionLocal) as session:
+        summary = services.bulk_update_contracts(
+            session, user, owner=owner, status=status, client_id=client_id, ids=contract_ids,
+            new_status=new_status, new_amount_total=new_amount_total, new_amount_remaining=new_amount_remaining,
+        )
+        session.commit()
 
-    session.commit()
-    sentry_sdk.capture_message(f"📝 Contrat modifié pour client {contract.client.name} (ID: {contract.id})")
-    click.echo(f"✅ Contrat mis à jour : {contract}")
-    session.close()
+    if summary["count"]:
+        audit(user.get('name'), "contract.bulk_update", "contract", None,
+              ids=summary["ids"], status=new_status, amount_total=new_amount_total,
+              amount_remaining=new_amount_remaining)
+    click.echo(f"✅ {summary['count']} contrat(s) mis à jour")
+    for contract_status, count in sorted(summary["by_status"].items()):
+        click.echo(f"  - {contract_status}: {count}")
+    click.echo(f"  Montant total : {summary['amount_total']} € | Restant : {summary['amount_remaining']} €")
 
 
 # === Commande : Afficher contrats non signés ou non payés ===
 @cli.command()
+@local_option
 @require_auth
 @require_role(["commercial"])
-def list_contracts_unsigned_unpaid(user):
+def list_contracts_unsigned_unpaid(user, local):
     """Afficher les contrats qui ne sont pas signés ou pas payés"""
-    session = SessionLocal()
-
-    # Récupérer les contrats du commercial qui ne sont pas signés OU pas payés
-    contracts = session.query(Contract).filter(
-        Contract.sales_contact == user.get("name"),
-        or_(
-            Contract.status != "signed",
-            Contract.amount_remaining > 0
-        )
-    ).all()
-
-    if not contracts:
-        click.echo("❌ Aucun contrat non signé ou non payé trouvé pour vous.")
-        session.close()
-        return
-
-    click.echo("\n📄 Contrats non signés ou non payés :")
-    for c in contracts:
-        click.echo(
-            f"  ID: {c.id} | Client: {decrypt_data(c.client.name)} | Montant: {c.amount_total} € | "
-            f"Restant: {c.amount_remaining} € | Statut: {c.status}"
-        )
+    with read_session(local) as session:
+        # Récupérer les contrats du commercial qui ne sont pas signés OU pas payés
+        contracts = list(contract_rows(
+            session,
+            Contract.sales_contact == user.get("name"),
+            or_(
+                Contract.status != "signed",
+                Contract.amount_remaining > 0
+            )
+        ))
+
+        if not contracts:
+            click.echo("❌ Aucun contrat non signé ou non payé trouvé pour vous.")
+            return
 
-    session.close()
+        click.echo("\n📄 Contrats non signés ou non payés :")
+        for c in contracts:
+            click.echo(
+                f"  ID: {c.id} | Client: {decrypt_data(c.client_name)} | Montant: {c.amount_total} € | "
+                f"Restant: {c.amount_remaining} € | Statut: {c.status}"
+            )
 
 
 # === Commande : Créer un Événement ===
@@ -411,103 +530,64 @@ def list_contracts_unsigned_unpaid(user):
 @require_role(["commercial"])
 def add_event(user):
     """Ajouter un événement pour un contrat existant"""
-    session = SessionLocal()
-
-    # Récupérer les contrats signés du commercial **sans événement associé**
-    contracts = (
-        session.query(Contract)
-        .filter(
-            Contract.status == "signed",
-            Contract.sales_contact == user.get("name"),
-            ~Contract.events.any()  # <-- filtre : contrats sans event
-        )
-        .all()
-    )
-
-    if not contracts:
-        click.echo("❌ Aucun contrat signé sans événement trouvé pour vous.")
-        session.close()
-        return
-
-    click.echo("\n📄 Contrats signés sans événement :")
-    for c in contracts:
-        click.echo(f"  ID: {c.id} | Client: {c.client.name} | Montant: {c.amount_total} €")
-
-    contract_id = prompt_until_valid("ID du contrat", check_number, "ID invalide")
-    contract = session.query(Contract).filter_by(
-        id=contract_id, status="signed", sales_contact=user.get("name")
-    ).first()
+    with session_scope(SessionLocal) as session:
+        # Récupérer les contrats signés du commercial **sans événement associé**
+        contracts = services.contracts_without_event(session, user)
 
-    if not contract:
-        click.echo("❌ Contrat introuvable ou non autorisé.")
-        session.close()
-        return
+        if not contracts:
+            click.echo("❌ Aucun contrat signé sans événement trouvé pour vous.")
+            return
 
-    # Vérifier que le contrat choisi est dans la liste filtrée (sans event)
-    if contract not in contracts:
-        click.echo("❌ Contrat introuvable, non autorisé ou déjà avec un événement.")
-        session.close()
-        return
+        click.echo("\n📄 Contrats signés sans événement :")
+        for c in contracts:
+            click.echo(f"  ID: {c.id} | Client: {c.client.name} | Montant: {c.amount_total} €")
 
-    existing_event = session.query(Event).filter_by(contract_id=contract.id).first()
-    if existing_event:
-        click.echo("❌ Un événement existe déjà pour ce contrat. Impossible d'en créer un autre.")
-        session.close()
-        return
-
-    support_users = session.query(User).join(Role).filter(Role.name == "support").all()
+        contract_id = prompt_until_valid("ID du contrat", check_number, "ID invalide")
+        # Vérifier que le contrat choisi est dans la liste filtrée (sans event)
+        if int(contract_id) not in {c.id for c in contracts}:
+            click.echo("❌ Contrat introuvable, non autorisé ou déjà avec un événement.")
+            return
 
-    if not support_users:
-        click.echo("❌ Aucun utilisateur avec le rôle 'support' trouvé.")
-        session.close()
-        return
+        support_users = reference_cache.users_with_role("support")
 
-    click.echo("\n🧑‍💻 Contacts support disponibles :")
-    for su in support_users:
-        click.echo(f"  ID: {su.id} | Nom: {su.name} | Email: {su.email}")
+        if not support_users:
+            click.echo("❌ Aucun utilisateur avec le rôle 'support' trouvé.")
+            return
 
-    support_contact_input = click.prompt("ID du contact support", default="", show_default=False)
+        click.echo("\n🧑‍💻 Contacts support disponibles :")
+        for su in support_users:
+            click.echo(f"  ID: {su.id} | Nom: {su.name} | Email: {su.email}")
 
-    if support_contact_input.strip() == "":
-        support_contact_name = None
-    else:
+        support_contact_input = click.prompt("ID du contact support", default="", show_default=False)
         try:
-            support_contact_id = int(support_contact_input)
-            support_user = next((u for u in support_users if u.id == support_contact_id), None)
-            if not support_user:
-                click.echo("❌ Contact support invalide.")
-                session.close()
-                return
-            support_contact_name = support_user.name
-        except ValueError:
-            click.echo("❌ Veuillez entrer un identifiant valide ou laisser vide.")
-            session.close()
+            support_contact_name = services.support_name(support_contact_input)
+        except ValueError as e:
+            click.echo(f"❌ {e}")
             return
 
-    start_days = int(prompt_until_valid("Jours à partir d'aujourd'hui pour START", check_number, "Nombre invalide"))
-    end_days = int(prompt_until_valid("Jours à partir d'aujourd'hui pour END", check_number, "Nombre invalide"))
+        start_days = int(prompt_until_valid("Jours à partir d'aujourd'hui pour START", check_number,
+                                            "Nombre invalide"))
+        end_days = int(prompt_until_valid("Jours à partir d'aujourd'hui pour END", check_number, "Nombre invalide"))
 
-    location = click.prompt("Lieu")
-    attendees = prompt_until_valid("Nombre de participants", check_number, "Nombre invalide")
-    notes = click.prompt("Notes")
+        location = click.prompt("Lieu")
+        attendees = prompt_until_valid("Nombre de participants", check_number, "Nombre invalide")
+        notes = click.prompt("Notes")
 
-    client = contract.client
-    event = Event(
-        contract_id=contract.id,
-        client_name=(client.name),
-        client_contact=f"{client.phone} | {client.email}",
-        event_date_start=datetime.utcnow() + timedelta(days=start_days),
-        event_date_end=datetime.utcnow() + timedelta(days=end_days),
-        support_contact=support_contact_name,
-        location=location,
-        attendees=attendees,
-        notes=notes
-    )
-
-    session.add(event)
-    session.commit()
-    click.echo(f"✅ Événement créé : {event}")
-    session.close()
+        try:
+            event = services.create_event(
+                session, user, contract_id,
+                start=datetime.utcnow() + timedelta(days=start_days),
+                end=datetime.utcnow() + timedelta(days=end_days),
+                support_contact=support_contact_name,
+                location=location,
+                attendees=attendees,
+                notes=notes,
+            )
+        except ValueError as e:
+            click.echo(f"❌ {e}")
+            return
+        session.commit()
+        click.echo(f"✅ Événement créé : {event}")
 
 
 # === Commande : Modifier un Événement ===
@@ -516,107 +596,117 @@ def add_event(user):
 @require_role(["gestion", "support"])
 def update_event(user):
     """Modifier un événement existant"""
-    session = SessionLocal()
-    user_role = user.get('role')
-
-    if user_role == "gestion":
-        events = session.query(Event).all()
-    elif user_role == "support":
-        events = session.query(Event).filter_by(support_contact=user.get('name')).all()
-    else:
-        click.echo("❌ Vous n'avez pas les droits pour modifier les événements.")
-        return
-
-    if not events:
-        click.echo("❌ Aucun événement trouvé.")
-        return
-
-    click.echo("\n📅 Liste des événements :")
-    for e in events:
-        click.echo(f"  ID: {e.id} | Client: {e.client_name} | Lieu: {e.location}")
+    with session_scope(SessionLocal) as session:
+        user_role = user.get('role')
+
+        if user_role == "gestion":
+            events = list(event_rows(session))
+        elif user_role == "support":
+            events = list(event_rows(session, Event.support_contact == user.get('name')))
+        else:
+            click.echo("❌ Vous n'avez pas les droits pour modifier les événements.")
+            return
 
-    event_id = prompt_until_valid("ID de l'événement à modifier", check_number, "ID invalide")
-    event = session.get(Event, event_id)
-    if not event:
-        click.echo("❌ Événement non trouvé.")
-        return
-    # Pour le support, vérifier qu'ils ne modifient que leurs evenements
-    if user_role == "support" and event.support_contact != user.get('name'):
-        click.echo("⛔️ Vous ne pouvez modifier que les événements où vous êtes le contact support.")
-        return
+        if not events:
+            click.echo("❌ Aucun événement trouvé.")
+            return
 
-    start_days = click.prompt("Jours à partir d'aujourd'hui nouvelle date de début", default="", show_default=False)
-    end_days = click.prompt("Jours à partir d'aujourd'hui nouvelle date de fin", default="", show_default=False)
-    new_start_days = int(start_days) if start_days.strip().isdigit() else None
-    new_end_days = int(end_days) if end_days.strip().isdigit() else None
-    new_support = click.prompt("Nouveau contact support", default=event.support_contact, show_default=True)
-    new_location = click.prompt("Nouveau lieu", default=event.location, show_default=True)
-    new_attendees = prompt_until_valid("Nouveau nombre de participants", check_number, "Nombre invalide")
-    new_notes = click.prompt("Nouvelles notes", default=event.notes, show_default=True)
+        click.echo("\n📅 Liste des événements :")
+        for e in events:
+            click.echo(f"  ID: {e.id} | Client: {e.client_name} | Lieu: {e.location}")
 
-    if new_start_days is not None:
-        event.event_date_start = datetime.utcnow() + timedelta(days=new_start_days)
-    if new_end_days is not None:
-        event.event_date_end = datetime.utcnow() + timedelta(days=new_end_days)
+        event_id = prompt_until_valid("ID de l'événement à modifier", check_number, "ID invalide")
+        # Pour le support, vérifier qu'ils ne modifient que leurs evenements
+        try:
+            event = services.editable_event(session, user, event_id)
+        except ValueError as e:
+            click.echo(f"⛔️ {e}")
+            return
 
-    event.support_contact = new_support
-    event.location = new_location
-    event.attendees = new_attendees
-    event.notes = new_notes
+        start_days = click.prompt("Jours à partir d'aujourd'hui nouvelle date de début", default="",
+                                  show_default=False)
+        end_days = click.prompt("Jours à partir d'aujourd'hui nouvelle date de fin", default="", show_default=False)
+        new_start_days = int(start_days) if start_days.strip().isdigit() else None
+        new_end_days = int(end_days) if end_days.strip().isdigit() else None
+        new_support = click.prompt("Nouveau contact support", default=event.support_contact, show_default=True)
+        new_location = click.prompt("Nouveau lieu", default=event.location, show_default=True)
+        new_attendees = prompt_until_valid("Nouveau nombre de participants", check_number, "Nombre invalide")
+        new_notes = click.prompt("Nouvelles notes", default=event.notes, show_default=True)
 
-    session.commit()
-    click.echo(f"✅ Événement modifié : {event}")
-    session.close()
+        try:
+            changes = services.event_changes(
+                event,
+                start=None if new_start_days is None else datetime.utcnow() + timedelta(days=new_start_days),
+                end=None if new_end_days is None else datetime.utcnow() + timedelta(days=new_end_days),
+                support_contact=new_support,
+                location=new_location,
+                attendees=new_attendees,
+                notes=new_notes,
+            )
+        except ValueError as e:
+            click.echo(f"❌ {e}")
+            return
+        if commit_with_conflict_resolution(session, event, changes, "événement"):
+            click.echo(f"✅ Événement modifié : {event}")
 
 
 # === Commande : Afficher Événements sans support ===
 @cli.command()
+@click.option("--from-date", type=click.DateTime(), help="Début de la période (date de début incluse)")
+@click.option("--to-date", type=click.DateTime(), help="Fin de la période (exclue)")
+@local_option
 @require_role(["gestion"])
-def list_events_no_support():
+def list_events_no_support(from_date, to_date, local):
     """Lister les évènements sans support"""
-    session = SessionLocal()
-    events = session.query(Event).filter(Event.support_contact.is_(None)).all()
-
-    if not events:
-        click.echo("✅ Tous les événements ont un support assigné.")
-    else:
-        click.echo("\n📅 Événements sans support :")
-        for e in events:
-            click.echo(f"- ID: {e.id} | Client: {e.client_name} | Début: {e.event_date_start} | Lieu: {e.location}")
-
-    session.close()
+    with read_session(local) as session:
+        events = list(event_rows(
+            session,
+            Event.support_contact.is_(None),
+            *date_range_criteria(Event.event_date_start, from_date, to_date)
+        ))
+
+        if not events:
+            click.echo("✅ Tous les événements ont un support assigné.")
+        else:
+            click.echo("\n📅 Événements sans support :")
+            for e in events:
+                click.echo(f"- ID: {e.id} | Client: {e.client_name} | Début: {e.event_date_start} | "
+                           f"Lieu: {e.location}")
 
 
 # === Commande : Afficher Événements pour support ===
 @cli.command()
+@click.option("--from-date", type=click.DateTime(), help="Début de la période (date de début incluse)")
+@click.option("--to-date", type=click.DateTime(), help="Fin de la période (exclue)")
+@local_option
 @require_auth
 @require_role(["support"])
-def list_events_support(user):
+def list_events_support(user, from_date, to_date, local):
     """Lister les évènements assignés à l'utilisateur support"""
-    session = SessionLocal()
-    events = session.query(Event).filter_by(support_contact=user.get('name')).all()
-
-    if not events:
-        click.echo("❌ Aucun événement trouvé pour vous.")
-        session.close()
-        return
-
-    click.echo("\n📅 Liste des événements où vous êtes contact support :")
-    for e in events:
-        click.echo(f"  ID: {e.id} | Client: {e.client_name} | Lieu: {e.location} | Début: {e.event_date_start}")
+    with read_session(local) as session:
+        events = list(event_rows(
+            session,
+            Event.support_contact == user.get('name'),
+            *date_range_criteria(Event.event_date_start, from_date, to_date)
+        ))
+
+        if not events:
+            click.echo("❌ Aucun événement trouvé pour vous.")
+            return
 
-    session.close()
+        click.echo("\n📅 Liste des événements où vous êtes contact support :")
+        for e in events:
+            click.echo(f"  ID: {e.id} | Client: {e.client_name} | Lieu: {e.location} | Début: {e.event_date_start}")
 
 
 @cli.command()
+@local_option
 @require_role(["gestion"])
-def list_users():
+def list_users(local):
     """Lister les utilisateurs (seulement pour 'gestion')"""
-    session = SessionLocal()
-    users = session.query(User).all()
-    for u in users:
-        click.echo(f"{u.id}: {u.name} ({u.email}) - {u.role.name if u.role else 'Aucun rôle'}")
-    session.close()
+    with read_session(local) as session:
+        for u in user_rows(session):
+            click.echo(f"{u.id}: {u.name} ({u.email}) - {u.role or 'Aucun rôle'}")
 
 
 @cli.command()
@@ -631,31 +721,451 @@ def whoami():
 
 # === Commande : Lister Clients, Contrats, Événements ===
 @cli.command()
-def list_all():
+@local_option
+def list_all(local):
     """Lister tous les clients, contrats et événements"""
-    session = SessionLocal()
-    clients = session.query(Client).all()
-    contracts = session.query(Contract).all()
-    events = session.query(Event).all()
-    roles = session.query(Role).all()
+    with read_session(local) as session:
+        click.echo("\n=== Clients ===")
+        for c in client_rows(session):
+            click.echo(f"- {c.id}: {c.name} ({c.email})")
 
-    click.echo("\n=== Clients ===")
-    for c in clients:
-        click.echo(f"- {c.id}: {c.name} ({c.email})")
+        click.echo("\n=== Contrats ===")
+        for c in contract_rows(session):
+            click.echo(f"- {c.id}: {c.unique_id} (Client ID: {c.client_id}, Montant: {c.amount_total})")
 
-    click.echo("\n=== Contrats ===")
-    for c in contracts:
-        click.echo(f"- {c.id}: {c.unique_id} (Client ID: {c.client_id}, Montant: {c.amount_total})")
+        click.echo("\n=== Événements ===")
+        for e in event_rows(session):
+            click.echo(f"- {e.id}: {e.client_name} (Début: {e.event_date_start}, Lieu: {e.location})")
 
-    click.echo("\n=== Événements ===")
-    for e in events:
-        click.echo(f"- {e.id}: {e.client_name} (Début: {e.event_date_start}, Lieu: {e.location})")
+        click.echo("\n=== Roles ===")
+        for r in session.execute(select(Role.id, Role.name).order_by(Role.id)):
+            click.echo(f"- {r.id}: {r.name}")
 
-    click.echo("\n=== Roles ===")
-    for r in roles:
-        click.echo(f"- {r.id}: {r.name}")
 
-    session.close()
+# === Commande : Synchroniser la copie locale ===
+@cli.command()
+@click.option("--full", is_flag=True, help="Repartir d'une copie vide")
+@require_auth
+def sync(user, full):
+    """Mettre à jour la copie locale (lecture hors ligne avec --local)"""
+    with session_scope(SessionLocal) as session:
+        transferred = local_replica.sync(session, user, full=full)
+    for table, count in transferred.items():
+        click.echo(f"  {table} : {count} ligne(s) transférée(s)")
+    click.echo(f"✅ Copie locale à jour ({local_replica.LOCAL_DATABASE_PATH})")
+
+
+# === Commande : Resynchroniser les copies client des événements ===
+@cli.command()
+@click.option("--chunk-size", default=5000, show_default=True, help="Nombre d'ID d'événements par tranche")
+@require_role(["gestion"])
+def resync_events(chunk_size):
+    """Recopier nom et contact client dans tous les événements (réparation)"""
+    with session_scope(SessionLocal) as session:
+        def progress(done, total, changed):
+            click.echo(f"  {done}/{total} ID traités | {changed} événement(s) corrigé(s)")
+
+        changed = resync_all_events(session, chunk_size=chunk_size, progress=progress)
+    click.echo(f"✅ {changed} événement(s) resynchronisé(s)")
+
+
+# === Commande : Archiver les contrats et événements anciens ===
+@cli.command()
+@click.option("--days", default=RETENTION_DAYS, show_default=True, help="Ancienneté minimale (en jours)")
+@click.option("--batch-size", default=RETENTION_BATCH_SIZE, show_default=True, help="Contrats par lot")
+@click.option("--sleep", "sleep_seconds", default=RETENTION_SLEEP_SECONDS, show_default=True,
+              help="Pause entre deux lots (en secondes)")
+@click.option("--max-batches", type=int, help="Nombre maximum de lots pour cette exécution")
+@click.option("--include-unpaid", is_flag=True, help="Archiver aussi les contrats non soldés")
+@click.option("--policy", default="default", show_default=True, help="Nom de la politique (point de reprise)")
+@click.option("--restart", is_flag=True,
+              help="Abandonner un archivage inachevé commencé avec d'autres --days / --include-unpaid")
+@require_auth
+@require_role(["gestion"])
+def archive(user, days, batch_size, sleep_seconds, max_batches, include_unpaid, policy, restart):
+    """Déplacer les contrats et événements anciens vers les tables d'archive"""
+    with session_scope(SessionLocal) as session:
+        def progress(checkpoint):
+            click.echo(f"  … contrat #{checkpoint.last_contract_id} | {checkpoint.contracts_archived} contrat(s), "
+                       f"{checkpoint.events_archived} événement(s) archivé(s)")
+
+        def on_start(state, checkpoint):
+            if state == "resumed":
+                click.echo(f"🔁 Reprise de l'archivage en cours (avant le {checkpoint.cutoff:%Y-%m-%d}) "
+                           f"après le contrat #{checkpoint.last_contract_id}")
+            elif state == "restarted":
+                click.echo(f"♻️ Archivage inachevé abandonné : reprise à zéro avec {days} jour(s)"
+                           + (", impayés compris" if include_unpaid else ""))
+
+        try:
+            checkpoint = run_retention(session, policy=policy, days=days, batch_size=batch_size,
+                                       sleep_seconds=sleep_seconds, include_unpaid=include_unpaid,
+                                       max_batches=max_batches, progress=progress, restart=restart,
+                                       on_start=on_start)
+        except RetentionSettingsChanged as e:
+            raise click.ClickException(f"❌ {e} (option --restart)")
+        audit(user.get('name'), "retention.run", None, None, policy=policy, cutoff=checkpoint.cutoff,
+              contracts=checkpoint.contracts_archived, events=checkpoint.events_archived)
+        if checkpoint.finished_at is None:
+            click.echo("⏸️  Archivage interrompu : relancez la commande pour reprendre.")
+        click.echo(f"✅ {checkpoint.contracts_archived} contrat(s) et {checkpoint.events_archived} événement(s) "
+                   f"archivé(s) (avant le {checkpoint.cutoff:%Y-%m-%d})")
+
+
+# === Commande : Créer les partitions mensuelles à venir (Postgres) ===
+@cli.command()
+@click.option("--months-ahead", default=PARTITION_MONTHS_AHEAD, show_default=True)
+@require_role(["gestion"])
+def create_partitions(months_ahead):
+    """Créer à l'avance les partitions mensuelles de la table des événements"""
+    try:
+        names, skipped = ensure_partitions(engine, months_ahead=months_ahead)
+    except SQLAlchemyError as e:
+        raise click.ClickException(f"❌ Partitions non créées : {str(e.orig if hasattr(e, 'orig') else e).strip()}")
+    if not names and not skipped:
+        click.echo("ℹ️  La table des événements n'est pas partitionnée (Postgres uniquement).")
+        return
+    if names:
+        click.echo(f"✅ Partitions disponibles : {', '.join(names)}")
+    if skipped:
+        click.echo(f"⚠️  Partitions ignorées (lignes du mois déjà dans la partition par défaut) : "
+                   f"{', '.join(skipped)}")
+
+
+# === Commande : Consulter le journal d'audit ===
+@cli.command()
+@click.option("--actor", help="Nom de l'utilisateur à l'origine de l'action")
+@click.option("--entity", help="Type d'objet (user, contract, ...)")
+@click.option("--entity-id", type=int, help="ID de l'objet")
+@click.option("--since", type=click.DateTime(), help="Depuis (inclus)")
+@click.option("--until", type=click.DateTime(), help="Jusqu'à (exclus)")
+@click.option("--limit", default=50, show_default=True)
+@require_role(["gestion"])
+def audit_log(actor, entity, entity_id, since, until, limit):
+    """Rechercher dans le journal d'audit (seulement pour 'gestion')"""
+    with session_scope(SessionLocal) as session:
+        entries = query_audit_log(session, actor=actor, entity=entity, entity_id=entity_id,
+                                  since=since, until=until, limit=limit)
+        if not entries:
+            click.echo("❌ Aucune entrée trouvée.")
+        for a in entries:
+            target = f"{a.entity} #{a.entity_id}" if a.entity_id is not None else (a.entity or "-")
+            click.echo(f"  {a.created_at:%Y-%m-%d %H:%M:%S} | {a.actor} | {a.action} | {target} | {a.details or ''}")
+
+
+# === Commande : Flux de modifications (intégrations) ===
+@cli.command()
+@click.argument("cursor", type=int, default=0)
+@click.option("--entity", "entities", multiple=True, type=click.Choice(list(TRACKED)),
+              help="Limiter à un type d'objet (répétable)")
+@click.option("--limit", type=int, help="Nombre maximum de modifications")
+@require_role(["gestion"])
+def changes_since(cursor, entities, limit):
+    """Modifications postérieures au curseur, une ligne JSON par modification"""
+    with session_scope(SessionLocal) as session:
+        for change in iter_changes(session, cursor, limit=limit, entities=entities):
+            click.echo(json.dumps(change, default=str, ensure_ascii=False))
+
+
+# === Commande : Rapport chiffre d'affaires / encaissements ===
+@cli.command()
+@click.option("--by", "dimensions", multiple=True, type=click.Choice(reporting.DIMENSIONS),
+              help="Regroupement (répétable, défaut : commercial, mois et statut)")
+@click.option("--owner", help="Commercial en charge des contrats")
+@click.option("--json", "as_json", is_flag=True, help="Sortie JSON")
+@require_auth
+@require_role(["gestion", "commercial"])
+def report(user, dimensions, owner, as_json):
+    """Totaux, restes dus, taux d'encaissement, percentiles et ancienneté des contrats"""
+    criteria = []
+    scope = services.contract_scope(user)
+    if scope is not None:
+        criteria.append(scope)
+    if owner:
+        criteria.append(Contract.sales_contact == owner)
+    with session_scope(SessionLocal) as session:
+        data = reporting.load_contract_arrays(session, *criteria)
+    result = reporting.build_report(data, dimensions or reporting.DIMENSIONS)
+
+    if as_json:
+        click.echo(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+
+    click.echo(f"\n📊 {result['contracts']} contrat(s) | Total : {result['amount_total']:.2f} € | "
+               f"Restant : {result['amount_remaining']:.2f} € | Encaissé : {result['collection_ratio']:.1%}")
+    click.echo("\n=== Regroupements ===")
+    for g in result["groups"]:
+        key = " | ".join(g[d] for d in (dimensions or reporting.DIMENSIONS))
+        click.echo(f"  {key} : {g['count']} contrat(s) | Total : {g['amount_total']:.2f} € | "
+                   f"Restant : {g['amount_remaining']:.2f} € | Encaissé : {g['collection_ratio']:.1%}")
+    click.echo("\n=== Ancienneté des restes dus ===")
+    for b in result["aging"]:
+        click.echo(f"  {b['bucket']} : {b['count']} contrat(s) | {b['amount_remaining']:.2f} €")
+    click.echo("\n=== Percentiles ===")
+    for name, values in result["percentiles"].items():
+        if values:
+            click.echo(f"  {name} : " + ", ".join(f"{p} = {v}" for p, v in values.items()))
+
+
+# === Commande : Prévision des encaissements ===
+@cli.command()
+@click.option("--months", default=FORECAST_MONTHS, show_default=True, help="Horizon en mois civils")
+@click.option("--refresh", is_flag=True, help="Ignorer le cache")
+@click.option("--json", "as_json", is_flag=True, help="Sortie JSON")
+@require_role(["gestion"])
+def forecast(months, refresh, as_json):
+    """Prévoir les encaissements sur les contrats non soldés (courbes historiques par commercial)"""
+    with session_scope(SessionLocal) as session:
+        result, from_cache = cached_forecast(session, months=months, refresh=refresh)
+
+    if as_json:
+        click.echo(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+
+    click.echo(f"\n💶 Restant dû : {result['outstanding']:.2f} € | Attendu sur {result['months']} mois : "
+               f"{result['expected']:.2f} € ({result['history']} contrat(s) soldé(s) en historique"
+               f"{', depuis le cache' if from_cache else ''})")
+    for p in result["periods"]:
+        click.echo(f"  {p['month']} : {p['expected']:.2f} €")
+    click.echo("\n=== Par commercial ===")
+    for c in result["by_commercial"]:
+        click.echo(f"  {c['commercial']} : {c['expected']:.2f} € attendus sur {c['outstanding']:.2f} € "
+                   f"({c['open_contracts']} contrat(s), courbe {'propre' if c['curve'] == 'own' else 'globale'})")
+
+
+# === Commande : Rappels des événements à venir ===
+@cli.command()
+@click.option("--windows", default=event_reminders.REMINDER_WINDOWS, show_default=True,
+              help="Fenêtres avant le début de l'événement (m, h, d)")
+@click.option("--notifier", default=event_reminders.REMINDER_NOTIFIER, show_default=True,
+              help="stdout ou file:<chemin>")
+@click.option("--daemon", is_flag=True, help="Tourner en continu")
+@click.option("--interval", default=event_reminders.REMINDER_INTERVAL_SECONDS, show_default=True,
+              help="Secondes entre deux passages (mode daemon)")
+@require_role(["gestion"])
+def reminders(windows, notifier, daemon, interval):
+    """Envoyer les rappels des événements qui commencent bientôt"""
+    try:
+        windows = event_reminders.parse_windows(windows)
+        notifier = event_reminders.get_notifier(notifier)
+    except ValueError as e:
+        click.echo(f"❌ {e}")
+        return
+
+    if daemon:
+        click.echo(f"⏰ Planificateur démarré (toutes les {interval} s, Ctrl+C pour arrêter)")
+        metrics.start_periodic_writer()
+        try:
+            event_reminders.run_daemon(SessionLocal, notifier, windows, interval=interval)
+        except KeyboardInterrupt:
+            click.echo("⏹️ Planificateur arrêté.")
+        return
+
+    with session_scope(SessionLocal) as session:
+        sent = event_reminders.run_tick(session, notifier, windows)
+    click.echo(f"✅ {len(sent)} rappel(s) envoyé(s)")
+
+
+# === Commandes : Sharding ===
+def _shard_router():
+    if sharding.router is None:
+        raise click.ClickException("❌ Sharding non configuré (variable SHARD_URLS).")
+    return sharding.router
+
+
+@cli.command()
+@require_role(["gestion"])
+def shard_status():
+    """Afficher le nombre de clients par shard"""
+    for name, count in sharding.shard_counts(_shard_router()).items():
+        click.echo(f"  {name} : {count} client(s)")
+
+
+@cli.command()
+@click.argument("client_id", type=int)
+@click.argument("target")
+@require_role(["gestion"])
+def shard_move(client_id, target):
+    """Déplacer un client (avec ses contrats et événements) vers un autre shard"""
+    router = _shard_router()
+    if target not in router.names:
+        click.echo(f"❌ Shard inconnu. Choisissez parmi : {', '.join(router.names)}")
+        return
+    try:
+        moved = sharding.move_client(router, client_id, target)
+    except sharding.ClientMoved as e:
+        raise click.ClickException(f"❌ {e}")
+    click.echo(f"✅ {moved} ligne(s) déplacée(s) vers {target}")
+
+
+@cli.command()
+@click.option("--limit", type=int, help="Nombre maximum de clients déplacés")
+@click.option("--dry-run", is_flag=True, help="Afficher le plan sans rien déplacer")
+@require_role(["gestion"])
+def shard_rebalance(limit, dry_run):
+    """Équilibrer le nombre de clients entre les shards"""
+    router = _shard_router()
+    if dry_run:
+        plan = sharding.plan_rebalance(router)[:limit]
+        for client_id, source, target in plan:
+            click.echo(f"  client {client_id} : {source} -> {target}")
+        click.echo(f"📋 {len(plan)} déplacement(s) prévu(s)")
+        return
+
+    def progress(done, total, client_id, source, target):
+        click.echo(f"  {done}/{total} client {client_id} : {source} -> {target}")
+
+    try:
+        plan = sharding.rebalance(router, limit=limit, progress=progress)
+    except sharding.ClientMoved as e:
+        raise click.ClickException(f"❌ {e}")
+    click.echo(f"✅ {len(plan)} client(s) déplacé(s)")
+
+
+# === Commande : Synthèse du journal des requêtes lentes ===
+@cli.command()
+@click.option("--top", default=20, show_default=True, help="Nombre de requêtes affichées")
+@click.option("--plans", is_flag=True, help="Afficher un plan EXPLAIN par requête")
+@click.option("--json", "as_json", is_flag=True, help="Sortie JSON")
+@require_role(["gestion"])
+def slow_queries(top, plans, as_json):
+    """Requêtes lentes regroupées par forme normalisée (temps total décroissant)"""
+    summary = slowlog.summarize(slowlog.read_entries(slowlog.SLOW_QUERY_LOG), top=top)
+    if as_json:
+        click.echo(json.dumps(summary, ensure_ascii=False, indent=2))
+        return
+    if not summary:
+        click.echo(f"✅ Aucune requête au-dessus de {slowlog.SLOW_QUERY_MS:g} ms.")
+        return
+    for s in summary:
+        scans = f" | ⚠️ Seq Scan dans {s['seq_scans']}/{s['plans']} plan(s)" if s["seq_scans"] else ""
+        click.echo(f"\n🐢 {s['count']}x | total {s['total_ms']} ms | moy. {s['mean_ms']} ms | "
+                   f"p95 {s['p95_ms']} ms | max {s['max_ms']} ms | {', '.join(s['commands']) or '-'}{scans}")
+        click.echo(f"  {s['normalized'][:500]}")
+        if plans and s["example_plan"]:
+            click.echo("  " + s["example_plan"].replace("\n", "\n  "))
+
+
+# === Commandes : Détection et fusion des doublons de clients ===
+@cli.command(name="dedup")
+@click.option("--threshold", default=dedup.DEDUP_THRESHOLD, show_default=True,
+              help="Similarité minimale des noms proches (0-1)")
+@click.option("--limit", default=20, show_default=True, help="Nombre de groupes affichés")
+@click.option("--json", "as_json", is_flag=True, help="Sortie JSON (tous les groupes)")
+@require_role(["gestion"])
+def dedup_clients(threshold, limit, as_json):
+    """Lister les groupes de clients probablement en double"""
+    binds = sharding.router.engines.values() if sharding.router else [engine]
+    indexed = sum(dedup.index_missing(bind) for bind in binds)
+    with session_scope(SessionLocal) as session:
+        clusters, stats = dedup.find_clusters(session, threshold=threshold)
+        if as_json:
+            click.echo(json.dumps({"stats": stats, "clusters": clusters}, ensure_ascii=False, indent=2))
+            return
+        if indexed:
+            click.echo(f"🔑 {indexed} client(s) indexé(s)")
+        if not clusters:
+            click.echo(f"✅ Aucun doublon parmi {stats['clients']} client(s).")
+            return
+
+        for cluster in clusters[:limit]:
+            click.echo(f"\n👥 {len(cluster['ids'])} clients | {', '.join(cluster['reasons'])} | "
+                       f"similarité {cluster['similarity']:.2f}")
+            contracts = dict(session.execute(
+                select(Contract.client_id, func.count()).where(Contract.client_id.in_(cluster["ids"]))
+                .group_by(Contract.client_id)
+            ).all())
+            for c in session.query(Client).filter(Client.id.in_(cluster["ids"])).order_by(Client.id):
+                click.echo(f"  ID: {c.id} | {search_index._plain(c.name)} | {search_index._plain(c.company)} | "
+                           f"{search_index._plain(c.email)} | Commercial: {c.sales_contact} | "
+                           f"Contrats: {contracts.get(c.id, 0)}")
+    click.echo(f"\n📋 {stats['clusters']} groupe(s), {len(clusters[:limit])} affiché(s) | "
+               f"{stats['clients']} client(s) analysé(s)")
+    if stats["skipped_buckets"]:
+        click.echo(f"⚠️ {stats['skipped_buckets']} seau(x) LSH trop grand(s) ignoré(s) (noms très courants)")
+
+
+@cli.command()
+@click.argument("keep_id", type=int)
+@click.argument("duplicate_ids", type=int, nargs=-1, required=True)
+@click.option("--yes", is_flag=True, help="Ne pas demander de confirmation")
+@require_auth
+@require_role(["gestion"])
+def dedup_merge(user, keep_id, duplicate_ids, yes):
+    """Fusionner des doublons : contrats rattachés à KEEP_ID, doublons supprimés"""
+    if not yes and not click.confirm(
+            f"Rattacher les contrats de {', '.join(map(str, duplicate_ids))} au client {keep_id} "
+            f"et supprimer ces doublons ?"):
+        click.echo("❌ Fusion annulée.")
+        return
+    with session_scope(SessionLocal) as session:
+        try:
+            result = dedup.merge_clients(session, keep_id, duplicate_ids)
+        except ValueError as e:
+            raise click.ClickException(f"❌ {e}")
+        session.commit()
+    audit(user.get('name'), "client.merge", "client", keep_id,
+          removed=result["removed"], contracts=result["contracts"])
+    click.echo(f"✅ {len(result['contracts'])} contrat(s) rattaché(s) au client {keep_id}, "
+               f"{len(result['removed'])} doublon(s) supprimé(s), {result['events']} événement(s) mis à jour")
+
+
+# === Commande : Exécuter un fichier d'opérations (sans saisie) ===
+@cli.command()
+@click.argument("path", type=click.File("r"))
+@click.option("--batch-size", default=batch.BATCH_SIZE, show_default=True, help="Opérations par transaction")
+@click.option("--stop-on-error", is_flag=True, help="S'arrêter à la première opération en erreur")
+@click.option("--dry-run", is_flag=True, help="Tout exécuter puis annuler")
+@click.option("--report", type=click.File("w"), default="-", help="Résultats JSONL (sortie standard par défaut)")
+@require_auth
+def run_batch(user, path, batch_size, stop_on_error, dry_run, report):
+    """Exécuter les opérations d'un fichier JSONL (create_client, update_contract, assign_support...)"""
+    with session_scope(SessionLocal) as session:
+        started = datetime.utcnow()
+        counts = {"ok": 0, "error": 0}
+        for result in batch.run_batch(session, user, batch.read_operations(path), batch_size=batch_size,
+                                      stop_on_error=stop_on_error, dry_run=dry_run):
+            counts[result["status"]] += 1
+            report.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+    elapsed = max((datetime.utcnow() - started).total_seconds(), 1e-6)
+    total = counts["ok"] + counts["error"]
+    suffix = " (simulation : rien n'a été enregistré)" if dry_run else ""
+    click.echo(f"✅ {counts['ok']} opération(s) réussie(s), ❌ {counts['error']} en erreur | "
+               f"{total / elapsed * 60:.0f} op/min{suffix}", err=True)
+    if counts["error"]:
+        raise SystemExit(1)
+
+
+# === Commande : Recherche plein texte ===
+@cli.command()
+@click.argument("terms", required=False)
+@click.option("--limit", default=20, show_default=True, help="Nombre maximum de résultats")
+@click.option("--rebuild", is_flag=True, help="Reconstruire l'index à partir des tables (gestion)")
+@require_auth
+def search(user, terms, limit, rebuild):
+    """Rechercher dans les notes, lieux, clients des événements et entreprises"""
+    with session_scope(SessionLocal) as session:
+        if rebuild:
+            if user.get('role') != "gestion":
+                click.echo("⛔ Seule l'équipe gestion peut reconstruire l'index.")
+                return
+            total = search_index.rebuild_search_index(session)
+            session.commit()
+            click.echo(f"✅ Index reconstruit : {total} document(s)")
+            return
+
+        if not terms:
+            terms = click.prompt("Recherche")
+
+        hits = search_index.search(session, terms, limit=limit, user=user)
+        if not hits:
+            click.echo("❌ Aucun résultat.")
+            return
+
+        click.echo(f"\n🔎 {len(hits)} résultat(s) pour « {terms} » :")
+        for hit in hits:
+            label = "Événement" if hit.entity == "event" else "Client"
+            click.echo(f"  {label} ID: {hit.entity_id} | Score: {hit.score:.2f} | {hit.excerpt}")
 
 
 @cli.command()
@@ -676,32 +1186,31 @@ def encrypt_existing_clients():
     from crm.database import SessionLocal
     from crm.auth import encrypt_data, decrypt_data
 
-    session = SessionLocal()
-    clients = session.query(Client).all()
-    updated_count = 0
-
-    for client in clients:
-        click.echo(f"Client ID {client.id} - Données : " +
-                   f"name={client.name}, email={client.email}, phone={client.phone}, company={client.company}")
-        updated = False
-        click.echo(f"\nClient ID {client.id} - données actuelles :")
-        for field in ['name', 'email', 'phone', 'company']:
-            value = getattr(client, field)
-            click.echo(f"  {field}: {value}")
-            if not value:
-                continue
-            try:
-                decrypt_data(value)
-                click.echo(f"  {field} déjà chiffré")
-            except Exception as e:
-                click.echo(f"  {field} non chiffré ou erreur décryptage ({e}) - chiffrement en cours...")
-                setattr(client, field, encrypt_data(value))
-                updated = True
-        if updated:
-            updated_count += 1
-
-    session.commit()
-    session.close()
+    with session_scope(SessionLocal) as session:
+        clients = session.query(Client).all()
+        updated_count = 0
+
+        for client in clients:
+            click.echo(f"Client ID {client.id} - Données : " +
+                       f"name={client.name}, email={client.email}, phone={client.phone}, company={client.company}")
+            updated = False
+            click.echo(f"\nClient ID {client.id} - données actuelles :")
+            for field in ['name', 'email', 'phone', 'company']:
+                value = getattr(client, field)
+                click.echo(f"  {field}: {value}")
+                if not value:
+                    continue
+                try:
+                    decrypt_data(value)
+                    click.echo(f"  {field} déjà chiffré")
+                except Exception as e:
+                    click.echo(f"  {field} non chiffré ou erreur décryptage ({e}) - chiffrement en cours...")
+                    setattr(client, field, encrypt_data(value))
+                    updated = True
+            if updated:
+                updated_count += 1
+
+        session.commit()
     click.echo(f"\n✅ Données chiffrées pour {updated_count} client(s)")
 
 
@@ -1,13 +1,175 @@
 import os
+import time
+import itertools
+import threading
+import click
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.sql.dml import UpdateBase
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Répliques en lecture seule (URLs séparées par des virgules)
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# Commandes servies par les répliques (les autres vont toujours sur la base principale)
+READ_REPLICA_COMMANDS = os.getenv(
+    "READ_REPLICA_COMMANDS",
+    "list-all,list-users,list-events-no-support,list-events-support,list-contracts-unsigned-unpaid,audit-log",
+)
+
+# Après une écriture, les lectures restent sur la base principale pendant ce délai (en secondes)
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 5))
+READ_YOUR_WRITES_FILE = ".last_write"
+
+# Une réplique injoignable est écartée pendant ce délai (en secondes)
+REPLICA_RETRY_SECONDS = 30
+
 engine = create_engine(DATABASE_URL, echo=False)
-SessionLocal = sessionmaker(bind=engine)
+replica_engines = [create_engine(url, echo=False, pool_pre_ping=True) for url in DATABASE_REPLICA_URLS]
 
 Base = declarative_base()
+
+
+def current_command_name():
+    """Nom de la commande click en cours d'exécution (ex: "list-all"), ou None"""
+    ctx = click.get_current_context(silent=True)
+    return ctx.command.name if ctx is not None else None
+
+
+class ReplicaRouter:
+    """Choisit la base à utiliser pour les lectures d'une commande."""
+
+    def __init__(self, primary, replicas, commands, read_your_writes=READ_YOUR_WRITES_SECONDS,
+                 state_file=READ_YOUR_WRITES_FILE):
+        self.primary = primary
+        self.replicas = list(replicas)
+        if isinstance(commands, str):
+            commands = [c.strip() for c in commands.split(",")]
+        self.commands = {c.replace("_", "-") for c in commands if c}
+        self.read_your_writes = read_your_writes
+        self.state_file = state_file
+        self.last_write = 0.0
+        self._cycle = itertools.cycle(self.replicas)
+        self._down_until = {}
+        self._lock = threading.Lock()
+
+    def record_write(self):
+        """Mémorise l'heure de la dernière écriture (partagée entre processus via un fichier)"""
+        self.last_write = time.time()
+        if self.state_file:
+            try:
+                with open(self.state_file, "w") as f:
+                    f.write(str(self.last_write))
+            except OSError:
+                pass
+
+    def _last_write(self):
+        last_write = self.last_write
+        if self.state_file and os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, "r") as f:
+                    last_write = max(last_write, float(f.read().strip() or 0))
+            except (OSError, ValueError):
+                pass
+        return last_write
+
+    def reads_from_replica(self, command):
+        if not self.replicas or command is None:
+            return False
+        if command.replace("_", "-") not in self.commands:
+            return False
+        return time.time() - self._last_write() >= self.read_your_writes
+
+    def replica(self):
+        """Réplique disponible suivante (tourniquet), ou la base principale à défaut"""
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                candidate = next(self._cycle)
+                if self._down_until.get(candidate, 0) > time.monotonic():
+                    continue
+                try:
+                    with candidate.connect():
+                        pass
+                    return candidate
+                except Exception:
+                    self._down_until[candidate] = time.monotonic() + REPLICA_RETRY_SECONDS
+        return self.primary
+
+
+class RoutingSession(Session):
+    """Session qui envoie les lectures des commandes configurées vers une réplique.
+
+    Les écritures (flush, INSERT/UPDATE/DELETE) vont toujours sur la base principale,
+    de même que `session.connection()` sans requête (utilisé pour les écritures hors ORM).
+    La réplique est choisie une fois par session pour garder des lectures cohérentes ;
+    dès la première écriture, la session reste sur la base principale jusqu'à sa fermeture
+    (sinon elle relirait sur la réplique des données qu'elle vient d'écrire).
+    """
+
+    def __init__(self, router=None, **kw):
+        super().__init__(**kw)
+        self.router = router
+        self._read_bind = None
+        self._has_written = False
+        self._pinned = False
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        router = self.router
+        if isinstance(clause, UpdateBase):
+            self._has_written = self._pinned = True
+        if router is None or self._flushing or isinstance(clause, UpdateBase):
+            return super().get_bind(mapper=mapper, clause=clause, **kw)
+        if (self._pinned or (mapper is None and clause is None) or self.info.get("route") == "primary"
+                or not router.reads_from_replica(current_command_name())):
+            return router.primary
+        if self._read_bind is None:
+            self._read_bind = router.replica()
+        return self._read_bind
+
+    def close(self):
+        super().close()
+        self._pinned = False
+        self._read_bind = None
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _mark_written(session, flush_context):
+    session._has_written = session._pinned = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _remember_write(session):
+    if session._has_written and session.router is not None and session.router.replicas:
+        session.router.record_write()
+    session._has_written = False
+
+
+router = ReplicaRouter(engine, replica_engines, READ_REPLICA_COMMANDS)
+SessionLocal = sessionmaker(bind=engine, class_=RoutingSession, router=router)
+
+
+# === Bases des données clients : une seule, ou une par shard (crm/sharding.py) ===
+# Identifiant de la base principale (annuaire, utilisateurs, change_log...) dans une session répartie
+DIRECTORY = "directory"
+
+
+def shard_ids(session):
+    """Shards à parcourir pour une écriture hors ORM (clients, contrats, événements, index de
+    recherche) : tous les shards d'une session répartie, sinon [None]"""
+    router = session.info.get("shard_router")
+    return list(router.names) if router is not None else [None]
+
+
+def shard_connection(session, shard_id=None):
+    """Connexion de la session vers un shard (None : base unique)"""
+    return session.connection(bind_arguments={"shard_id": shard_id}) if shard_id else session.connection()
+
+
+def directory_connection(session):
+    """Connexion de la session vers la base principale, qui porte les tables globales (change_log)
+    et leurs séquences uniques, même sous sharding"""
+    return shard_connection(session, DIRECTORY if session.info.get("shard_router") is not None else None)
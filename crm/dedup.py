@@ -0,0 +1,349 @@
+import hashlib
+import hmac
+import os
+import re
+import unicodedata
+from collections import Counter
+import numpy as np
+from sqlalchemy import bindparam, delete, event, func, inspect, or_, select, update
+from sqlalchemy.orm.attributes import flag_modified
+from .auth import ENCRYPTION_KEY
+from .backfill import run_backfill
+from .changefeed import record_changes
+from .database import directory_connection, shard_connection, shard_ids
+from .models import Client, Contract, utcnow
+from .propagation import propagate_clients
+from .search import _plain, remove_document
+
+
+# Signature MinHash : DEDUP_BANDS bandes de DEDUP_PERMUTATIONS / DEDUP_BANDS valeurs
+DEDUP_PERMUTATIONS = 32
+DEDUP_BANDS = 8
+# Similarité (Jaccard estimée) minimale de deux clients proches
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", 0.6))
+# Les seaux LSH plus grands (nom très courant) sont ignorés
+DEDUP_MAX_BUCKET = int(os.getenv("DEDUP_MAX_BUCKET", 100))
+DEDUP_CHUNK_SIZE = int(os.getenv("DEDUP_CHUNK_SIZE", 10000))
+# À incrémenter quand le calcul des clés change (normalisation, mots ignorés) : tout est recalculé
+DEDUP_KEYS_VERSION = 1
+
+# Mots ignorés dans les noms : formes juridiques, articles, civilités
+STOP_WORDS = {
+    "sa", "sas", "sasu", "sarl", "eurl", "sci", "scop", "inc", "ltd", "llc", "gmbh", "cie", "co",
+    "et", "de", "du", "des", "la", "le", "les", "l", "d", "the", "and", "of", "m", "mme", "mr", "mrs",
+}
+
+# Clé dérivée de la clé de chiffrement : sans elle, les index ne permettent pas de tester une valeur
+_KEY = hmac.new(ENCRYPTION_KEY.encode(), b"crm-blind-index", hashlib.sha256).digest()
+_rng = np.random.default_rng(int.from_bytes(_KEY[:8], "big"))
+# Hachage multiplicatif (a * x + b) >> 32, une paire (a impair, b) par permutation
+_A = _rng.integers(1, 2 ** 63, DEDUP_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2 ** 63, DEDUP_PERMUTATIONS, dtype=np.uint64)
+_BAND_MIX = _rng.integers(1, 2 ** 63, DEDUP_PERMUTATIONS // DEDUP_BANDS, dtype=np.uint64) | np.uint64(1)
+
+
+# === Normalisation et clés ===
+def normalize_email(value):
+    value = (value or "").strip().lower()
+    local, _, domain = value.partition("@")
+    if not domain:
+        return value
+    return f"{local.split('+', 1)[0]}@{domain}"
+
+
+def normalize_phone(value):
+    """Chiffres seuls, sans indicatif : 06 01 02 03 04 et +33 6 01 02 03 04 donnent la même clé"""
+    digits = re.sub(r"\D", "", value or "")
+    return digits[-9:] if len(digits) >= 9 else digits
+
+
+def name_tokens(*values):
+    """Mots normalisés (sans accents, ni casse, ni formes juridiques), triés"""
+    text = unicodedata.normalize("NFKD", " ".join(v for v in values if v))
+    text = text.encode("ascii", "ignore").decode().lower()
+    return sorted(set(re.findall(r"[a-z0-9]+", text)) - STOP_WORDS)
+
+
+def blind_index(kind, value):
+    """HMAC tronqué d'une valeur normalisée (None si vide)"""
+    if not value:
+        return None
+    return hmac.new(_KEY, f"{kind}:{value}".encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def shingles(tokens):
+    """Trigrammes de caractères de chaque mot : tolèrent les fautes de frappe"""
+    grams = set()
+    for token in tokens:
+        padded = f" {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def minhash(grams):
+    """Signature MinHash (uint32) d'un ensemble de trigrammes, hachés avec la clé secrète"""
+    if not grams:
+        return None
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(g.encode(), key=_KEY, digest_size=8).digest(), "big") for g in grams],
+        dtype=np.uint64,
+    )
+    return ((_A[:, None] * hashes[None, :] + _B[:, None]) >> np.uint64(32)).min(axis=1).astype(np.uint32)
+
+
+def client_keys(name, email, phone, company):
+    """Colonnes de détection des doublons, à partir des valeurs (chiffrées ou non) d'un client"""
+    tokens = name_tokens(_plain(name), _plain(company))
+    signature = minhash(shingles(tokens))
+    return {
+        "email_bidx": blind_index("email", normalize_email(_plain(email))),
+        "phone_bidx": blind_index("phone", normalize_phone(_plain(phone))),
+        "name_bidx": blind_index("name", " ".join(tokens)),
+        "name_minhash": signature.tobytes() if signature is not None else None,
+        # Posée même quand les clés sont vides (nom fait de mots ignorés) : la ligne n'est pas reprise
+        "dedup_keys_version": DEDUP_KEYS_VERSION,
+    }
+
+
+KEY_SOURCES = ("name", "email", "phone", "company")
+
+
+@event.listens_for(Client, "before_insert")
+@event.listens_for(Client, "before_update")
+def _update_client_keys(mapper, connection, target):
+    state = inspect(target)
+    if state.persistent and not any(state.attrs[f].history.has_changes() for f in KEY_SOURCES):
+        # Clés inchangées : la version en base est conservée (sinon remise à NULL par onupdate)
+        target.dedup_keys_version = Client.__table__.c.dedup_keys_version
+        return
+    for column, value in client_keys(*(getattr(target, f) for f in KEY_SOURCES)).items():
+        setattr(target, column, value)
+    # Écrite même si elle n'a pas changé, sinon onupdate la remettrait à NULL
+    flag_modified(target, "dedup_keys_version")
+
+
+def _index_chunk(connection, keys):
+    clients = Client.__table__
+    rows = connection.execute(
+        select(clients.c.id, *(clients.c[f] for f in KEY_SOURCES)).where(clients.c.id.in_(keys))
+    ).all()
+    params = [{"_id": row.id, **client_keys(*row[1:])} for row in rows]
+    # last_updated inchangé : ces colonnes techniques ne déclenchent pas de synchronisation
+    connection.execute(
+        update(clients).where(clients.c.id == bindparam("_id"))
+        .values(last_updated=clients.c.last_updated, **{c: bindparam(c) for c in params[0] if c != "_id"}),
+        params,
+    )
+
+
+def index_missing(bind, progress=None):
+    """Calcule les clés des clients qui n'en ont pas ou dont les clés sont périmées (données
+    antérieures, insertions ou UPDATE hors ORM, nouvelle version du calcul).
+    Reprise par lots de run_backfill : une interruption reprend au dernier lot."""
+    clients = Client.__table__
+    version = clients.c.dedup_keys_version
+    return run_backfill(bind, "dedup_client_keys", clients, apply=_index_chunk,
+                        where=(or_(version.is_(None), version < DEDUP_KEYS_VERSION),),
+                        batch_size=DEDUP_CHUNK_SIZE, rows_per_second=0, progress=progress, repeat=True)
+
+
+# === Recherche des groupes de doublons ===
+class _UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        root = self.parent.setdefault(x, x)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        while x != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        self.parent[self.find(a)] = self.find(b)
+
+
+def _shared_keys(session, column):
+    """Clés d'index aveugle portées par plusieurs clients.
+
+    Sous sharding, un doublon recréé par un autre commercial est en général sur un
+    autre shard : les comptes par clé de chaque shard sont additionnés (un GROUP BY
+    par shard ne verrait que les doublons d'un même shard).
+    """
+    shards = shard_ids(session)
+    if shards == [None]:
+        return session.execute(
+            select(column).where(column.isnot(None)).group_by(column).having(func.count() > 1)
+        ).scalars().all()
+    counts = Counter()
+    for shard_id in shards:
+        for key, count in shard_connection(session, shard_id).execute(
+                select(column, func.count()).where(column.isnot(None)).group_by(column)):
+            counts[key] += count
+    return [key for key, count in counts.items() if count > 1]
+
+
+def exact_groups(session):
+    """Groupes de clients partageant un index aveugle : (raison, [ids])"""
+    for reason, column in (("email", Client.email_bidx), ("phone", Client.phone_bidx), ("name", Client.name_bidx)):
+        shared = _shared_keys(session, column)
+        rows = []
+        for start in range(0, len(shared), DEDUP_CHUNK_SIZE):
+            # Sous sharding, résultats concaténés shard par shard : triés ensuite
+            rows += session.execute(
+                select(column, Client.id).where(column.in_(shared[start:start + DEDUP_CHUNK_SIZE]))
+            ).all()
+        group, current = [], None
+        for key, client_id in sorted(rows):
+            if key != current and len(group) > 1:
+                yield reason, group
+            if key != current:
+                group, current = [], key
+            group.append(client_id)
+        if len(group) > 1:
+            yield reason, group
+
+
+def load_signatures(session):
+    """ID et signatures MinHash de tous les clients, lus par paquets"""
+    result = session.execute(
+        select(Client.id, Client.name_minhash).where(Client.name_minhash.isnot(None)).order_by(Client.id)
+        .execution_options(yield_per=DEDUP_CHUNK_SIZE)
+    )
+    ids, blobs = [], []
+    for partition in result.partitions():
+        ids.append(np.fromiter((row[0] for row in partition), dtype=np.int64, count=len(partition)))
+        blobs.append(np.frombuffer(b"".join(row[1] for row in partition), dtype=np.uint32))
+    if not ids:
+        return np.empty(0, dtype=np.int64), np.empty((0, DEDUP_PERMUTATIONS), dtype=np.uint32)
+    return np.concatenate(ids), np.concatenate(blobs).reshape(-1, DEDUP_PERMUTATIONS)
+
+
+def lsh_pairs(signatures, threshold=DEDUP_THRESHOLD, max_bucket=DEDUP_MAX_BUCKET):
+    """Paires (i, j, similarité) de signatures proches, sans comparer tous les clients deux à deux.
+
+    Chaque bande de la signature est réduite à une clé : deux clients qui
+    partagent une clé dans au moins une bande sont candidats, puis leur
+    similarité estimée (part des valeurs MinHash égales) est vérifiée.
+    Retourne aussi le nombre de seaux ignorés car trop grands.
+    """
+    n = len(signatures)
+    rows = DEDUP_PERMUTATIONS // DEDUP_BANDS
+    bands = signatures.astype(np.uint64).reshape(n, DEDUP_BANDS, rows)
+    band_keys = (bands * _BAND_MIX).sum(axis=2)
+    candidates, skipped = set(), 0
+    for b in range(DEDUP_BANDS):
+        order = np.argsort(band_keys[:, b], kind="stable")
+        keys = band_keys[order, b]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+        skipped += int((sizes > max_bucket).sum())
+        kept = (sizes > 1) & (sizes <= max_bucket)
+        for start, size in zip(starts[kept], sizes[kept]):
+            members = sorted(order[start:start + size].tolist())
+            candidates.update((a, c) for k, a in enumerate(members) for c in members[k + 1:])
+    if not candidates:
+        return [], skipped
+    pairs = np.array(sorted(candidates), dtype=np.int64)
+    similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+    keep = similarity >= threshold
+    return [(int(i), int(j), float(s)) for (i, j), s in zip(pairs[keep], similarity[keep])], skipped
+
+
+def find_clusters(session, threshold=DEDUP_THRESHOLD):
+    """Groupes de doublons probables : correspondances exactes (index aveugles) et noms proches (LSH).
+
+    Retourne (groupes, statistiques) ; chaque groupe indique ses ID, les
+    raisons du rapprochement et la meilleure similarité de nom.
+    """
+    clusters = _UnionFind()
+    reasons, similarity = {}, {}
+
+    def link(ids, reason, score=1.0):
+        for other in ids[1:]:
+            clusters.union(ids[0], other)
+        for client_id in ids:
+            reasons.setdefault(client_id, set()).add(reason)
+            similarity[client_id] = max(similarity.get(client_id, 0.0), score)
+
+    exact = 0
+    for reason, ids in exact_groups(session):
+        link(ids, reason)
+        exact += 1
+
+    ids, signatures = load_signatures(session)
+    pairs, skipped = lsh_pairs(signatures, threshold)
+    for i, j, score in pairs:
+        link([int(ids[i]), int(ids[j])], "similar", score)
+
+    groups = {}
+    for client_id in list(clusters.parent):
+        groups.setdefault(clusters.find(client_id), []).append(client_id)
+    result = [
+        {
+            "ids": sorted(members),
+            "reasons": sorted(set().union(*(reasons[m] for m in members))),
+            "similarity": round(max(similarity[m] for m in members), 3),
+        }
+        for members in groups.values()
+    ]
+    result.sort(key=lambda c: (-len(c["ids"]), -c["similarity"], c["ids"][0]))
+    stats = {"clients": int(len(ids)), "exact_groups": exact, "similar_pairs": len(pairs),
+             "skipped_buckets": skipped, "clusters": len(result)}
+    return result, stats
+
+
+# === Fusion ===
+def _merge_shard(session, keep_id, duplicate_ids):
+    """Shard commun aux clients à fusionner (None sans sharding)"""
+    router = session.info.get("shard_router")
+    if router is None:
+        return None
+    shards = {client_id: router.client_shard(client_id) for client_id in (keep_id, *duplicate_ids)}
+    if shards[keep_id] is None:
+        raise ValueError(f"Client {keep_id} absent de l'annuaire des shards.")
+    elsewhere = sorted(client_id for client_id, shard in shards.items() if shard != shards[keep_id])
+    if elsewhere:
+        raise ValueError(f"Client(s) {', '.join(map(str, elsewhere))} sur un autre shard que le client {keep_id} : "
+                         f"déplacez-les d'abord avec `shard-move`.")
+    return shards[keep_id]
+
+
+def merge_clients(session, keep_id, duplicate_ids):
+    """Rattache au client conservé tous les contrats des doublons (un seul UPDATE), puis supprime
+    les doublons. Les copies client des événements sont rafraîchies.
+    Sous sharding, tous les clients doivent être sur le shard du client conservé.
+    Retourne un résumé ; la transaction est à valider par l'appelant.
+    """
+    duplicate_ids = sorted(set(duplicate_ids) - {keep_id})
+    keep = session.get(Client, keep_id)
+    if keep is None:
+        raise ValueError(f"Client {keep_id} introuvable.")
+    found = session.execute(select(Client.id).where(Client.id.in_(duplicate_ids))).scalars().all()
+    missing = sorted(set(duplicate_ids) - set(found))
+    if missing:
+        raise ValueError(f"Client(s) introuvable(s) : {', '.join(map(str, missing))}")
+
+    shard_id = _merge_shard(session, keep_id, duplicate_ids)
+    connection = shard_connection(session, shard_id)
+    contract_ids = connection.execute(
+        select(Contract.id).where(Contract.client_id.in_(duplicate_ids))
+    ).scalars().all()
+    if contract_ids:
+        connection.execute(
+            update(Contract).where(Contract.id.in_(contract_ids))
+            .values(client_id=keep_id, last_updated=utcnow(), version_id=Contract.version_id + 1)
+        )
+        record_changes(directory_connection(session), "contract", contract_ids, "update")
+    event_ids = propagate_clients(session, shard_id, [keep_id])
+
+    connection.execute(delete(Client.__table__).where(Client.__table__.c.id.in_(duplicate_ids)))
+    for client_id in duplicate_ids:
+        remove_document(connection, "client", client_id)
+    record_changes(directory_connection(session), "client", duplicate_ids, "delete")
+    for client_id in duplicate_ids:
+        obj = session.identity_map.get(session.identity_key(Client, client_id))
+        if obj is not None:
+            session.expunge(obj)
+    return {"kept": keep_id, "removed": duplicate_ids, "contracts": sorted(contract_ids), "events": len(event_ids)}
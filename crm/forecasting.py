@@ -0,0 +1,143 @@
+import json
+import os
+from datetime import datetime
+import numpy as np
+from sqlalchemy import func, or_, select
+from .metrics import CACHE_REQUESTS
+from .models import ChangeLog, Contract
+from .partitioning import add_months, month_start
+
+
+FORECAST_MONTHS = int(os.getenv("FORECAST_MONTHS", 3))
+# En dessous de ce nombre de contrats soldés, on utilise la courbe de tous les commerciaux
+FORECAST_MIN_HISTORY = int(os.getenv("FORECAST_MIN_HISTORY", 20))
+FORECAST_CACHE_FILE = os.getenv("FORECAST_CACHE_FILE", ".forecast_cache.json")
+
+SECONDS_PER_DAY = 86400.0
+_not_cancelled = or_(Contract.status.is_(None), Contract.status != "cancelled")
+
+
+def _days(start, end):
+    """Écart en jours (float) entre deux tableaux datetime64"""
+    return (end - start).astype("timedelta64[s]").astype(np.float64) / SECONDS_PER_DAY
+
+
+def _columns(session, *criteria):
+    rows = session.execute(
+        select(Contract.sales_contact, Contract.created_at, Contract.paid_at, Contract.amount_remaining)
+        .where(_not_cancelled, Contract.created_at.isnot(None), *criteria)
+    ).all()
+    commercial, created_at, paid_at, remaining = list(zip(*rows)) or [(), (), (), ()]
+    labels = np.array(commercial, dtype=object)
+    labels[np.equal(labels, None)] = "-"
+    return (labels.astype(str), np.array(created_at, dtype="datetime64[s]"),
+            np.array(paid_at, dtype="datetime64[s]"), np.array(remaining, dtype=np.float64))
+
+
+def payoff_curves(session):
+    """Durées de solde (paid_at - created_at, en jours) des contrats soldés, triées, par commercial.
+
+    paid_at n'est pas déplacé par les modifications ultérieures (statut, propagation,
+    fusion de doublons), contrairement à last_updated. La clé None contient la courbe
+    de tous les commerciaux.
+    """
+    commercial, created_at, paid_at, _ = _columns(
+        session, Contract.amount_remaining <= 0, Contract.paid_at.isnot(None))
+    durations = np.maximum(_days(created_at, paid_at), 0.0)
+    curves = {None: np.sort(durations)}
+    order = np.argsort(commercial, kind="stable")
+    names, starts = np.unique(commercial[order], return_index=True)
+    for name, group in zip(names, np.split(durations[order], starts[1:])):
+        curves[str(name)] = np.sort(group)
+    return curves
+
+
+def _cdf(curve, days):
+    """Part des contrats historiques soldés en `days` jours ou moins"""
+    return np.searchsorted(curve, days, side="right") / len(curve)
+
+
+def payoff_probability(curve, ages, start, end):
+    """Probabilité qu'un contrat âgé de `ages` jours soit soldé entre start et end jours à partir d'aujourd'hui.
+
+    Loi conditionnelle : P(a + start < T <= a + end | T > a). Un contrat plus
+    ancien que tout l'historique reçoit une probabilité nulle.
+    """
+    if not len(curve):
+        return np.zeros_like(ages)
+    survival = 1.0 - _cdf(curve, ages)
+    paid = _cdf(curve, ages + end) - _cdf(curve, ages + start)
+    return np.divide(paid, survival, out=np.zeros_like(ages), where=survival > 0)
+
+
+def forecast(session, months=FORECAST_MONTHS, now=None, min_history=FORECAST_MIN_HISTORY):
+    """Encaissements attendus, par mois civil et par commercial, sur les contrats non soldés"""
+    now = now or datetime.utcnow()
+    curves = payoff_curves(session)
+    commercial, created_at, _, remaining = _columns(session, Contract.amount_remaining > 0)
+    ages = np.maximum(_days(created_at, np.datetime64(now, "s")), 0.0)
+
+    bounds = [now] + [add_months(month_start(now), i) for i in range(1, months + 1)]
+    offsets = [(b - now).total_seconds() / SECONDS_PER_DAY for b in bounds]
+    periods = np.zeros(months)
+    by_commercial = []
+    for name in np.unique(commercial):
+        selected = commercial == name
+        own = curves.get(str(name), np.array([]))
+        curve = own if len(own) >= min_history else curves[None]
+        expected = np.array([
+            float((remaining[selected] * payoff_probability(curve, ages[selected], start, end)).sum())
+            for start, end in zip(offsets, offsets[1:])
+        ])
+        periods += expected
+        by_commercial.append({
+            "commercial": str(name),
+            "open_contracts": int(selected.sum()),
+            "outstanding": float(remaining[selected].sum()),
+            "expected": round(float(expected.sum()), 2),
+            "curve": "own" if curve is own else "global",
+            "history": int(len(own)),
+        })
+
+    return {
+        "generated_at": now.isoformat(timespec="seconds"),
+        "months": months,
+        "history": int(len(curves[None])),
+        "outstanding": float(remaining.sum()),
+        "expected": round(float(periods.sum()), 2),
+        "periods": [{"month": f"{b:%Y-%m}", "expected": round(float(v), 2)} for b, v in zip(bounds, periods)],
+        "by_commercial": by_commercial,
+    }
+
+
+def contracts_sequence(session):
+    """Dernier numéro du flux de modifications touchant un contrat"""
+    return session.execute(select(func.max(ChangeLog.seq)).where(ChangeLog.entity == "contract")).scalar() or 0
+
+
+def cached_forecast(session, months=FORECAST_MONTHS, refresh=False, path=None):
+    """Prévision mise en cache dans un fichier.
+
+    Le cache est valable tant qu'aucun contrat n'a changé (séquence du flux de
+    modifications) et pour la journée en cours (l'âge des contrats évolue).
+    """
+    path = path or FORECAST_CACHE_FILE
+    key = {"sequence": contracts_sequence(session), "months": months, "day": f"{datetime.utcnow():%Y-%m-%d}"}
+    if not refresh and os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                cached = json.load(f)
+            if cached.get("key") == key:
+                CACHE_REQUESTS.inc(cache="forecast", result="hit")
+                return cached["result"], True
+        except (OSError, ValueError):
+            pass
+
+    CACHE_REQUESTS.inc(cache="forecast", result="miss")
+    result = forecast(session, months=months)
+    try:
+        with open(path, "w") as f:
+            json.dump({"key": key, "result": result}, f)
+    except OSError:
+        pass
+    return result, False
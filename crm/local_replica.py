@@ -0,0 +1,136 @@
+import os
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, create_engine, delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import sessionmaker
+from .models import Base, Client, Contract, Event, Role, User
+from .services import visible_ids
+
+
+# Copie locale (SQLite) des données visibles par l'utilisateur connecté
+LOCAL_DATABASE_PATH = os.getenv("CRM_LOCAL_DB", ".crm_local.sqlite")
+SYNC_CHUNK_SIZE = 1000
+# Chaque synchronisation relit les lignes modifiées dans ce délai avant le repère : une transaction
+# validée après la synchronisation précédente porte un last_updated antérieur à son commit.
+# À régler au-dessus de la durée de la plus longue transaction d'écriture.
+SYNC_OVERLAP_SECONDS = int(os.getenv("SYNC_OVERLAP_SECONDS", 300))
+
+# Tables recopiées, dans l'ordre des clés étrangères
+SYNCED_TABLES = [Role.__table__, User.__table__, Client.__table__, Contract.__table__, Event.__table__]
+# Colonnes qui ne quittent pas la base principale : empreintes des mots de passe, clés des doublons
+EXCLUDED_COLUMNS = {
+    User.__table__: {"hashed_password"},
+    Client.__table__: {"email_bidx", "phone_bidx", "name_bidx", "name_minhash", "dedup_keys_version"},
+}
+# Valeur locale des colonnes obligatoires non recopiées
+LOCAL_PLACEHOLDERS = {User.__table__: {"hashed_password": ""}}
+
+local_metadata = MetaData()
+sync_state = Table(
+    "sync_state", local_metadata,
+    Column("table_name", String, primary_key=True),
+    Column("watermark", DateTime),
+    Column("synced_at", DateTime),
+    Column("user_name", String),
+    Column("rows", Integer),
+)
+
+_engines = {}
+
+
+def local_engine(path=None):
+    path = path or LOCAL_DATABASE_PATH
+    if path not in _engines:
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(engine, tables=SYNCED_TABLES)
+        local_metadata.create_all(engine)
+        _engines[path] = engine
+    return _engines[path]
+
+
+def local_session(path=None):
+    """Session en lecture sur la copie locale (erreur si aucune synchronisation n'a eu lieu)"""
+    path = path or LOCAL_DATABASE_PATH
+    if not os.path.exists(path):
+        raise click.ClickException("📦 Aucune copie locale. Lancez d'abord la commande `sync`.")
+    return sessionmaker(bind=local_engine(path))()
+
+
+def last_synced_at(path=None):
+    with local_engine(path).connect() as connection:
+        return connection.execute(select(sync_state.c.synced_at).order_by(sync_state.c.synced_at.desc())).scalar()
+
+
+def synced_columns(table):
+    excluded = EXCLUDED_COLUMNS.get(table, ())
+    return [c for c in table.columns if c.name not in excluded]
+
+
+def _upsert(connection, table, rows):
+    stmt = sqlite_insert(table)
+    columns = {name: stmt.excluded[name] for name in rows[0] if not table.c[name].primary_key}
+    connection.execute(stmt.on_conflict_do_update(index_elements=[table.c.id], set_=columns), rows)
+
+
+def sync(remote_session, user, path=None, full=False):
+    """Met à jour la copie locale à partir de la base principale.
+
+    Seules les lignes modifiées depuis la dernière synchronisation (last_updated, horloge
+    du serveur, moins SYNC_OVERLAP_SECONDS) sont transférées ; les données chiffrées sont
+    recopiées telles quelles, les colonnes de EXCLUDED_COLUMNS jamais.
+    Les lignes supprimées ou devenues invisibles sont retirées par comparaison des ID.
+    Retourne le nombre de lignes transférées par table.
+    """
+    engine = local_engine(path)
+    scopes = visible_ids(user)
+    transferred = {}
+    with engine.begin() as local:
+        previous_user = local.execute(select(sync_state.c.user_name).limit(1)).scalar()
+        if full or (previous_user is not None and previous_user != user.get('name')):
+            # Autre utilisateur : on repart d'une copie vide
+            for table in reversed(SYNCED_TABLES):
+                local.execute(delete(table))
+            local.execute(delete(sync_state))
+
+        for table in SYNCED_TABLES:
+            state = local.execute(select(sync_state).where(sync_state.c.table_name == table.name)).first()
+            watermark = state.watermark if state else None
+            criteria = []
+            scope = scopes.get(table) if scopes else None
+            if scope is not None:
+                criteria.append(table.c.id.in_(scope))
+            incremental = "last_updated" in table.c and watermark is not None
+            if incremental:
+                # Fenêtre de recouvrement : les lignes validées en retard sont reprises (l'upsert est idempotent)
+                criteria.append(table.c.last_updated >= watermark - timedelta(seconds=SYNC_OVERLAP_SECONDS))
+
+            count = 0
+            result = remote_session.execute(
+                select(*synced_columns(table)).where(*criteria).execution_options(yield_per=SYNC_CHUNK_SIZE)
+            )
+            placeholders = LOCAL_PLACEHOLDERS.get(table, {})
+            for partition in result.partitions():
+                rows = [{**dict(row._mapping), **placeholders} for row in partition]
+                _upsert(local, table, rows)
+                count += len(rows)
+                if "last_updated" in table.c:
+                    stamps = [row["last_updated"] for row in rows if row["last_updated"] is not None]
+                    if stamps:
+                        watermark = max([watermark, *stamps]) if watermark else max(stamps)
+            transferred[table.name] = count
+
+            # Réconciliation : suppression locale des lignes disparues ou devenues invisibles
+            remote_ids = set(remote_session.execute(
+                select(table.c.id).where(table.c.id.in_(scope)) if scope is not None else select(table.c.id)
+            ).scalars())
+            local_ids = set(local.execute(select(table.c.id)).scalars())
+            stale = list(local_ids - remote_ids)
+            for start in range(0, len(stale), SYNC_CHUNK_SIZE):
+                local.execute(delete(table).where(table.c.id.in_(stale[start:start + SYNC_CHUNK_SIZE])))
+
+            values = {"watermark": watermark, "synced_at": datetime.utcnow(), "user_name": user.get('name'),
+                      "rows": len(remote_ids)}
+            upsert = sqlite_insert(sync_state).values(table_name=table.name, **values)
+            local.execute(upsert.on_conflict_do_update(index_elements=[sync_state.c.table_name], set_=values))
+    return transferred
@@ -0,0 +1,418 @@
+import atexit
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+import click
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .database import current_command_name
+from .sessions import pool_metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou entre processus
+    fcntl = None
+
+
+# Fichier lu par le textfile collector de node_exporter (vide = métriques désactivées)
+METRICS_FILE = os.getenv("CRM_METRICS_FILE", "")
+# Écriture périodique des processus longs (reminders --daemon), en secondes
+METRICS_INTERVAL = float(os.getenv("CRM_METRICS_INTERVAL", 60))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+ARGON2_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+_SAMPLE = re.compile(r"^([a-zA-Z_:][\w:]*)(?:\{(.*)\})?\s+(\S+)$")
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _unescape(value):
+    return re.sub(r"\\(.)", lambda m: "\n" if m.group(1) == "n" else m.group(1), value)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = registry.lock
+        self._values = {}
+        self._flushed = {}
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} : étiquettes attendues {self.labelnames}, reçues {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def sample_names(self):
+        return (self.name,)
+
+    def samples(self):
+        """(nom, étiquettes, valeur) de chaque série ; les compteurs donnent l'écart depuis la dernière écriture"""
+        raise NotImplementedError
+
+    def mark_flushed(self):
+        self._flushed = {key: list(value) if isinstance(value, list) else value
+                         for key, value in self._values.items()}
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Valeur cumulée tenue ailleurs dans le processus (pools de connexions, caches)"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in self._values.items():
+            delta = value - self._flushed.get(key, 0)
+            if delta:
+                yield self.name, dict(zip(self.labelnames, key)), delta
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(registry, name, documentation, labelnames)
+
+    def sample_names(self):
+        return (f"{self.name}_bucket", f"{self.name}_sum", f"{self.name}_count")
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Compteurs par seau (non cumulés), somme, nombre
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        for key, state in self._values.items():
+            previous = self._flushed.get(key) or [0] * len(state)
+            delta = [now - before for now, before in zip(state, previous)]
+            if not delta[-1]:
+                continue
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, delta):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, delta[-2]
+            yield f"{self.name}_count", labels, delta[-1]
+
+
+class Registry:
+    """Métriques du processus, ajoutées au fichier texte Prometheus à chaque écriture.
+
+    Chaque commande CLI est un processus court : les compteurs et histogrammes
+    sont donc cumulés dans le fichier (on y ajoute l'écart depuis la dernière
+    écriture du processus), les jauges y sont remplacées par la dernière valeur.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def collector(self, func):
+        """Fonction appelée avant chaque écriture pour relever des valeurs tenues ailleurs"""
+        self.collectors.append(func)
+        return func
+
+    def counter(self, name, documentation, labelnames=()):
+        return Counter(self, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return Gauge(self, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return Histogram(self, name, documentation, labelnames, buckets)
+
+    def collect(self):
+        for func in self.collectors:
+            func()
+
+    def mark_flushed(self):
+        with self.lock:
+            for metric in self.metrics:
+                metric.mark_flushed()
+
+
+def parse_textfile(text):
+    """Séries d'un fichier au format texte Prometheus : {(nom, étiquettes triées): valeur}"""
+    series = {}
+    for line in text.splitlines():
+        match = _SAMPLE.match(line.strip())
+        if line.startswith("#") or not match:
+            continue
+        name, labels, value = match.groups()
+        labels = tuple(sorted((k, _unescape(v)) for k, v in _LABEL.findall(labels or "")))
+        try:
+            series[name, labels] = float(value)
+        except ValueError:
+            continue
+    return series
+
+
+def _sort_key(names):
+    """Séries groupées par étiquettes, puis seaux croissants, somme et nombre"""
+    def key(item):
+        (name, labels), _ = item
+        le = dict(labels).get("le")
+        rest = tuple(pair for pair in labels if pair[0] != "le")
+        return rest, names.index(name), float(le) if le is not None else 0.0
+    return key
+
+
+def render(registry, series):
+    lines = []
+    for metric in registry.metrics:
+        names = metric.sample_names()
+        samples = sorted(((key, value) for key, value in series.items() if key[0] in names), key=_sort_key(names))
+        if not samples:
+            continue
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for (name, labels), value in samples:
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            lines.append(f"{name}{{{label_text}}} {_format_value(value)}" if labels
+                         else f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def _file_lock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def write_textfile(path=None, registry=None):
+    """Ajoute les métriques du processus au fichier (écriture atomique, verrou entre processus)"""
+    path = path or METRICS_FILE
+    registry = registry or REGISTRY
+    if not path:
+        return None
+    registry.collect()
+    with _file_lock(path), registry.lock:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                series = parse_textfile(f.read())
+        except FileNotFoundError:
+            series = {}
+        for metric in registry.metrics:
+            for name, labels, value in metric.samples():
+                key = (name, tuple(sorted(labels.items())))
+                series[key] = value if metric.type == "gauge" else series.get(key, 0) + value
+        # Le collector ne doit jamais lire un fichier à moitié écrit
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".crm-metrics-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(render(registry, series))
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+        registry.mark_flushed()
+    return path
+
+
+def _write_at_exit():
+    try:
+        write_textfile()
+    except OSError as e:
+        click.echo(f"⚠️ Métriques non écrites ({METRICS_FILE}) : {e}", err=True)
+
+
+REGISTRY = Registry()
+
+COMMAND_LATENCY = REGISTRY.histogram(
+    "crm_command_duration_seconds", "Durée des commandes CLI.", ("command", "status"))
+SQL_DURATION = REGISTRY.histogram(
+    "crm_sql_statement_duration_seconds", "Durée des requêtes SQL par commande et type d'instruction.",
+    ("command", "operation"), SQL_BUCKETS)
+CRYPTO_OPERATIONS = REGISTRY.counter(
+    "crm_crypto_operations_total", "Chiffrements et déchiffrements Fernet.", ("operation",))
+ARGON2_VERIFY = REGISTRY.histogram(
+    "crm_argon2_verify_duration_seconds", "Vérifications de mot de passe argon2.", ("result",), ARGON2_BUCKETS)
+CACHE_REQUESTS = REGISTRY.counter(
+    "crm_cache_requests_total", "Lectures des caches (données de référence, prévision).", ("cache", "result"))
+POOL_CHECKOUTS = REGISTRY.counter(
+    "crm_pool_checkouts_total", "Connexions empruntées au pool.", ("pool",))
+POOL_TIMEOUTS = REGISTRY.counter(
+    "crm_pool_timeouts_total", "Attentes de connexion ayant dépassé pool_timeout.", ("pool",))
+POOL_WAIT = REGISTRY.counter(
+    "crm_pool_wait_seconds_total", "Temps passé à attendre une connexion du pool.", ("pool",))
+POOL_CHECKED_OUT = REGISTRY.gauge(
+    "crm_pool_checked_out_max", "Connexions prises simultanément (maximum du dernier processus).", ("pool",))
+POOL_OVERFLOW = REGISTRY.gauge(
+    "crm_pool_overflow_max", "Connexions au-delà de pool_size (maximum du dernier processus).", ("pool",))
+
+
+@REGISTRY.collector
+def _collect_pools():
+    for pool in pool_metrics.snapshot():
+        POOL_CHECKOUTS.set_total(pool["checkouts"], pool=pool["url"])
+        POOL_TIMEOUTS.set_total(pool["timeouts"], pool=pool["url"])
+        POOL_WAIT.set_total(pool["wait_ms_total"] / 1000, pool=pool["url"])
+        POOL_CHECKED_OUT.set(pool["max_checked_out"], pool=pool["url"])
+        POOL_OVERFLOW.set(pool["max_overflow_used"], pool=pool["url"])
+
+
+@REGISTRY.collector
+def _collect_reference_cache():
+    from .cache import reference_cache
+    CACHE_REQUESTS.set_total(reference_cache.hits, cache="reference", result="hit")
+    CACHE_REQUESTS.set_total(reference_cache.misses, cache="reference", result="miss")
+
+
+def count_crypto(operation):
+    CRYPTO_OPERATIONS.inc(operation=operation)
+
+
+def _statement_type(statement):
+    word = statement.lstrip().split(None, 1)[:1]
+    word = word[0].lower() if word else ""
+    return word if word in ("select", "insert", "update", "delete", "with") else "other"
+
+
+class SqlTimer:
+    """Durée de chaque requête SQL, par commande CLI et type d'instruction"""
+
+    def install(self, target=Engine):
+        event.listen(target, "before_cursor_execute", self._before)
+        event.listen(target, "after_cursor_execute", self._after)
+        self.target = target
+        return self
+
+    def uninstall(self):
+        event.remove(self.target, "before_cursor_execute", self._before)
+        event.remove(self.target, "after_cursor_execute", self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("metrics_started")
+        if started:
+            SQL_DURATION.observe(time.perf_counter() - started.pop(),
+                                 command=current_command_name() or "none", operation=_statement_type(statement))
+
+
+class CommandTimer:
+    """Durée et issue des commandes (même protocole `run` que les profileurs)"""
+
+    def run(self, name, func, *args, **kwargs):
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = func(*args, **kwargs)
+            status = "ok"
+            return result
+        except SystemExit as e:
+            status = "ok" if not e.code else "error"
+            raise
+        finally:
+            COMMAND_LATENCY.observe(time.perf_counter() - started, command=name, status=status)
+
+
+_command_timer = None
+_sql_timer = None
+_writer = None
+
+
+def enable_metrics():
+    """Mesure les commandes et les requêtes SQL ; le fichier est écrit à la sortie du processus"""
+    global _command_timer, _sql_timer
+    if _command_timer is None:
+        _command_timer = CommandTimer()
+        _sql_timer = SqlTimer().install()
+        atexit.register(_write_at_exit)
+    return _command_timer
+
+
+def command_timer():
+    return _command_timer
+
+
+def start_periodic_writer(interval=METRICS_INTERVAL):
+    """Écrit le fichier toutes les `interval` secondes (processus longs, ex: reminders --daemon)"""
+    global _writer
+    if _command_timer is None or _writer is not None:
+        return _writer
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            _write_at_exit()
+
+    _writer = threading.Thread(target=loop, name="metrics-writer", daemon=True)
+    _writer.stop = stop
+    _writer.start()
+    return _writer
+
+
+if METRICS_FILE:
+    enable_metrics()
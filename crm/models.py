@@ -1,12 +1,34 @@
+import time
 from .database import Base
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from .metrics import ARGON2_VERIFY
+from sqlalchemy import (Boolean, Column, Integer, String, Float, DateTime, ForeignKey, Index, Text, Table, LargeBinary,
+                        event, null)
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql.functions import FunctionElement
 from argon2 import PasswordHasher
 
 
 ph = PasswordHasher()
 
 
+class utcnow(FunctionElement):
+    """Heure UTC du serveur de base de données : une seule horloge pour tous les postes"""
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, "postgresql")
+def _utcnow_postgresql(element, compiler, **kw):
+    # Heure de l'instruction (et non du début de la transaction), sans fuseau
+    return "TIMEZONE('utc', STATEMENT_TIMESTAMP())"
+
+
 class Role(Base):
     __tablename__ = "roles"
     id = Column(Integer, primary_key=True)
@@ -33,10 +55,13 @@ class User(Base):
         self.hashed_password = ph.hash(password)
 
     def verify_password(self, password: str) -> bool:
+        started = time.perf_counter()
         try:
-            return ph.verify(self.hashed_password, password)
+            valid = ph.verify(self.hashed_password, password)
         except Exception:
-            return False
+            valid = False
+        ARGON2_VERIFY.observe(time.perf_counter() - started, result="ok" if valid else "failed")
+        return valid
 
     def __repr__(self):
         return f"<User(name={self.name}, email={self.email}, role={self.role.name})>"
@@ -52,16 +77,31 @@ class Client(Base):
     phone = Column(String)
     company = Column(String)
     created_at = Column(DateTime)
-    last_updated = Column(DateTime)
+    # Mis à jour à chaque modification, y compris par les UPDATE en masse (synchronisation incrémentale),
+    # avec l'horloge du serveur : une horloge de poste décalée ne fait pas manquer de lignes
+    last_updated = Column(DateTime, server_default=utcnow(), onupdate=utcnow(), index=True)
 
     # Contact commercial
     sales_contact = Column(String, nullable=True)
+    # Détection des doublons (crm/dedup.py) : index aveugles (HMAC des valeurs normalisées)
+    # et signature MinHash du nom et de l'entreprise, calculés à chaque écriture
+    email_bidx = Column(String(32), index=True)
+    phone_bidx = Column(String(32), index=True)
+    name_bidx = Column(String(32), index=True)
+    name_minhash = Column(LargeBinary)
+    # Version du calcul des clés ; remise à NULL par tout UPDATE qui ne la fixe pas (UPDATE hors ORM) :
+    # NULL ou ancienne version = clés à recalculer
+    dedup_keys_version = Column(Integer, onupdate=null())
     # Relations
     contracts = relationship("Contract", back_populates="client")
     # lien vers le User qui a créé le client
     created_by_id = Column(Integer, ForeignKey("users.id"))
     created_by = relationship("User")
 
+    # Verrouillage optimiste : incrémenté à chaque modification
+    version_id = Column(Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version_id}
+
     def __repr__(self):
         return f"<Client(name={self.name}, sales_contact={self.sales_contact})>"
 
@@ -85,18 +125,38 @@ class Contract(Base):
     amount_total = Column(Float, nullable=False)
     amount_remaining = Column(Float, nullable=False)
     created_at = Column(DateTime)
+    last_updated = Column(DateTime, server_default=utcnow(), onupdate=utcnow(), index=True)
+    # Date à laquelle le reste dû est passé à 0 (prévision des encaissements), None tant qu'il reste à payer
+    paid_at = Column(DateTime, nullable=True)
     status = Column(String)  # ex: "signed", "pending"
 
     # Relation vers Event
     events = relationship("Event", back_populates="contract")
 
+    # Verrouillage optimiste : incrémenté à chaque modification
+    version_id = Column(Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version_id}
+
     def __repr__(self):
         return f"<Contract(unique_id={self.unique_id}, amount_total={self.amount_total})>"
 
 
+@event.listens_for(Contract, "before_insert")
+@event.listens_for(Contract, "before_update")
+def _stamp_paid_at(mapper, connection, target):
+    """paid_at posé quand le reste dû atteint 0 (date d'origine conservée), effacé s'il redevient positif"""
+    if target.amount_remaining is not None and target.amount_remaining <= 0:
+        if target.paid_at is None:
+            target.paid_at = utcnow()
+    elif target.paid_at is not None:
+        target.paid_at = None
+
+
 # === Event ===
 class Event(Base):
     __tablename__ = 'events'
+    # Sous Postgres la table est partitionnée par mois sur la date de début (cf. crm/partitioning.py)
+    __table_args__ = {"info": {"partition_by": "event_date_start", "partition_interval": "month"}}
 
     id = Column(Integer, primary_key=True)
 
@@ -109,7 +169,7 @@ class Event(Base):
     # Contact client : phone + email concaténés
     client_contact = Column(String, nullable=True)
 
-    event_date_start = Column(DateTime, nullable=False)
+    event_date_start = Column(DateTime, nullable=False, index=True)
     event_date_end = Column(DateTime, nullable=False)
 
     # Support contact
@@ -118,6 +178,139 @@ class Event(Base):
     location = Column(String, nullable=True)
     attendees = Column(Integer, nullable=True)
     notes = Column(String, nullable=True)
+    last_updated = Column(DateTime, server_default=utcnow(), onupdate=utcnow(), index=True)
+
+    # Verrouillage optimiste : incrémenté à chaque modification
+    version_id = Column(Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version_id}
 
     def __repr__(self):
         return f"<Event(client_name={self.client_name}, date_start={self.event_date_start})>"
+
+
+# === Versions des données de référence (rôles, utilisateurs) ===
+class ReferenceVersion(Base):
+    __tablename__ = 'reference_versions'
+
+    name = Column(String, primary_key=True)  # ex: "roles", "users"
+    version = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ReferenceVersion(name={self.name}, version={self.version})>"
+
+
+# === Journal d'audit (ajout uniquement) ===
+class AuditLog(Base):
+    __tablename__ = 'audit_log'
+    __table_args__ = (
+        Index("ix_audit_log_actor_created_at", "actor", "created_at"),
+        Index("ix_audit_log_entity_created_at", "entity", "entity_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, nullable=False, index=True)
+    actor = Column(String, nullable=True)
+    action = Column(String, nullable=False)  # ex: "user.create", "contract.bulk_update"
+    entity = Column(String, nullable=True)
+    entity_id = Column(Integer, nullable=True)
+    details = Column(Text, nullable=True)  # JSON
+
+    def __repr__(self):
+        return f"<AuditLog(action={self.action}, actor={self.actor}, created_at={self.created_at})>"
+
+
+# === Flux de modifications (changes-since) : une ligne par écriture, numérotée ===
+class ChangeLog(Base):
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        # Dernière modification par type d'objet (invalidation des caches)
+        Index("ix_change_log_entity_seq", "entity", "seq"),
+    )
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)  # curseur des consommateurs
+    changed_at = Column(DateTime, nullable=False)
+    entity = Column(String, nullable=False)  # "client", "contract", "event"
+    entity_id = Column(Integer, nullable=False)
+    operation = Column(String, nullable=False)  # "insert", "update", "delete"
+
+    def __repr__(self):
+        return f"<ChangeLog(seq={self.seq}, {self.operation} {self.entity}#{self.entity_id})>"
+
+
+# === Archives (rétention) : mêmes colonnes que les tables actives, sans contraintes ===
+def _archive_table(source, name):
+    columns = [Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False) for c in source.columns]
+    return Table(name, Base.metadata, *columns, Column("archived_at", DateTime, nullable=False, index=True))
+
+
+contracts_archive = _archive_table(Contract.__table__, "contracts_archive")
+events_archive = _archive_table(Event.__table__, "events_archive")
+
+
+class RetentionCheckpoint(Base):
+    __tablename__ = 'retention_checkpoints'
+
+    policy = Column(String, primary_key=True)
+    cutoff = Column(DateTime, nullable=False)
+    days = Column(Integer, nullable=True)  # ancienneté demandée au départ (cutoff = départ - days)
+    include_unpaid = Column(Boolean, nullable=True)  # contrats non soldés archivés aussi
+    last_contract_id = Column(Integer, nullable=False, default=0)
+    contracts_archived = Column(Integer, nullable=False, default=0)
+    events_archived = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    def __repr__(self):
+        return f"<RetentionCheckpoint(policy={self.policy}, last_contract_id={self.last_contract_id})>"
+
+
+# === Rappels d'événements déjà envoyés (une ligne par événement, fenêtre et date de début) ===
+class ReminderSent(Base):
+    __tablename__ = 'reminders_sent'
+
+    event_id = Column(Integer, primary_key=True)
+    window_name = Column(String, primary_key=True)  # ex: "7d", "1d", "2h"
+    # Un événement déplacé reçoit de nouveaux rappels
+    event_date_start = Column(DateTime, primary_key=True, index=True)
+    sent_at = Column(DateTime, nullable=False)
+    recipient = Column(String, nullable=True)
+
+    def __repr__(self):
+        return f"<ReminderSent(event_id={self.event_id}, window={self.window_name})>"
+
+
+# === Sharding : tables de l'annuaire (base principale) ===
+class ShardMap(Base):
+    __tablename__ = 'shard_map'
+
+    client_id = Column(Integer, primary_key=True)  # le client et ses contrats/événements
+    shard = Column(String, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<ShardMap(client_id={self.client_id}, shard={self.shard})>"
+
+
+class IdSequence(Base):
+    __tablename__ = 'id_sequences'
+
+    name = Column(String, primary_key=True)  # "clients", "contracts", "events"
+    next_id = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<IdSequence(name={self.name}, next_id={self.next_id})>"
+
+
+# === Reprises de données par lots (crm/backfill.py) ===
+class BackfillCheckpoint(Base):
+    __tablename__ = 'backfill_checkpoints'
+
+    name = Column(String, primary_key=True)  # ex: "a1b2c3_last_updated_events"
+    table_name = Column(String, nullable=False)
+    last_key = Column(Integer, nullable=False, default=0)
+    rows_done = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    def __repr__(self):
+        return f"<BackfillCheckpoint(name={self.name}, last_key={self.last_key})>"
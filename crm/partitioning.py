@@ -0,0 +1,95 @@
+import os
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from .models import Event
+
+
+# Nombre de mois créés à l'avance (create-partitions, à planifier au moins une fois par mois)
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+# Attente maximale du verrou ACCESS EXCLUSIVE sur events avant d'abandonner
+PARTITION_LOCK_TIMEOUT = os.getenv("PARTITION_LOCK_TIMEOUT", "5s")
+# check_violation : des lignes du mois sont déjà dans la partition par défaut
+DEFAULT_PARTITION_CONFLICT = "23514"
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def is_partitioned(connection, table: str = Event.__tablename__) -> bool:
+    """Vrai si la table est partitionnée (Postgres uniquement)"""
+    if connection.dialect.name != "postgresql":
+        return False
+    return bool(connection.execute(
+        text("SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+             "WHERE c.relname = :table AND pg_table_is_visible(c.oid)"),
+        {"table": table},
+    ).scalar())
+
+
+def create_month_partition(connection, month: datetime, table: str = Event.__tablename__):
+    """Crée la partition mensuelle contenant `month` si elle n'existe pas"""
+    start = month_start(month)
+    end = add_months(start, 1)
+    connection.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, start)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    )
+
+
+def _sqlstate(error: DBAPIError):
+    # psycopg2 : pgcode, psycopg 3 : sqlstate
+    return getattr(error.orig, "pgcode", None) or getattr(error.orig, "sqlstate", None)
+
+
+def ensure_partitions(bind, start=None, months_ahead=PARTITION_MONTHS_AHEAD, table: str = Event.__tablename__):
+    """Crée les partitions de `start` (par défaut ce mois-ci) jusqu'à `months_ahead` mois plus tard.
+
+    Les partitions sont créées à l'avance, jamais pendant un flush : CREATE TABLE ...
+    PARTITION OF verrouille la table parente en ACCESS EXCLUSIVE. L'attente de ce
+    verrou est bornée par PARTITION_LOCK_TIMEOUT ; un dépassement annule l'ensemble et
+    remonte. Chaque mois est créé dans son propre point de sauvegarde : un mois dont
+    des lignes sont déjà dans la partition par défaut est ignoré (à déplacer à la main)
+    sans empêcher la création des mois suivants.
+    Ne fait rien si la base n'est pas Postgres ou si la table n'est pas partitionnée.
+    Retourne (partitions couvertes, partitions ignorées).
+    """
+    with bind.begin() as connection:
+        if not is_partitioned(connection, table):
+            return [], []
+        connection.execute(text("SELECT set_config('lock_timeout', :timeout, true)"),
+                           {"timeout": PARTITION_LOCK_TIMEOUT})
+        month = month_start(start or datetime.utcnow())
+        last = add_months(month_start(datetime.utcnow()), months_ahead)
+        names, skipped = [], []
+        while month <= last:
+            try:
+                with connection.begin_nested():
+                    create_month_partition(connection, month, table)
+                names.append(partition_name(table, month))
+            except DBAPIError as e:
+                if _sqlstate(e) != DEFAULT_PARTITION_CONFLICT:
+                    raise
+                skipped.append(partition_name(table, month))
+            month = add_months(month, 1)
+        return names, skipped
+
+
+def date_range_criteria(column, start=None, end=None):
+    """Filtre sur une plage de dates : permet l'élagage des partitions par Postgres"""
+    criteria = []
+    if start is not None:
+        criteria.append(column >= start)
+    if end is not None:
+        criteria.append(column < end)
+    return criteria
@@ -0,0 +1,287 @@
+import functools
+import gc
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+import click
+from sqlalchemy.orm import Session
+from . import metrics, sessions
+
+
+# Profilage mémoire activé par variable d'environnement (ex: tâches planifiées)
+PROFILE_MEM = os.getenv("CRM_PROFILE_MEM", "") not in ("", "0")
+PROFILE_MEM_JSON = os.getenv("CRM_PROFILE_MEM_JSON")
+PROFILE_TOP = int(os.getenv("CRM_PROFILE_TOP", 10))
+PROFILE_FRAMES = 25
+PROFILE_CPU = os.getenv("CRM_PROFILE_CPU", "") not in ("", "0")
+PROFILE_CPU_DIR = os.getenv("CRM_PROFILE_CPU_DIR", ".")
+PROFILE_CPU_INTERVAL = float(os.getenv("CRM_PROFILE_CPU_INTERVAL", 0.005))
+
+# Catégories de temps CPU, reconnues au chemin du fichier (de la frame la plus profonde à la racine)
+CPU_CATEGORIES = (
+    ("fernet", ("cryptography",)),
+    ("argon2", ("argon2",)),
+    ("sqlalchemy_orm", ("sqlalchemy/orm", "sqlalchemy/ext")),
+    ("database", ("sqlalchemy", "sqlite3", "psycopg2")),
+    ("terminal", ("click/termui", "click/utils", "questionary", "prompt_toolkit")),
+)
+
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def open_sessions():
+    """Sessions SQLAlchemy encore vivantes avec une transaction ou des objets chargés (oubli de close())"""
+    gc.collect()
+    return sum(
+        1 for obj in gc.get_objects()
+        if isinstance(obj, Session) and (obj.in_transaction() or len(obj.identity_map))
+    )
+
+
+def _sites(statistics, top):
+    return [{"site": f"{s.traceback[0].filename}:{s.traceback[0].lineno}", "size_kib": round(s.size / 1024, 1),
+             "count": s.count} for s in statistics[:top]]
+
+
+class MemoryProfiler:
+    """Instantanés tracemalloc autour de chaque commande.
+
+    tracemalloc reste actif entre deux commandes (menu de main.py) : la
+    croissance mesurée d'une commande à la suivante révèle ce qui n'a pas été
+    libéré, typiquement des sessions jamais fermées.
+    """
+
+    def __init__(self, json_path=None, top=PROFILE_TOP, echo=True):
+        self.json_path = json_path
+        self.top = top
+        self.echo = echo
+        self.reports = []
+        self._previous = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_FRAMES)
+
+    def run(self, name, func, *args, **kwargs):
+        """Exécute func en mesurant sa mémoire ; le rapport est émis même si la commande échoue"""
+        self.start()
+        before = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+            report = {
+                "command": name,
+                "peak_kib": round(peak / 1024, 1),
+                "peak_over_baseline_kib": round((peak - baseline) / 1024, 1),
+                "retained_kib": round((current - baseline) / 1024, 1),
+                "top": _sites(after.compare_to(before, "lineno"), self.top),
+                "growth_since_previous": (
+                    _sites(after.compare_to(self._previous, "lineno"), self.top) if self._previous else []
+                ),
+                "open_sessions": open_sessions(),
+            }
+            self._previous = after
+            self.reports.append(report)
+            self.emit(report)
+
+    def emit(self, report):
+        if self.echo:
+            click.echo(format_report(report), err=True)
+        if self.json_path:
+            with open(self.json_path, "a") as f:
+                f.write(json.dumps(report, ensure_ascii=False) + "\n")
+
+
+def format_report(report):
+    lines = [
+        f"\n🧠 Mémoire [{report['command']}] pic : {report['peak_kib']} Kio "
+        f"(+{report['peak_over_baseline_kib']} Kio) | conservé : {report['retained_kib']} Kio | "
+        f"sessions ouvertes : {report['open_sessions']}",
+        "  Principaux sites d'allocation :",
+    ]
+    lines += [f"    {s['size_kib']:>9} Kio  {s['count']:>7}  {s['site']}" for s in report["top"]]
+    if report["growth_since_previous"]:
+        lines.append("  Croissance depuis la commande précédente :")
+        lines += [f"    {s['size_kib']:>9} Kio  {s['count']:>7}  {s['site']}" for s in report["growth_since_previous"]]
+    return "\n".join(lines)
+
+
+# === Profilage CPU par échantillonnage ===
+def _frame_label(frame):
+    code = frame.f_code
+    path = code.co_filename.replace(os.sep, "/")
+    for marker in ("site-packages/", "/crm/", "/lib/python"):
+        if marker in path:
+            path = path.split(marker, 1)[1]
+            break
+    return f"{code.co_name} ({path}:{code.co_firstlineno})".replace(";", ",")
+
+
+def categorize(filenames):
+    """Catégorie d'une pile (noms de fichiers, frame la plus profonde en dernier)"""
+    for filename in reversed(filenames):
+        path = filename.replace(os.sep, "/")
+        for category, markers in CPU_CATEGORIES:
+            if any(marker in path for marker in markers):
+                return category
+    return "app"
+
+
+class CpuProfiler:
+    """Profileur par échantillonnage : un thread relève la pile du thread de la commande
+    toutes les `interval` secondes, sans modifier le code profilé.
+
+    Produit des piles repliées (format flame graph : "a;b;c N"), un top des
+    fonctions et la répartition du temps par catégorie (Fernet, argon2, ORM...).
+    """
+
+    def __init__(self, output_dir=PROFILE_CPU_DIR, interval=PROFILE_CPU_INTERVAL, top=PROFILE_TOP, echo=True):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.top = top
+        self.echo = echo
+        self.reports = []
+
+    def _sample(self, thread_id, stacks, stop):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            labels, filenames = [], []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                filenames.append(frame.f_code.co_filename)
+                frame = frame.f_back
+            if labels:
+                stacks[tuple(reversed(labels)), categorize(filenames[::-1])] += 1
+
+    def run(self, name, func, *args, **kwargs):
+        """Exécute func sous échantillonnage ; le rapport est émis même si la commande échoue"""
+        stacks = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample, args=(threading.get_ident(), stacks, stop),
+                                   name="cpu-profiler", daemon=True)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stop.set()
+            sampler.join()
+            self.emit(self.build_report(name, stacks, time.perf_counter() - started))
+
+    def build_report(self, name, stacks, elapsed):
+        total = sum(stacks.values())
+        self_samples, cumulative, categories = Counter(), Counter(), Counter()
+        for (labels, category), count in stacks.items():
+            self_samples[labels[-1]] += count
+            for label in set(labels):
+                cumulative[label] += count
+            categories[category] += count
+        report = {
+            "command": name,
+            "elapsed_s": round(elapsed, 4),
+            "samples": total,
+            "categories": {c: round(n / total, 4) for c, n in categories.most_common()},
+            "top_self": [{"function": f, "samples": n} for f, n in self_samples.most_common(self.top)],
+            "top_cumulative": [{"function": f, "samples": n} for f, n in cumulative.most_common(self.top)],
+            "collapsed": None,
+        }
+        if self.output_dir and total:
+            path = os.path.join(self.output_dir, f"profile-{name}.folded")
+            with open(path, "w") as f:
+                for (labels, _), count in stacks.items():
+                    f.write(f"{';'.join(labels)} {count}\n")
+            report["collapsed"] = path
+        return report
+
+    def emit(self, report):
+        self.reports.append(report)
+        if self.echo:
+            click.echo(format_cpu_report(report), err=True)
+
+
+def format_cpu_report(report):
+    lines = [f"\n⏱️ CPU [{report['command']}] {report['elapsed_s']} s | {report['samples']} échantillon(s)"]
+    if report["categories"]:
+        lines.append("  Répartition : " + ", ".join(f"{c} {share:.0%}" for c, share in report["categories"].items()))
+    lines.append("  Fonctions (temps propre) :")
+    lines += [f"    {t['samples']:>6}  {t['function']}" for t in report["top_self"]]
+    if report["collapsed"]:
+        lines.append(f"  Piles repliées : {report['collapsed']} (flamegraph.pl, speedscope)")
+    return "\n".join(lines)
+
+
+_memory_profiler = None
+_cpu_profiler = None
+
+
+def enable_memory_profiling(json_path=None, echo=True):
+    """Active le profilage mémoire de toutes les commandes suivantes (CLI ou menu)"""
+    global _memory_profiler
+    if _memory_profiler is None:
+        _memory_profiler = MemoryProfiler(json_path=json_path, echo=echo)
+        _memory_profiler.start()
+    elif json_path:
+        _memory_profiler.json_path = json_path
+    return _memory_profiler
+
+
+def disable_memory_profiling():
+    global _memory_profiler
+    _memory_profiler = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def memory_profiler():
+    return _memory_profiler
+
+
+def enable_cpu_profiling(output_dir=PROFILE_CPU_DIR, interval=PROFILE_CPU_INTERVAL, echo=True):
+    """Active le profilage CPU de toutes les commandes suivantes (CLI ou menu)"""
+    global _cpu_profiler
+    if _cpu_profiler is None:
+        _cpu_profiler = CpuProfiler(output_dir=output_dir, interval=interval, echo=echo)
+    return _cpu_profiler
+
+
+def disable_cpu_profiling():
+    global _cpu_profiler
+    _cpu_profiler = None
+
+
+def cpu_profiler():
+    return _cpu_profiler
+
+
+class CRMCommand(click.Command):
+    """Commande CRM : exécutée sous les métriques, profileurs et détecteur de sessions activés"""
+
+    def invoke(self, ctx):
+        run = super().invoke
+        for profiler in (metrics.command_timer(), sessions.leak_detector(), cpu_profiler(), memory_profiler()):
+            if profiler is not None:
+                run = functools.partial(profiler.run, self.name, run)
+        return run(ctx)
+
+
+class CRMGroup(click.Group):
+    command_class = CRMCommand
+
+
+if PROFILE_MEM:
+    enable_memory_profiling(PROFILE_MEM_JSON)
+if PROFILE_CPU:
+    enable_cpu_profiling()
@@ -0,0 +1,85 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+from sqlalchemy import select
+from .models import Client, Contract, Event, Role, User
+
+
+# Lignes de lecture seule pour les listes : de simples tuples (sans __dict__),
+# hors identity map et unit of work de la session.
+class UserRow(NamedTuple):
+    id: int
+    employee_number: str
+    name: str
+    email: str
+    role: Optional[str]
+
+
+class ClientRow(NamedTuple):
+    id: int
+    name: str
+    email: str
+    phone: Optional[str]
+
+
+class ContractRow(NamedTuple):
+    id: int
+    unique_id: str
+    client_id: int
+    client_name: str
+    amount_total: float
+    amount_remaining: float
+    status: Optional[str]
+
+
+class EventRow(NamedTuple):
+    id: int
+    client_name: str
+    event_date_start: datetime
+    location: Optional[str]
+    support_contact: Optional[str]
+
+
+ROW_CHUNK_SIZE = 1000
+
+
+def _rows(session, row_type, stmt):
+    """Itère sur le résultat par paquets, en construisant directement les tuples"""
+    result = session.execute(stmt.execution_options(yield_per=ROW_CHUNK_SIZE))
+    make = row_type._make
+    for row in result:
+        yield make(row)
+
+
+def user_rows(session, *criteria):
+    stmt = (
+        select(User.id, User.employee_number, User.name, User.email, Role.name)
+        .outerjoin(Role, User.role_id == Role.id)
+        .where(*criteria)
+        .order_by(User.id)
+    )
+    return _rows(session, UserRow, stmt)
+
+
+def client_rows(session, *criteria):
+    stmt = select(Client.id, Client.name, Client.email, Client.phone).where(*criteria).order_by(Client.id)
+    return _rows(session, ClientRow, stmt)
+
+
+def contract_rows(session, *criteria):
+    stmt = (
+        select(Contract.id, Contract.unique_id, Contract.client_id, Client.name,
+               Contract.amount_total, Contract.amount_remaining, Contract.status)
+        .join(Client, Contract.client_id == Client.id)
+        .where(*criteria)
+        .order_by(Contract.id)
+    )
+    return _rows(session, ContractRow, stmt)
+
+
+def event_rows(session, *criteria):
+    stmt = (
+        select(Event.id, Event.client_name, Event.event_date_start, Event.location, Event.support_contact)
+        .where(*criteria)
+        .order_by(Event.id)
+    )
+    return _rows(session, EventRow, stmt)
@@ -0,0 +1,89 @@
+from sqlalchemy import event, func, inspect, or_, select, update
+from sqlalchemy.orm import Session, object_session
+from .changefeed import record_changes
+from .database import directory_connection, shard_connection, shard_ids
+from .models import Client, Contract, Event
+from .search import reindex_events
+
+
+# Champs du client recopiés dans les événements
+PROPAGATED_FIELDS = ("name", "phone", "email")
+
+
+def _client_values():
+    """Valeurs à jour (sous-requêtes corrélées) des copies client d'un événement"""
+    joined = (Client.id == Contract.client_id, Contract.id == Event.contract_id)
+    name = select(Client.name).where(*joined).scalar_subquery()
+    contact = (
+        select(func.coalesce(Client.phone, "") + " | " + func.coalesce(Client.email, ""))
+        .where(*joined)
+        .scalar_subquery()
+    )
+    return name, contact
+
+
+def refresh_events(session, shard_id, *criteria):
+    """Rafraîchit en un seul UPDATE les copies client des événements du filtre, sur un shard
+    (None hors sharding).
+
+    Seules les lignes réellement différentes sont réécrites.
+    Retourne les ID des événements modifiés.
+    """
+    connection = shard_connection(session, shard_id)
+    name, contact = _client_values()
+    stale = or_(Event.client_name != name, Event.client_contact.is_distinct_from(contact))
+    values = {"client_name": name, "client_contact": contact, "version_id": Event.version_id + 1}
+    stmt = update(Event).where(*criteria, stale).values(**values)
+    if connection.dialect.update_returning:
+        event_ids = connection.execute(stmt.returning(Event.id)).scalars().all()
+    else:
+        event_ids = connection.execute(select(Event.id).where(*criteria, stale)).scalars().all()
+        if event_ids:
+            connection.execute(update(Event).where(Event.id.in_(event_ids)).values(**values))
+    reindex_events(connection, event_ids)
+    record_changes(directory_connection(session), "event", event_ids, "update")
+    return event_ids
+
+
+def propagate_clients(session, shard_id, client_ids):
+    """Répercute les modifications de clients (tous sur `shard_id`) sur leurs événements"""
+    client_ids = list(client_ids)
+    if not client_ids:
+        return []
+    contracts = select(Contract.id).where(Contract.client_id.in_(client_ids))
+    return refresh_events(session, shard_id, Event.contract_id.in_(contracts))
+
+
+def resync_all_events(session, chunk_size=5000, progress=None):
+    """Réparation : resynchronise tous les événements par tranches d'ID, un commit par tranche
+    (sur chaque shard sous sharding)"""
+    shards = shard_ids(session)
+    max_id = max(shard_connection(session, shard_id).execute(select(func.max(Event.id))).scalar() or 0
+                 for shard_id in shards)
+    total = 0
+    for start in range(0, max_id, chunk_size):
+        for shard_id in shards:
+            changed = refresh_events(session, shard_id, Event.id > start, Event.id <= start + chunk_size)
+            total += len(changed)
+        session.commit()
+        if progress:
+            progress(min(start + chunk_size, max_id), max_id, total)
+    return total
+
+
+# === File d'attente des clients modifiés, traitée à la fin de chaque flush ===
+@event.listens_for(Client, "after_update")
+def _enqueue_client(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in PROPAGATED_FIELDS):
+        session = object_session(target)
+        # Jeton d'identité : shard du client (None hors sharding)
+        session.info.setdefault("clients_to_propagate", set()).add((state.identity_token, target.id))
+
+
+@event.listens_for(Session, "after_flush")
+def _propagate_pending_clients(session, flush_context):
+    pending = session.info.pop("clients_to_propagate", None)
+    for shard in {token for token, _ in pending or ()}:
+        client_ids = [client_id for token, client_id in pending if token == shard]
+        propagate_clients(session, shard, client_ids)
@@ -0,0 +1,148 @@
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+import click
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from .models import Event, ReminderSent
+from .search import _plain
+from .sessions import session_scope
+
+
+# Fenêtres de rappel avant le début de l'événement, ex: "7d,1d,2h"
+REMINDER_WINDOWS = os.getenv("REMINDER_WINDOWS", "7d,1d,2h")
+REMINDER_INTERVAL_SECONDS = int(os.getenv("REMINDER_INTERVAL_SECONDS", 60))
+REMINDER_NOTIFIER = os.getenv("REMINDER_NOTIFIER", "stdout")
+
+_UNITS = {"m": "minutes", "h": "hours", "d": "days"}
+
+
+class Reminder(NamedTuple):
+    event_id: int
+    window: str
+    event_date_start: datetime
+    recipient: Optional[str]  # None : événement sans support
+    client_name: str
+    location: Optional[str]
+
+
+def parse_windows(spec=REMINDER_WINDOWS):
+    """ "7d,1d,2h" -> [("2h", 2 heures), ("1d", 1 jour), ("7d", 7 jours)], de la plus courte à la plus longue"""
+    windows = []
+    for part in spec.split(","):
+        part = part.strip()
+        match = re.fullmatch(r"(\d+)([mhd])", part)
+        if not match:
+            raise ValueError(f"Fenêtre de rappel invalide : {part!r}")
+        windows.append((part, timedelta(**{_UNITS[match.group(2)]: int(match.group(1))})))
+    return sorted(windows, key=lambda w: w[1])
+
+
+# === Notificateurs ===
+class StdoutNotifier:
+    def send(self, reminder):
+        who = reminder.recipient or "(sans support)"
+        click.echo(f"🔔 [{reminder.window}] {who} : événement #{reminder.event_id} ({reminder.client_name}) "
+                   f"le {reminder.event_date_start:%Y-%m-%d %H:%M} à {reminder.location or '-'}")
+
+
+class FileNotifier:
+    """Ajoute chaque rappel au fichier, une ligne JSON par rappel"""
+
+    def __init__(self, path="reminders.jsonl"):
+        self.path = path
+
+    def send(self, reminder):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(reminder._asdict(), default=str, ensure_ascii=False) + "\n")
+
+
+NOTIFIERS = {"stdout": StdoutNotifier, "file": FileNotifier}
+
+
+def register_notifier(name, factory):
+    """Ajoute un type de notificateur (objet ayant une méthode send(reminder))"""
+    NOTIFIERS[name] = factory
+
+
+def get_notifier(spec=REMINDER_NOTIFIER):
+    """ "stdout" ou "file:/chemin/rappels.jsonl" """
+    name, _, argument = spec.partition(":")
+    if name not in NOTIFIERS:
+        raise ValueError(f"Notificateur inconnu : {name}")
+    return NOTIFIERS[name](argument) if argument else NOTIFIERS[name]()
+
+
+# === Passage du planificateur ===
+def due_reminders(session, windows, now):
+    """Rappels à envoyer : une seule requête sur l'index de event_date_start, bornée à la plus grande fenêtre.
+
+    Pour chaque événement, seule la fenêtre la plus courte qui le contient est
+    envoyée ; les fenêtres plus larges sont considérées comme dépassées.
+    """
+    events = session.execute(
+        select(Event.id, Event.event_date_start, Event.support_contact, Event.client_name, Event.location)
+        .where(Event.event_date_start > now, Event.event_date_start <= now + windows[-1][1])
+        .order_by(Event.event_date_start)
+    ).all()
+    if not events:
+        return []
+    sent = set(session.execute(
+        select(ReminderSent.event_id, ReminderSent.window_name, ReminderSent.event_date_start)
+        .where(ReminderSent.event_id.in_([e.id for e in events]))
+    ).all())
+
+    reminders = []
+    for e in events:
+        window = next(name for name, delta in windows if e.event_date_start <= now + delta)
+        if (e.id, window, e.event_date_start) not in sent:
+            reminders.append(Reminder(e.id, window, e.event_date_start, e.support_contact,
+                                      _plain(e.client_name), e.location))
+    return reminders
+
+
+def run_tick(session, notifier, windows=None, now=None):
+    """Envoie les rappels dus et les enregistre ; retourne les rappels envoyés.
+
+    L'état est inséré (jamais fusionné) avant l'envoi, dans la même transaction :
+    si deux planificateurs tournent en même temps, le second bute sur la clé
+    primaire (IntegrityError) et n'envoie rien. Un envoi en échec est annulé et
+    retenté au passage suivant.
+    """
+    windows = windows or parse_windows()
+    now = now or datetime.utcnow()
+    # Les événements commencés n'ont plus besoin de leur état
+    session.execute(delete(ReminderSent).where(ReminderSent.event_date_start <= now))
+    session.commit()
+
+    sent = []
+    for reminder in due_reminders(session, windows, now):
+        # Seule la fenêtre envoyée est enregistrée : les plus larges ne sont plus jamais proposées
+        session.add(ReminderSent(event_id=reminder.event_id, window_name=reminder.window,
+                                 event_date_start=reminder.event_date_start, sent_at=now,
+                                 recipient=reminder.recipient))
+        try:
+            session.flush()
+            notifier.send(reminder)
+            session.commit()
+            sent.append(reminder)
+        except IntegrityError:
+            session.rollback()
+        except Exception as e:
+            session.rollback()
+            click.echo(f"❌ Rappel de l'événement #{reminder.event_id} non envoyé : {e}")
+    return sent
+
+
+def run_daemon(session_factory, notifier, windows=None, interval=REMINDER_INTERVAL_SECONDS, max_ticks=None):
+    """Boucle du planificateur : un passage toutes les `interval` secondes"""
+    ticks = 0
+    while max_ticks is None or ticks < max_ticks:
+        with session_scope(session_factory) as session:
+            run_tick(session, notifier, windows)
+        ticks += 1
+        if max_ticks is None or ticks < max_ticks:
+            time.sleep(interval)
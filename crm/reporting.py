@@ -0,0 +1,112 @@
+from datetime import datetime
+from typing import NamedTuple
+import numpy as np
+from sqlalchemy import select
+from .models import Contract
+
+
+# Tranches d'ancienneté (en jours depuis created_at) des soldes restant dus
+AGING_BUCKETS = (30, 60, 90, 180, 365)
+PERCENTILES = (50, 90, 99)
+DIMENSIONS = ("commercial", "month", "status")
+
+
+class ContractArrays(NamedTuple):
+    """Colonnes des contrats, une ligne par contrat"""
+    commercial: np.ndarray  # str
+    status: np.ndarray  # str
+    created_at: np.ndarray  # datetime64[s], NaT si inconnue
+    amount_total: np.ndarray  # float64
+    amount_remaining: np.ndarray  # float64
+
+    @property
+    def month(self):
+        return self.created_at.astype("datetime64[M]").astype(str)
+
+
+def _labels(values):
+    labels = np.array(values, dtype=object)
+    labels[np.equal(labels, None)] = "-"
+    return labels.astype(str)
+
+
+def load_contract_arrays(session, *criteria):
+    """Charge en une seule requête de projection les colonnes utiles au rapport"""
+    rows = session.execute(
+        select(Contract.sales_contact, Contract.status, Contract.created_at,
+               Contract.amount_total, Contract.amount_remaining).where(*criteria)
+    ).all()
+    columns = list(zip(*rows)) or [(), (), (), (), ()]
+    commercial, status, created_at, amount_total, amount_remaining = columns
+    return ContractArrays(
+        commercial=_labels(commercial),
+        status=_labels(status),
+        created_at=np.array(created_at, dtype="datetime64[s]"),
+        amount_total=np.array(amount_total, dtype=np.float64),
+        amount_remaining=np.array(amount_remaining, dtype=np.float64),
+    )
+
+
+def _ratio(collected, total):
+    return np.divide(collected, total, out=np.zeros_like(total), where=total > 0)
+
+
+def group_totals(data, dimensions):
+    """Totaux, restes dus et taux d'encaissement par combinaison des dimensions demandées"""
+    if not len(data.amount_total):
+        return []
+    keys = np.column_stack([getattr(data, dimension) for dimension in dimensions])
+    labels, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    size = len(labels)
+    counts = np.bincount(inverse, minlength=size)
+    totals = np.bincount(inverse, weights=data.amount_total, minlength=size)
+    remaining = np.bincount(inverse, weights=data.amount_remaining, minlength=size)
+    ratios = _ratio(totals - remaining, totals)
+    return [
+        {**dict(zip(dimensions, label.tolist())), "count": int(count), "amount_total": float(total),
+         "amount_remaining": float(rest), "collection_ratio": round(float(ratio), 4)}
+        for label, count, total, rest, ratio in zip(labels, counts, totals, remaining, ratios)
+    ]
+
+
+def aging(data, now):
+    """Reste dû par tranche d'ancienneté (contrats non soldés dont la date est connue)"""
+    outstanding = (data.amount_remaining > 0) & ~np.isnat(data.created_at)
+    age_days = (np.datetime64(now, "s") - data.created_at[outstanding]).astype("timedelta64[D]").astype(np.int64)
+    buckets = np.digitize(age_days, AGING_BUCKETS, right=True)
+    size = len(AGING_BUCKETS) + 1
+    counts = np.bincount(buckets, minlength=size)
+    amounts = np.bincount(buckets, weights=data.amount_remaining[outstanding], minlength=size)
+    bounds = (-1,) + AGING_BUCKETS
+    labels = [f"{low + 1}-{high} j" for low, high in zip(bounds, AGING_BUCKETS)] + [f"> {AGING_BUCKETS[-1]} j"]
+    return [{"bucket": label, "count": int(count), "amount_remaining": float(amount)}
+            for label, count, amount in zip(labels, counts, amounts)], age_days
+
+
+def _percentiles(values):
+    if not len(values):
+        return {}
+    return {f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+
+def build_report(data, dimensions=DIMENSIONS, now=None):
+    """Calcule le rapport complet à partir des colonnes chargées (sans boucle par contrat)"""
+    now = now or datetime.utcnow()
+    total = float(data.amount_total.sum())
+    remaining = float(data.amount_remaining.sum())
+    buckets, age_days = aging(data, now)
+    return {
+        "generated_at": now.isoformat(timespec="seconds"),
+        "contracts": int(len(data.amount_total)),
+        "amount_total": total,
+        "amount_remaining": remaining,
+        "collection_ratio": round((total - remaining) / total, 4) if total > 0 else 0.0,
+        "groups": group_totals(data, dimensions),
+        "aging": buckets,
+        "percentiles": {
+            "amount_total": _percentiles(data.amount_total),
+            "amount_remaining": _percentiles(data.amount_remaining[data.amount_remaining > 0]),
+            "days_outstanding": _percentiles(age_days),
+        },
+    }
@@ -0,0 +1,148 @@
+import os
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, exists, literal, select
+from .changefeed import record_changes
+from .database import directory_connection, shard_connection, shard_ids
+from .models import Contract, Event, RetentionCheckpoint, contracts_archive, events_archive
+from .search import remove_document
+
+
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", 730))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 200))
+RETENTION_SLEEP_SECONDS = float(os.getenv("RETENTION_SLEEP_SECONDS", 0.2))
+
+
+def archivable_contracts(cutoff, include_unpaid=False):
+    """Contrats créés avant la date limite dont tous les événements sont terminés avant elle"""
+    criteria = [
+        Contract.created_at < cutoff,
+        ~exists().where(Event.contract_id == Contract.id, Event.event_date_end >= cutoff),
+    ]
+    if not include_unpaid:
+        # Un contrat avec un reste à payer reste dans les tables actives
+        criteria.append(Contract.amount_remaining <= 0)
+    return criteria
+
+
+def _move(connection, source, archive, where, archived_at):
+    """Copie les lignes dans l'archive puis les supprime de la table active"""
+    names = [c.name for c in source.columns]
+    rows = select(*[source.c[name] for name in names], literal(archived_at)).where(where)
+    connection.execute(archive.insert().from_select(names + ["archived_at"], rows))
+    return connection.execute(delete(source).where(where)).rowcount
+
+
+def archive_batch(session, contract_ids, shard_id=None):
+    """Archive un lot de contrats et leurs événements (enfants d'abord, pour respecter les FK)"""
+    connection = shard_connection(session, shard_id)
+    now = datetime.utcnow()
+    events = Event.__table__
+    contracts = Contract.__table__
+
+    event_ids = connection.execute(
+        select(events.c.id).where(events.c.contract_id.in_(contract_ids))
+    ).scalars().all()
+    for event_id in event_ids:
+        remove_document(connection, "event", event_id)
+
+    events_moved = _move(connection, events, events_archive, events.c.contract_id.in_(contract_ids), now)
+    contracts_moved = _move(connection, contracts, contracts_archive, contracts.c.id.in_(contract_ids), now)
+    # Pour les consommateurs du flux, une ligne archivée est une ligne supprimée
+    record_changes(directory_connection(session), "event", event_ids, "delete")
+    record_changes(directory_connection(session), "contract", contract_ids, "delete")
+    return contracts_moved, events_moved
+
+
+def _settings(days, include_unpaid):
+    return f"{days} jour(s)" + (", impayés compris" if include_unpaid else "")
+
+
+class RetentionSettingsChanged(ValueError):
+    """Reprise demandée avec une autre ancienneté ou une autre règle d'impayés que le point de reprise"""
+
+    def __init__(self, checkpoint, days, include_unpaid):
+        self.checkpoint = checkpoint
+        started = _settings(checkpoint.days if checkpoint.days is not None else days,
+                            checkpoint.include_unpaid if checkpoint.include_unpaid is not None else include_unpaid)
+        super().__init__(
+            f"Un archivage « {checkpoint.policy} » commencé avec {started} "
+            f"(avant le {checkpoint.cutoff:%Y-%m-%d}) n'est pas terminé : relancez avec "
+            f"les mêmes options pour le reprendre, ou repartez de zéro avec {_settings(days, include_unpaid)}."
+        )
+
+
+def run_retention(session, policy="default", days=RETENTION_DAYS, batch_size=RETENTION_BATCH_SIZE,
+                  sleep_seconds=RETENTION_SLEEP_SECONDS, include_unpaid=False, max_batches=None,
+                  progress=None, restart=False, on_start=None):
+    """Déplace par petits lots les contrats et événements anciens vers les tables d'archive.
+
+    Chaque lot est une transaction courte (peu de verrous) suivie d'une pause.
+    L'avancement est enregistré dans retention_checkpoints : une exécution
+    interrompue reprend après le dernier contrat traité, avec la date limite
+    d'origine. Si `days` ou `include_unpaid` diffèrent de ceux du point de reprise,
+    RetentionSettingsChanged est levée, sauf avec `restart` (point de reprise réinitialisé).
+    `on_start(state, checkpoint)` indique ce qui a été fait : "new", "resumed" ou "restarted".
+    """
+    checkpoint = session.get(RetentionCheckpoint, policy)
+    state = "resumed"
+    # NULL : point de reprise antérieur à l'enregistrement de l'option, repris tel quel
+    changed = checkpoint is not None and checkpoint.finished_at is None and (
+        checkpoint.days not in (None, days) or checkpoint.include_unpaid not in (None, include_unpaid))
+    if changed:
+        if not restart:
+            raise RetentionSettingsChanged(checkpoint, days, include_unpaid)
+        state = "restarted"
+    if checkpoint is None or checkpoint.finished_at is not None or state == "restarted":
+        if checkpoint is None:
+            checkpoint = RetentionCheckpoint(policy=policy)
+            session.add(checkpoint)
+        if state != "restarted":
+            state = "new"
+        checkpoint.cutoff = datetime.utcnow() - timedelta(days=days)
+        checkpoint.days = days
+        checkpoint.include_unpaid = include_unpaid
+        checkpoint.last_contract_id = 0
+        checkpoint.contracts_archived = 0
+        checkpoint.events_archived = 0
+        checkpoint.finished_at = None
+        checkpoint.updated_at = datetime.utcnow()
+        session.commit()
+    if on_start:
+        on_start(state, checkpoint)
+
+    criteria = archivable_contracts(checkpoint.cutoff, include_unpaid=include_unpaid)
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        # Sous sharding, chaque shard est interrogé ; le lot garde les plus petits ID de l'ensemble
+        # (uniques entre shards), ce qui conserve le sens de last_contract_id
+        found = []
+        for shard_id in shard_ids(session):
+            found += [(contract_id, shard_id) for contract_id in shard_connection(session, shard_id).execute(
+                select(Contract.id)
+                .where(Contract.id > checkpoint.last_contract_id, *criteria)
+                .order_by(Contract.id)
+                .limit(batch_size)
+            ).scalars()]
+        found = sorted(found)[:batch_size]
+        if not found:
+            checkpoint.finished_at = datetime.utcnow()
+            session.commit()
+            break
+
+        for shard_id in {shard_id for _, shard_id in found}:
+            contracts_moved, events_moved = archive_batch(
+                session, [contract_id for contract_id, s in found if s == shard_id], shard_id)
+            checkpoint.contracts_archived += contracts_moved
+            checkpoint.events_archived += events_moved
+        checkpoint.last_contract_id = found[-1][0]
+        checkpoint.updated_at = datetime.utcnow()
+        session.commit()
+        batches += 1
+
+        if progress:
+            progress(checkpoint)
+        if sleep_seconds:
+            time.sleep(sleep_seconds)
+
+    return checkpoint
@@ -0,0 +1,257 @@
+import hashlib
+import hmac
+import re
+import unicodedata
+from collections import namedtuple
+from sqlalchemy import and_, bindparam, column, event, func, literal, literal_column, or_, select, table, text
+from .models import Base, Client, Event
+from .auth import ENCRYPTION_KEY, decrypt_data
+from .database import shard_connection, shard_ids
+from .services import visible_ids
+
+
+# Code de chaque type de document : sert à calculer un rowid unique dans l'index SQLite
+ENTITIES = {"event": 0, "client": 1}
+
+SearchHit = namedtuple("SearchHit", ["entity", "entity_id", "excerpt", "score"])
+# body : texte stocké en clair en base ; keys : HMAC des mots des champs chiffrés
+Document = namedtuple("Document", ["body", "keys"])
+
+# Index créé par la migration (PostgreSQL) ou par create_all (SQLite : développement, tests)
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "entity UNINDEXED, entity_id UNINDEXED, body, keys, tokenize = 'unicode61 remove_diacritics 2')",
+]
+
+search_index = table("search_index", column("entity"), column("entity_id"), column("body"), column("document"))
+
+# Clé dérivée de la clé de chiffrement : sans elle, les mots indexés ne peuvent pas être testés
+_KEY = hmac.new(ENCRYPTION_KEY.encode(), b"crm-search-index", hashlib.sha256).digest()
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_sqlite_index(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        for statement in SQLITE_DDL:
+            connection.exec_driver_sql(statement)
+
+
+@event.listens_for(Base.metadata, "before_drop")
+def _drop_sqlite_index(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS search_index")
+
+
+def _plain(value) -> str:
+    """Retourne la valeur en clair (les champs chiffrés avec Fernet sont déchiffrés)"""
+    if not value:
+        return ""
+    try:
+        return decrypt_data(value)
+    except Exception:
+        return str(value)
+
+
+def _words(value):
+    """Mots normalisés (sans accents ni casse), comme le tokenizer de l'index"""
+    value = unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode().lower()
+    return re.findall(r"[a-z0-9]+", value)
+
+
+def word_key(word: str) -> str:
+    """Clé aveugle d'un mot normalisé"""
+    return "k" + hmac.new(_KEY, word.encode(), hashlib.sha256).hexdigest()[:24]
+
+
+def _document(*values) -> Document:
+    """Les valeurs en clair en base sont indexées telles quelles ; les valeurs chiffrées
+    seulement par les clés de leurs mots, pour ne jamais écrire leur texte dans l'index"""
+    body, keys = [], []
+    for value in values:
+        if not value:
+            continue
+        try:
+            plain = decrypt_data(value)
+        except Exception:
+            body.append(str(value))
+            continue
+        keys += [word_key(word) for word in _words(plain)]
+    return Document(" ".join(body), " ".join(dict.fromkeys(keys)))
+
+
+def event_document(evt) -> Document:
+    """Document d'un événement : client, lieu et notes"""
+    return _document(evt.client_name, evt.location, evt.notes)
+
+
+def client_document(client) -> Document:
+    """Document d'un client : l'entreprise"""
+    return _document(client.company)
+
+
+def index_document(connection, entity: str, entity_id: int, document: Document):
+    """Insère ou remplace un document de l'index"""
+    if connection.dialect.name == "sqlite":
+        rowid = entity_id * len(ENTITIES) + ENTITIES[entity]
+        connection.execute(text("DELETE FROM search_index WHERE rowid = :rowid"), {"rowid": rowid})
+        if document.body or document.keys:
+            connection.execute(
+                text("INSERT INTO search_index (rowid, entity, entity_id, body, keys) "
+                     "VALUES (:rowid, :entity, :entity_id, :body, :keys)"),
+                {"rowid": rowid, "entity": entity, "entity_id": entity_id, **document._asdict()},
+            )
+    else:
+        if not (document.body or document.keys):
+            remove_document(connection, entity, entity_id)
+            return
+        connection.execute(
+            text("INSERT INTO search_index (entity, entity_id, body, keys) "
+                 "VALUES (:entity, :entity_id, :body, :keys) "
+                 "ON CONFLICT (entity, entity_id) DO UPDATE SET body = EXCLUDED.body, keys = EXCLUDED.keys"),
+            {"entity": entity, "entity_id": entity_id, **document._asdict()},
+        )
+
+
+def remove_document(connection, entity: str, entity_id: int):
+    """Supprime un document de l'index"""
+    if connection.dialect.name == "sqlite":
+        rowid = entity_id * len(ENTITIES) + ENTITIES[entity]
+        connection.execute(text("DELETE FROM search_index WHERE rowid = :rowid"), {"rowid": rowid})
+    else:
+        connection.execute(
+            text("DELETE FROM search_index WHERE entity = :entity AND entity_id = :entity_id"),
+            {"entity": entity, "entity_id": entity_id},
+        )
+
+
+def reindex_events(connection, event_ids):
+    """Réindexe une liste d'événements modifiés hors ORM (UPDATE en masse)"""
+    event_ids = list(event_ids)
+    if not event_ids:
+        return
+    rows = connection.execute(
+        text("SELECT id, client_name, location, notes FROM events WHERE id IN :ids")
+        .bindparams(bindparam("ids", expanding=True)),
+        {"ids": event_ids},
+    )
+    for row in rows.all():
+        index_document(connection, "event", row.id, event_document(row))
+
+
+def rebuild_search_index(session, chunk_size: int = 1000) -> int:
+    """Reconstruit tout l'index par paquets (parcours par clé croissante), sur chaque shard"""
+    total = 0
+    for shard_id in shard_ids(session):
+        connection = shard_connection(session, shard_id)
+        connection.exec_driver_sql("DELETE FROM search_index")
+        for model, entity, document in ((Event, "event", event_document), (Client, "client", client_document)):
+            source = model.__table__
+            last_id = 0
+            while True:
+                rows = connection.execute(
+                    select(source).where(source.c.id > last_id).order_by(source.c.id).limit(chunk_size)
+                ).all()
+                if not rows:
+                    break
+                for row in rows:
+                    index_document(connection, entity, row.id, document(row))
+                total += len(rows)
+                last_id = rows[-1].id
+    return total
+
+
+def _match_expression(terms: str, any_term: bool = False) -> str:
+    """Transforme la saisie utilisateur en requête FTS5 : préfixe dans le texte en clair,
+    ou mot entier dans les clés des champs chiffrés"""
+    clauses = []
+    for token in re.findall(r"\w+", terms):
+        alternatives = [f'body : "{token}"*'] + [f'keys : "{word_key(word)}"' for word in _words(token)]
+        clauses.append("(" + " OR ".join(alternatives) + ")")
+    return (" OR " if any_term else " AND ").join(clauses)
+
+
+def _tsquery(terms: str) -> str:
+    """Même requête pour to_tsquery (PostgreSQL)"""
+    clauses = []
+    for token in re.findall(r"\w+", terms):
+        alternatives = [f"'{token.lower()}':*"] + [word_key(word) for word in _words(token)]
+        clauses.append("(" + " | ".join(alternatives) + ")")
+    return " & ".join(clauses)
+
+
+def _scope_criteria(user):
+    """Droits du rôle (mêmes règles que la copie locale) : documents des clients et événements visibles"""
+    scopes = visible_ids(user) if user is not None else None
+    if scopes is None:
+        return []
+    return [or_(
+        and_(search_index.c.entity == "event", search_index.c.entity_id.in_(scopes[Event.__table__])),
+        and_(search_index.c.entity == "client", search_index.c.entity_id.in_(scopes[Client.__table__])),
+    )]
+
+
+def _search_connection(connection, terms: str, limit: int, criteria):
+    if connection.dialect.name == "sqlite":
+        query = (
+            select(search_index.c.entity, search_index.c.entity_id,
+                   literal_column("snippet(search_index, 2, '[', ']', '…', 10)").label("excerpt"),
+                   literal_column("bm25(search_index)").label("score"))
+            .where(literal_column("search_index").op("MATCH")(bindparam("match")), *criteria)
+            .order_by(literal_column("score")).limit(limit)
+        )
+        rows = connection.execute(query, {"match": _match_expression(terms)}).all()
+        if not rows:
+            # Aucun document ne contient tous les mots : on élargit à n'importe lequel
+            rows = connection.execute(query, {"match": _match_expression(terms, any_term=True)}).all()
+        # bm25 : plus petit = plus pertinent
+        return [SearchHit(r.entity, int(r.entity_id), r.excerpt, -r.score) for r in rows]
+
+    q = literal_column("q")
+    query = (
+        select(search_index.c.entity, search_index.c.entity_id,
+               func.ts_headline(literal_column("'simple'"), search_index.c.body, q,
+                                "StartSel=[, StopSel=], MaxWords=20, MinWords=5").label("excerpt"),
+               (func.ts_rank_cd(search_index.c.document, q)
+                + func.word_similarity(literal(terms), search_index.c.body)).label("score"))
+        .select_from(search_index, func.to_tsquery(literal_column("'simple'"), _tsquery(terms)).alias("q"))
+        .where(or_(search_index.c.document.op("@@")(q), literal(terms).op("<%")(search_index.c.body)), *criteria)
+        .order_by(literal_column("score").desc()).limit(limit)
+    )
+    return [SearchHit(r.entity, r.entity_id, r.excerpt, r.score) for r in connection.execute(query)]
+
+
+def search(session, terms: str, limit: int = 20, user=None):
+    """Recherche classée dans les événements et les clients (sur tous les shards).
+
+    Avec `user`, seuls les documents visibles par son rôle sont renvoyés.
+    """
+    if not re.search(r"\w", terms or ""):
+        return []
+    criteria = _scope_criteria(user)
+    hits = []
+    for shard_id in shard_ids(session):
+        hits += _search_connection(shard_connection(session, shard_id), terms, limit, criteria)
+    return sorted(hits, key=lambda hit: hit.score, reverse=True)[:limit]
+
+
+# === Maintenance incrémentale de l'index à chaque écriture ===
+@event.listens_for(Event, "after_insert")
+@event.listens_for(Event, "after_update")
+def _index_event(mapper, connection, target):
+    index_document(connection, "event", target.id, event_document(target))
+
+
+@event.listens_for(Event, "after_delete")
+def _unindex_event(mapper, connection, target):
+    remove_document(connection, "event", target.id)
+
+
+@event.listens_for(Client, "after_insert")
+@event.listens_for(Client, "after_update")
+def _index_client(mapper, connection, target):
+    index_document(connection, "client", target.id, client_document(target))
+
+
+@event.listens_for(Client, "after_delete")
+def _unindex_client(mapper, connection, target):
+    remove_document(connection, "client", target.id)
@@ -0,0 +1,337 @@
+import uuid
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import func, select, update, false
+from tests.validators import check_email, check_phone, check_company, check_amount
+from .auth import encrypt_data
+from .cache import reference_cache
+from .changefeed import record_changes
+from .database import directory_connection, shard_connection, shard_ids
+from .models import Client, Contract, Event, utcnow
+
+
+VALID_STATUSES = ["new", "pending", "signed", "cancelled"]
+
+
+def contract_scope(user):
+    """Prédicat de droits : gestion = tous les contrats, commercial = uniquement les siens"""
+    role = user.get('role')
+    if role == "gestion":
+        return None
+    if role == "commercial":
+        return Contract.sales_contact == user.get('name')
+    return false()
+
+
+def visible_ids(user):
+    """Sous-requêtes des ID de clients, contrats et événements visibles par l'utilisateur"""
+    role, name = user.get('role'), user.get('name')
+    if role == "gestion":
+        return None
+    if role == "commercial":
+        clients = select(Client.id).where(Client.sales_contact == name)
+        contracts = select(Contract.id).where(Contract.sales_contact == name)
+        events = select(Event.id).where(Event.contract_id.in_(contracts))
+    else:
+        events = select(Event.id).where(Event.support_contact == name)
+        contracts = select(Event.contract_id).where(Event.support_contact == name)
+        clients = select(Contract.client_id).where(Contract.id.in_(contracts))
+    return {Client.__table__: clients, Contract.__table__: contracts, Event.__table__: events}
+
+
+def read_ids_file(path):
+    """Lit un fichier d'identifiants (un par ligne ou séparés par des virgules)"""
+    with open(path, "r") as f:
+        return [int(part) for part in f.read().replace(",", "\n").split() if part.strip()]
+
+
+def bulk_update_contracts(session, user, owner=None, status=None, client_id=None, ids=None,
+                          new_status=None, new_amount_total=None, new_amount_remaining=None):
+    """Met à jour en une seule requête UPDATE ... RETURNING tous les contrats du filtre.
+
+    Les droits du rôle sont vérifiés dans le prédicat de la requête : un commercial
+    ne peut jamais toucher les contrats d'un autre, quel que soit le filtre.
+    Retourne un résumé des lignes modifiées.
+    """
+    values = {}
+    if new_status is not None:
+        values["status"] = new_status
+    if new_amount_total is not None:
+        values["amount_total"] = float(new_amount_total)
+    if new_amount_remaining is not None:
+        values["amount_remaining"] = float(new_amount_remaining)
+        # Date de solde : conservée pour un contrat déjà soldé, effacée si un reste dû réapparaît
+        values["paid_at"] = func.coalesce(Contract.paid_at, utcnow()) if float(new_amount_remaining) <= 0 else None
+    if not values:
+        raise ValueError("Aucune modification demandée.")
+    values["last_updated"] = utcnow()
+    # Les éditions en cours sur ces contrats détecteront la modification (verrouillage optimiste)
+    values["version_id"] = Contract.version_id + 1
+
+    criteria = []
+    scope = contract_scope(user)
+    if scope is not None:
+        criteria.append(scope)
+    if owner is not None:
+        criteria.append(Contract.sales_contact == owner)
+    if status is not None:
+        criteria.append(Contract.status == status)
+    if client_id is not None:
+        criteria.append(Contract.client_id == client_id)
+    if ids is not None:
+        criteria.append(Contract.id.in_(list(ids)))
+
+    returned = (Contract.id, Contract.status, Contract.amount_total, Contract.amount_remaining)
+    rows = []
+    session.flush()
+    # Sous sharding, la même requête est exécutée sur chaque shard
+    for shard_id in shard_ids(session):
+        connection = shard_connection(session, shard_id)
+        if connection.dialect.update_returning:
+            shard_rows = connection.execute(
+                update(Contract).where(*criteria).values(**values).returning(*returned)).all()
+        else:
+            # Base sans RETURNING : on verrouille les lignes visées avant de les modifier
+            target_ids = connection.execute(select(Contract.id).where(*criteria).with_for_update()).scalars().all()
+            connection.execute(update(Contract).where(Contract.id.in_(target_ids)).values(**values))
+            shard_rows = connection.execute(
+                select(*returned).where(Contract.id.in_(target_ids))).all() if target_ids else []
+        record_changes(directory_connection(session), "contract", [row.id for row in shard_rows], "update")
+        rows += shard_rows
+
+    return {
+        "count": len(rows),
+        "ids": sorted(row.id for row in rows),
+        "by_status": dict(Counter(row.status for row in rows)),
+        "amount_total": sum(row.amount_total for row in rows),
+        "amount_remaining": sum(row.amount_remaining for row in rows),
+    }
+
+
+# === Création et modification (commandes interactives et run-batch) ===
+# Les fonctions valident, vérifient les droits sur l'objet et flushent, sans valider la
+# transaction ; une saisie invalide ou un accès refusé lève ValueError.
+def _validated(value, validator, label):
+    if value is None or str(value).strip() == "" or not validator(str(value)):
+        raise ValueError(f"{label} invalide : {value}")
+    return value
+
+
+def _amount(value):
+    return float(_validated(value, check_amount, "Montant"))
+
+
+def _status(status):
+    if status not in VALID_STATUSES:
+        raise ValueError("Statut invalide. Choisissez parmi : " + ", ".join(VALID_STATUSES))
+    return status
+
+
+def create_client(session, user, name, email, phone, company):
+    """Crée un client du commercial connecté (nom, email et téléphone chiffrés)"""
+    if not name:
+        raise ValueError("Nom invalide : vide")
+    client = Client(
+        name=encrypt_data(name),
+        email=encrypt_data(_validated(email, check_email, "Email")),
+        phone=encrypt_data(str(_validated(phone, check_phone, "Téléphone"))),
+        company=_validated(company, check_company, "Entreprise"),
+        created_at=datetime.utcnow(),
+        sales_contact=user['name'],
+    )
+    session.add(client)
+    session.flush()
+    return client
+
+
+def own_client(session, user, client_id):
+    """Client modifiable par l'utilisateur (commercial = uniquement les siens)"""
+    client = session.query(Client).filter_by(id=int(client_id), sales_contact=user.get('name')).first()
+    if not client:
+        raise ValueError("Client introuvable ou non autorisé.")
+    return client
+
+
+def client_changes(client, name=None, email=None, phone=None, company=None):
+    """Champs saisis (None = inchangé) réellement différents des valeurs en clair, rechiffrés"""
+    from .search import _plain  # search importe ce module (visible_ids)
+    entered = {
+        "name": name,
+        "email": None if email is None else _validated(email, check_email, "Email"),
+        "phone": None if phone is None else str(_validated(phone, check_phone, "Téléphone")),
+        "company": None if company is None else _validated(company, check_company, "Entreprise"),
+    }
+    return {field: encrypt_data(str(value)) for field, value in entered.items()
+            if value is not None and _plain(getattr(client, field)) != str(value)}
+
+
+def create_contract(session, user, client_id, amount_total, amount_remaining, status):
+    """Crée un contrat pour un client existant (commercial du contrat = celui du client)"""
+    amount_total, amount_remaining, status = _amount(amount_total), _amount(amount_remaining), _status(status)
+    client = session.get(Client, int(client_id))
+    if not client:
+        raise ValueError("Client non trouvé.")
+    contract = Contract(
+        unique_id=str(uuid.uuid4()),
+        client_id=client.id,
+        sales_contact=client.sales_contact,
+        amount_total=amount_total,
+        amount_remaining=amount_remaining,
+        created_at=datetime.utcnow(),
+        status=status,
+    )
+    session.add(contract)
+    session.flush()
+    return contract
+
+
+def editable_contract(session, user, contract_id):
+    """Contrat modifiable par l'utilisateur (gestion = tous, commercial = uniquement les siens)"""
+    contract = session.get(Contract, int(contract_id))
+    if not contract:
+        raise ValueError("Contrat non trouvé.")
+    if user.get('role') == "commercial" and contract.sales_contact != user.get('name'):
+        raise ValueError("Vous ne pouvez modifier que vos propres contrats.")
+    return contract
+
+
+def contract_changes(amount_total=None, amount_remaining=None, status=None):
+    """Modifications validées d'un contrat (None = inchangé)"""
+    changes = {}
+    if amount_total is not None:
+        changes["amount_total"] = _amount(amount_total)
+    if amount_remaining is not None:
+        changes["amount_remaining"] = _amount(amount_remaining)
+    if status is not None:
+        changes["status"] = _status(status)
+    return changes
+
+
+def contract_audit(action, contract):
+    """Entrée du journal d'audit d'un contrat créé ou modifié : (action, entité, ID, détails)"""
+    if action == "contract.create":
+        details = {"client_id": contract.client_id, "amount_total": contract.amount_total,
+                   "status": contract.status}
+    else:
+        details = {"amount_total": contract.amount_total, "amount_remaining": contract.amount_remaining,
+                   "status": contract.status}
+    return action, "contract", contract.id, details
+
+
+def contracts_without_event(session, user):
+    """Contrats signés du commercial sans événement associé"""
+    return session.query(Contract).filter(
+        Contract.status == "signed",
+        Contract.sales_contact == user.get("name"),
+        ~Contract.events.any(),
+    ).all()
+
+
+def support_name(support_id=None, name=None):
+    """Nom du contact support désigné par son ID ou son nom (None si aucun des deux)"""
+    support_users = reference_cache.users_with_role("support")
+    if support_id is not None and str(support_id).strip() != "":
+        try:
+            found = next((u for u in support_users if u.id == int(support_id)), None)
+        except ValueError:
+            raise ValueError("Veuillez entrer un identifiant valide ou laisser vide.")
+    elif name:
+        found = next((u for u in support_users if u.name == name), None)
+    else:
+        return None
+    if found is None:
+        raise ValueError("Contact support invalide.")
+    return found.name
+
+
+def _check_dates(start, end):
+    if start is not None and end is not None and end < start:
+        raise ValueError("La date de fin précède la date de début.")
+
+
+def _attendees(value):
+    if value is None or value == "":
+        return 0
+    if not str(value).isdigit():
+        raise ValueError(f"Nombre de participants invalide : {value}")
+    return int(value)
+
+
+def create_event(session, user, contract_id, start, end, support_contact=None, location=None,
+                 attendees=None, notes=None):
+    """Crée l'événement d'un contrat signé du commercial, qui n'en a pas encore"""
+    contract = session.query(Contract).filter_by(
+        id=int(contract_id), status="signed", sales_contact=user.get("name")
+    ).first()
+    if not contract:
+        raise ValueError("Contrat introuvable ou non autorisé.")
+    if session.query(Event).filter_by(contract_id=contract.id).first():
+        raise ValueError("Un événement existe déjà pour ce contrat.")
+    _check_dates(start, end)
+    client = contract.client
+    event = Event(
+        contract_id=contract.id,
+        client_name=client.name,
+        client_contact=f"{client.phone} | {client.email}",
+        event_date_start=start,
+        event_date_end=end,
+        support_contact=support_contact,
+        location=location,
+        attendees=_attendees(attendees),
+        notes=notes,
+    )
+    session.add(event)
+    session.flush()
+    return event
+
+
+def editable_event(session, user, event_id):
+    """Événement modifiable par l'utilisateur (gestion = tous, support = ceux dont il est le contact)"""
+    event = session.get(Event, int(event_id))
+    if not event:
+        raise ValueError("Événement non trouvé.")
+    if user.get('role') == "support" and event.support_contact != user.get('name'):
+        raise ValueError("Vous ne pouvez modifier que les événements où vous êtes le contact support.")
+    return event
+
+
+def event_changes(event, start=None, end=None, support_contact=None, location=None, attendees=None, notes=None):
+    """Modifications validées d'un événement (None = inchangé) ; un nouveau contact support
+    doit être un utilisateur du rôle support"""
+    changes = {}
+    if start is not None:
+        changes["event_date_start"] = start
+    if end is not None:
+        changes["event_date_end"] = end
+    _check_dates(changes.get("event_date_start", event.event_date_start),
+                 changes.get("event_date_end", event.event_date_end))
+    if support_contact is not None and support_contact != event.support_contact:
+        changes["support_contact"] = support_name(name=support_contact)
+    if location is not None:
+        changes["location"] = location
+    if attendees is not None:
+        changes["attendees"] = _attendees(attendees)
+    if notes is not None:
+        changes["notes"] = notes
+    return changes
+
+
+def assign_support(session, user, event_id, support_id=None, name=None):
+    """Désigne le contact support d'un événement"""
+    event = session.get(Event, int(event_id))
+    if not event:
+        raise ValueError("Événement non trouvé.")
+    support = support_name(support_id, name)
+    if support is None:
+        raise ValueError("Champ manquant : support_id ou support_name")
+    event.support_contact = support
+    session.flush()
+    return event
+
+
+def apply_changes(session, obj, changes):
+    """Applique des modifications validées, sans gestion de conflit (run-batch)"""
+    for field, value in changes.items():
+        setattr(obj, field, value)
+    session.flush()
+    return obj
@@ -0,0 +1,247 @@
+import gc
+import os
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+from contextlib import contextmanager
+import click
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+from .database import current_command_name, engine, replica_engines
+
+
+# Mode débogage : sessions non fermées signalées après chaque commande
+DEBUG_SESSIONS = os.getenv("CRM_DEBUG_SESSIONS", "") not in ("", "0")
+DEBUG_SESSIONS_FRAMES = int(os.getenv("CRM_DEBUG_SESSIONS_FRAMES", 8))
+POOL_WAIT_SAMPLES = 1000
+
+# Frames ignorées dans les piles : SQLAlchemy et ce module
+_INTERNAL = (os.sep + "sqlalchemy" + os.sep, __file__)
+
+
+@contextmanager
+def session_scope(factory, commit=False):
+    """Unité de travail : la session est toujours fermée à la sortie du bloc, y compris
+    sur un `return` anticipé ; annulée en cas d'exception, validée si `commit`.
+
+    Les commandes passent leur fabrique (ex: `session_scope(SessionLocal)`), ce
+    qui permet aux tests de la remplacer.
+    """
+    session = factory()
+    try:
+        yield session
+        if commit:
+            session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def _caller_stack(limit):
+    frames = [f for f in traceback.extract_stack() if not any(marker in f.filename for marker in _INTERNAL)]
+    return "".join(traceback.format_list(frames[-limit:]))
+
+
+class SessionLeakDetector:
+    """Repère les sessions qui gardent une connexion après la fin de leur commande.
+
+    Une session prend une connexion au premier accès à la base et la garde
+    jusqu'à commit, rollback ou close. La pile de ce premier accès est
+    mémorisée ; à la fin de chaque commande, les sessions encore en
+    transaction, ou libérées seulement par le ramasse-miettes, sont signalées.
+    """
+
+    def __init__(self, frames=DEBUG_SESSIONS_FRAMES, echo=True):
+        self.frames = frames
+        self.echo = echo
+        self.reports = []
+        self._open = {}
+        self._collected = []
+        self._lock = threading.Lock()
+
+    def install(self):
+        event.listen(Session, "after_begin", self._after_begin)
+        event.listen(Session, "after_transaction_end", self._after_transaction_end)
+        return self
+
+    def uninstall(self):
+        event.remove(Session, "after_begin", self._after_begin)
+        event.remove(Session, "after_transaction_end", self._after_transaction_end)
+
+    def _after_begin(self, session, transaction, connection):
+        key = id(session)
+        with self._lock:
+            if key in self._open:
+                return
+            ref = weakref.ref(session, lambda _, key=key: self._on_collected(key))
+            self._open[key] = (ref, _caller_stack(self.frames), time.monotonic(), current_command_name())
+
+    def _after_transaction_end(self, session, transaction):
+        if transaction.parent is None:
+            with self._lock:
+                self._open.pop(id(session), None)
+
+    def _on_collected(self, key):
+        with self._lock:
+            entry = self._open.pop(key, None)
+            if entry is not None:
+                self._collected.append(entry)
+
+    def leaks(self):
+        """Sessions encore en transaction et sessions libérées par le ramasse-miettes sans close()"""
+        gc.collect()
+        now = time.monotonic()
+        with self._lock:
+            open_entries = [entry for entry in self._open.values() if entry[0]() is not None]
+            collected, self._collected = self._collected, []
+        return (
+            [{"state": "open", "command": c, "age_s": round(now - t, 3), "stack": s} for _, s, t, c in open_entries]
+            + [{"state": "collected", "command": c, "age_s": round(now - t, 3), "stack": s}
+               for _, s, t, c in collected]
+        )
+
+    def run(self, name, func, *args, **kwargs):
+        """Exécute func puis signale les sessions restées ouvertes"""
+        try:
+            return func(*args, **kwargs)
+        finally:
+            report = {"command": name, "leaks": self.leaks(), "pools": pool_metrics.snapshot()}
+            self.reports.append(report)
+            if self.echo:
+                click.echo(format_leak_report(report), err=True)
+
+
+def format_leak_report(report):
+    lines = []
+    for leak in report["leaks"]:
+        state = "encore ouverte" if leak["state"] == "open" else "fermée par le ramasse-miettes"
+        lines.append(f"\n⚠️ Session {state} [{leak['command'] or report['command']}] "
+                     f"depuis {leak['age_s']} s, ouverte ici :")
+        lines.append("  " + leak["stack"].rstrip().replace("\n", "\n  "))
+    for pool in report["pools"]:
+        lines.append(
+            f"🔌 Pool {pool['url']} : {pool['checked_out']} connexion(s) prise(s) "
+            f"(max {pool['max_checked_out']}, débordement {pool['overflow']}/{pool['max_overflow']}) | "
+            f"{pool['checkouts']} emprunt(s), attente moy. {pool['wait_ms_mean']} ms / max {pool['wait_ms_max']} ms"
+            + (f" | ⛔ {pool['timeouts']} délai(s) dépassé(s)" if pool["timeouts"] else "")
+        )
+    return "\n".join(lines)
+
+
+class PoolMetrics:
+    """Compteurs des pools de connexions : emprunts, débordement, temps d'attente, délais dépassés"""
+
+    def __init__(self, samples=POOL_WAIT_SAMPLES):
+        self.samples = samples
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def install(self, target):
+        pool = target.pool
+        if id(pool) in self._pools:
+            return self
+        stats = {
+            "pool": weakref.ref(pool), "url": target.url.render_as_string(hide_password=True),
+            "checkouts": 0, "checkins": 0, "connects": 0, "invalidations": 0, "timeouts": 0,
+            "max_checked_out": 0, "max_overflow_used": 0, "waits": deque(maxlen=self.samples), "wait_total": 0.0,
+        }
+        self._pools[id(pool)] = stats
+        event.listen(pool, "checkout", lambda *a: self._on_checkout(pool, stats))
+        event.listen(pool, "checkin", lambda *a: self._count(stats, "checkins"))
+        event.listen(pool, "connect", lambda *a: self._count(stats, "connects"))
+        event.listen(pool, "invalidate", lambda *a: self._count(stats, "invalidations"))
+
+        # Temps passé à attendre une connexion libre (pas d'événement « avant emprunt »)
+        connect = pool.connect
+
+        def timed_connect():
+            started = time.perf_counter()
+            try:
+                return connect()
+            except PoolTimeoutError:
+                self._count(stats, "timeouts")
+                raise
+            finally:
+                elapsed = (time.perf_counter() - started) * 1000
+                with self._lock:
+                    stats["waits"].append(elapsed)
+                    stats["wait_total"] += elapsed
+
+        pool.connect = timed_connect
+        return self
+
+    def _count(self, stats, name):
+        with self._lock:
+            stats[name] += 1
+
+    def _on_checkout(self, pool, stats):
+        checked_out = pool.checkedout() if hasattr(pool, "checkedout") else 0
+        # QueuePool.overflow() est négatif tant que le pool n'est pas plein
+        overflow = max(0, pool.overflow()) if hasattr(pool, "overflow") else 0
+        with self._lock:
+            stats["checkouts"] += 1
+            stats["max_checked_out"] = max(stats["max_checked_out"], checked_out)
+            stats["max_overflow_used"] = max(stats["max_overflow_used"], overflow)
+
+    def snapshot(self):
+        result = []
+        with self._lock:
+            for stats in self._pools.values():
+                pool = stats["pool"]()
+                if pool is None:
+                    continue
+                waits = sorted(stats["waits"])
+                result.append({
+                    "url": stats["url"],
+                    "size": pool.size() if hasattr(pool, "size") else None,
+                    "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+                    "overflow": max(0, pool.overflow()) if hasattr(pool, "overflow") else None,
+                    "max_overflow": getattr(pool, "_max_overflow", None),
+                    "max_checked_out": stats["max_checked_out"],
+                    "max_overflow_used": stats["max_overflow_used"],
+                    "checkouts": stats["checkouts"],
+                    "checkins": stats["checkins"],
+                    "connects": stats["connects"],
+                    "invalidations": stats["invalidations"],
+                    "timeouts": stats["timeouts"],
+                    "wait_ms_total": round(stats["wait_total"], 3),
+                    "wait_ms_mean": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                    "wait_ms_p95": round(waits[int(0.95 * (len(waits) - 1))], 3) if waits else 0.0,
+                    "wait_ms_max": round(waits[-1], 3) if waits else 0.0,
+                })
+        return result
+
+
+pool_metrics = PoolMetrics()
+for _engine in (engine, *replica_engines):
+    pool_metrics.install(_engine)
+
+_leak_detector = None
+
+
+def enable_session_debug(echo=True):
+    """Active la détection des sessions non fermées pour les commandes suivantes (CLI ou menu)"""
+    global _leak_detector
+    if _leak_detector is None:
+        _leak_detector = SessionLeakDetector(echo=echo).install()
+    return _leak_detector
+
+
+def disable_session_debug():
+    global _leak_detector
+    if _leak_detector is not None:
+        _leak_detector.uninstall()
+    _leak_detector = None
+
+
+def leak_detector():
+    return _leak_detector
+
+
+if DEBUG_SESSIONS:
+    enable_session_debug()
@@ -0,0 +1,365 @@
+import os
+import threading
+import time
+import zlib
+from sqlalchemy import create_engine, delete, event, func, insert, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.util import find_tables
+from .database import DIRECTORY, Base, SessionLocal as DefaultSessionLocal, engine
+from .models import Client, Contract, Event, IdSequence, ReferenceVersion, ShardMap
+from .cache import bump_version
+from .sessions import pool_metrics
+from .search import client_document, index_document, reindex_events, remove_document
+
+
+# Bases des données clients, ex: "shard0=postgresql://...,shard1=postgresql://..."
+SHARD_URLS = os.getenv("SHARD_URLS", "")
+SHARD_ID_BLOCK_SIZE = int(os.getenv("SHARD_ID_BLOCK_SIZE", 100))
+# Délai pendant lequel l'emplacement des clients est lu en cache sans revérifier l'annuaire (en secondes)
+SHARD_MAP_REVALIDATE_SECONDS = float(os.getenv("SHARD_MAP_REVALIDATE_SECONDS", 5))
+
+SHARDED_MODELS = (Client, Contract, Event)
+SHARDED_TABLES = {model.__table__ for model in SHARDED_MODELS}
+SEQUENCES = {model: model.__tablename__ for model in SHARDED_MODELS}
+# Version de l'annuaire (reference_versions), incrémentée à chaque déplacement de client
+SHARD_MAP_VERSION = "shard_map"
+
+
+def parse_shard_urls(spec):
+    """ "a=url1,b=url2" ou "url1,url2" -> {"a": url1, "b": url2} / {"shard0": url1, "shard1": url2}"""
+    shards = {}
+    for index, part in enumerate(p.strip() for p in spec.split(",") if p.strip()):
+        name, sep, url = part.partition("=")
+        if not sep or "://" in name:
+            name, url = f"shard{index}", part
+        shards[name] = url
+    return shards
+
+
+class IdAllocator:
+    """Identifiants uniques sur l'ensemble des shards, réservés par blocs dans l'annuaire.
+
+    Un bloc de `block_size` ID est réservé en une transaction courte ; les ID
+    sont ensuite distribués sans aller-retour jusqu'à épuisement du bloc.
+    """
+
+    def __init__(self, bind, block_size=SHARD_ID_BLOCK_SIZE):
+        self.bind = bind
+        self.block_size = block_size
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def _reserve(self, name):
+        with self.bind.begin() as connection:
+            result = connection.execute(
+                update(IdSequence).where(IdSequence.name == name)
+                .values(next_id=IdSequence.next_id + self.block_size)
+            )
+            if result.rowcount:
+                end = connection.execute(select(IdSequence.next_id).where(IdSequence.name == name)).scalar()
+                return end - self.block_size
+        try:
+            with self.bind.begin() as connection:
+                connection.execute(insert(IdSequence).values(name=name, next_id=1 + self.block_size))
+            return 1
+        except IntegrityError:
+            # Séquence créée entre-temps par un autre processus
+            return self._reserve(name)
+
+    def next_id(self, name):
+        with self._lock:
+            start, end = self._blocks.get(name, (0, 0))
+            if start >= end:
+                start = self._reserve(name)
+                end = start + self.block_size
+            self._blocks[name] = (start + 1, end)
+            return start
+
+    def seed(self, name, minimum):
+        """Garantit que les prochains ID dépassent `minimum` (mise en place sur des données existantes)"""
+        with self.bind.begin() as connection:
+            current = connection.execute(select(IdSequence.next_id).where(IdSequence.name == name)).scalar()
+            if current is None:
+                connection.execute(insert(IdSequence).values(name=name, next_id=minimum + 1))
+            elif current <= minimum:
+                connection.execute(update(IdSequence).where(IdSequence.name == name).values(next_id=minimum + 1))
+        with self._lock:
+            self._blocks.pop(name, None)
+
+
+class ShardRouter:
+    """Répartition des clients (et de leurs contrats/événements) entre plusieurs bases.
+
+    Un nouveau client est placé selon un hachage stable de son commercial ;
+    son shard est ensuite enregistré dans l'annuaire (shard_map), ce qui permet
+    de le déplacer. Contrats et événements suivent toujours leur client.
+
+    L'emplacement des clients est mis en cache dans le processus ; un
+    déplacement (par n'importe quel processus) incrémente la version de
+    l'annuaire, relue au plus toutes les `revalidate_seconds` secondes, et
+    vide alors le cache.
+    """
+
+    def __init__(self, directory, shards, block_size=SHARD_ID_BLOCK_SIZE,
+                 revalidate_seconds=SHARD_MAP_REVALIDATE_SECONDS):
+        self.directory = directory
+        self.engines = {name: create_engine(url) if isinstance(url, str) else url for name, url in shards.items()}
+        self.names = sorted(self.engines)
+        self.allocator = IdAllocator(directory, block_size)
+        self.revalidate_seconds = revalidate_seconds
+        self._client_shards = {}
+        self._contract_clients = {}
+        self._map_version = None
+        self._map_checked_at = None
+        self._lock = threading.Lock()
+
+    def create_all(self):
+        Base.metadata.create_all(self.directory)
+        for shard in self.engines.values():
+            Base.metadata.create_all(shard)
+
+    # --- Choix du shard ---
+    def shard_for_owner(self, owner):
+        return self.names[zlib.crc32((owner or "").encode()) % len(self.names)]
+
+    def _revalidate(self):
+        now = time.monotonic()
+        if self._map_checked_at is not None and now - self._map_checked_at < self.revalidate_seconds:
+            return
+        with self.directory.connect() as connection:
+            version = connection.execute(
+                select(ReferenceVersion.version).where(ReferenceVersion.name == SHARD_MAP_VERSION)).scalar()
+        with self._lock:
+            if version != self._map_version:
+                self._client_shards.clear()
+                self._contract_clients.clear()
+                self._map_version = version
+            self._map_checked_at = now
+
+    def client_shard(self, client_id):
+        self._revalidate()
+        if client_id not in self._client_shards:
+            with self.directory.connect() as connection:
+                shard = connection.execute(select(ShardMap.shard).where(ShardMap.client_id == client_id)).scalar()
+            if shard is None:
+                return None
+            self._client_shards[client_id] = shard
+        return self._client_shards[client_id]
+
+    def assign(self, client_id, shard):
+        with self.directory.begin() as connection:
+            moved = connection.execute(update(ShardMap).where(ShardMap.client_id == client_id).values(shard=shard))
+            if moved.rowcount == 0:
+                connection.execute(insert(ShardMap).values(client_id=client_id, shard=shard))
+            else:
+                bump_version(connection, SHARD_MAP_VERSION)
+        self._client_shards[client_id] = shard
+
+    def contract_shard(self, contract_id):
+        if contract_id not in self._contract_clients:
+            for name in self.names:
+                with self.engines[name].connect() as connection:
+                    client_id = connection.execute(
+                        select(Contract.client_id).where(Contract.id == contract_id)).scalar()
+                if client_id is not None:
+                    self._contract_clients[contract_id] = client_id
+                    break
+            else:
+                return None
+        return self.client_shard(self._contract_clients[contract_id])
+
+    def shard_for(self, instance):
+        if isinstance(instance, Client):
+            return (instance.id and self.client_shard(instance.id)) or self.shard_for_owner(instance.sales_contact)
+        if isinstance(instance, Contract):
+            client = instance.__dict__.get("client")
+            return self.client_shard(client.id if client is not None else instance.client_id)
+        if isinstance(instance, Event):
+            contract = instance.__dict__.get("contract")
+            if contract is not None:
+                return inspect(contract).identity_token or self.client_shard(contract.client_id)
+            return self.contract_shard(instance.contract_id)
+        return DIRECTORY
+
+    # --- Fonctions attendues par ShardedSession ---
+    def shard_chooser(self, mapper, instance, clause=None):
+        if mapper is None and instance is None and clause is None:
+            # session.connection() sans shard : l'annuaire ne contient pas les données clients
+            raise ValueError("Connexion sans shard : utilisez database.shard_connection(session, shard) "
+                             "pour chaque shard de database.shard_ids(session).")
+        if mapper is None or mapper.class_ not in SHARDED_MODELS or instance is None:
+            return DIRECTORY
+        shard = self.shard_for(instance)
+        if shard is None:
+            raise ValueError(f"Shard introuvable pour {instance!r}")
+        return shard
+
+    def identity_chooser(self, mapper, primary_key, *, lazy_loaded_from, **kw):
+        if lazy_loaded_from is not None:
+            return [lazy_loaded_from.identity_token]
+        if mapper.class_ not in SHARDED_MODELS:
+            return [DIRECTORY]
+        if mapper.class_ is Client:
+            shard = self.client_shard(primary_key[0])
+            if shard is not None:
+                return [shard]
+        return self.names
+
+    def execute_chooser(self, context):
+        """Requêtes sur les tables clients/contrats/événements : tous les shards (scatter-gather)"""
+        tables = find_tables(context.statement, include_crud=True, include_joins=True)
+        if any(table in SHARDED_TABLES for table in tables):
+            return self.names
+        return [DIRECTORY]
+
+
+def sharded_sessionmaker(router):
+    return sessionmaker(
+        class_=ShardedSession,
+        shards={DIRECTORY: router.directory, **router.engines},
+        shard_chooser=router.shard_chooser,
+        identity_chooser=router.identity_chooser,
+        execute_chooser=router.execute_chooser,
+        info={"shard_router": router},
+    )
+
+
+@event.listens_for(ShardedSession, "before_flush")
+def _allocate_ids(session, flush_context, instances):
+    """Attribue un ID global aux nouveaux objets, et enregistre le shard des nouveaux clients"""
+    router = session.info.get("shard_router")
+    if router is None:
+        return
+    new = list(session.new)
+    for model in SHARDED_MODELS:
+        for obj in new:
+            if type(obj) is model and obj.id is None:
+                obj.id = router.allocator.next_id(SEQUENCES[model])
+                if model is Client:
+                    router.assign(obj.id, router.shard_for_owner(obj.sales_contact))
+
+
+# === Outils de rééquilibrage ===
+def shard_counts(router):
+    """Nombre de clients par shard selon l'annuaire"""
+    with router.directory.connect() as connection:
+        counts = dict(connection.execute(select(ShardMap.shard, func.count()).group_by(ShardMap.shard)).all())
+    return {name: counts.get(name, 0) for name in router.names}
+
+
+class ClientMoved(RuntimeError):
+    """Client modifié sur son shard d'origine pendant son déplacement"""
+
+
+def _client_rows(connection, client_id, lock=False):
+    """Lignes (client, contrats, événements) d'un client sur un shard, verrouillées si `lock`"""
+    clients, contracts, events = Client.__table__, Contract.__table__, Event.__table__
+
+    def fetch(stmt):
+        stmt = stmt.with_for_update() if lock else stmt
+        return connection.execute(stmt).all()
+
+    client_rows = fetch(select(clients).where(clients.c.id == client_id))
+    contract_rows = fetch(select(contracts).where(contracts.c.client_id == client_id).order_by(contracts.c.id))
+    contract_ids = [row.id for row in contract_rows]
+    event_rows = fetch(select(events).where(events.c.contract_id.in_(contract_ids))
+                       .order_by(events.c.id)) if contract_ids else []
+    return client_rows, contract_rows, event_rows
+
+
+def move_client(router, client_id, target, source=None):
+    """Déplace un client, ses contrats et ses événements vers un autre shard.
+
+    Ordre : verrouillage des lignes sur la source (SELECT ... FOR UPDATE, jusqu'à la fin),
+    copie sur la cible, vérification que la source n'a pas changé, suppression sur la
+    source, validée après la mise à jour de l'annuaire. Un processus dont le cache pointe encore vers
+    la source attend la fin du déplacement, puis son écriture échoue (ligne absente ou
+    modifiée) au lieu d'être perdue. Chaque étape est rejouable : relancer après une
+    interruption termine le déplacement sans doublon.
+    Retourne le nombre de lignes déplacées ; lève ClientMoved si la source a changé.
+    """
+    source = source or router.client_shard(client_id)
+    if source is None or source == target:
+        return 0
+    clients, contracts, events = Client.__table__, Contract.__table__, Event.__table__
+
+    # Les autres processus revalident leur cache dès maintenant, sans attendre la fin
+    with router.directory.begin() as connection:
+        bump_version(connection, SHARD_MAP_VERSION)
+
+    with router.engines[source].begin() as source_connection:
+        rows = _client_rows(source_connection, client_id, lock=True)
+        client_rows, contract_rows, event_rows = rows
+        contract_ids = [row.id for row in contract_rows]
+        event_ids = [row.id for row in event_rows]
+
+        with router.engines[target].begin() as connection:
+            connection.execute(delete(events).where(events.c.id.in_(event_ids)))
+            connection.execute(delete(contracts).where(contracts.c.id.in_(contract_ids)))
+            connection.execute(delete(clients).where(clients.c.id == client_id))
+            for table, table_rows in ((clients, client_rows), (contracts, contract_rows), (events, event_rows)):
+                if table_rows:
+                    connection.execute(insert(table), [row._asdict() for row in table_rows])
+            for row in client_rows:
+                index_document(connection, "client", client_id, client_document(row))
+            reindex_events(connection, event_ids)
+
+        # Sans verrou de ligne (SQLite), une écriture a pu passer pendant la copie
+        if _client_rows(source_connection, client_id) != rows:
+            raise ClientMoved(f"Client {client_id} modifié sur {source} pendant son déplacement : relancez-le.")
+        for event_id in event_ids:
+            remove_document(source_connection, "event", event_id)
+        remove_document(source_connection, "client", client_id)
+        source_connection.execute(delete(events).where(events.c.id.in_(event_ids)))
+        source_connection.execute(delete(contracts).where(contracts.c.id.in_(contract_ids)))
+        source_connection.execute(delete(clients).where(clients.c.id == client_id))
+        router.assign(client_id, target)
+
+    for contract_id in contract_ids:
+        router._contract_clients[contract_id] = client_id
+    return len(client_rows) + len(contract_rows) + len(event_rows)
+
+
+def plan_rebalance(router):
+    """Déplacements (client_id, source, cible) pour équilibrer le nombre de clients par shard"""
+    counts = shard_counts(router)
+    target_size = -(-sum(counts.values()) // len(counts))  # arrondi supérieur
+    plan = []
+    with router.directory.connect() as connection:
+        for source in sorted(counts, key=counts.get, reverse=True):
+            excess = counts[source] - target_size
+            if excess <= 0:
+                continue
+            candidates = connection.execute(
+                select(ShardMap.client_id).where(ShardMap.shard == source)
+                .order_by(ShardMap.client_id.desc()).limit(excess)
+            ).scalars().all()
+            for client_id in candidates:
+                target = min(counts, key=counts.get)
+                if counts[target] >= target_size:
+                    break
+                plan.append((client_id, source, target))
+                counts[source] -= 1
+                counts[target] += 1
+    return plan
+
+
+def rebalance(router, limit=None, progress=None):
+    plan = plan_rebalance(router)[:limit]
+    for done, (client_id, source, target) in enumerate(plan, start=1):
+        move_client(router, client_id, target, source=source)
+        if progress:
+            progress(done, len(plan), client_id, source, target)
+    return plan
+
+
+router = ShardRouter(engine, parse_shard_urls(SHARD_URLS)) if SHARD_URLS else None
+if router is not None:
+    router.create_all()
+    for _shard in router.engines.values():
+        pool_metrics.install(_shard)
+
+# Fabrique de sessions de l'application : répartie si SHARD_URLS est défini
+SessionLocal = sharded_sessionmaker(router) if router is not None else DefaultSessionLocal
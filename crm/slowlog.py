@@ -0,0 +1,202 @@
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import random
+import re
+import time
+from datetime import datetime
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .database import current_command_name
+
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", ".slow_queries.log")
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", 5 * 1024 * 1024))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", 3))
+# Part des requêtes lentes (SELECT, Postgres) dont le plan EXPLAIN ANALYZE est capturé
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", 0.1))
+
+# Jetons Fernet (base64 url de l'octet de version 0x80) et empreintes argon2
+_SECRET = re.compile(r"gAAAAA[\w-]{20,}={0,2}|\$argon2[\w$=,+/.-]+")
+_MAX_VALUE_LENGTH = 200
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|:\w+|\$\d+|\?")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+# Requêtes rejouables sous EXPLAIN ANALYZE : lectures pures (EXPLAIN ANALYZE exécute la requête)
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_SIDE_EFFECTS = re.compile(
+    r"\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b"   # verrous de lignes
+    r"|\b(pg_advisory\w*|nextval|setval)\s*\("                  # verrous consultatifs, séquences
+    r"|\b(INSERT|UPDATE|DELETE|MERGE)\b",                       # CTE qui modifient des données
+    re.IGNORECASE,
+)
+_SPACES = re.compile(r"\s+")
+
+
+def redact(value):
+    """Masque les valeurs chiffrées et tronque les valeurs longues"""
+    if isinstance(value, dict):
+        return {k: redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} octets>"
+    if isinstance(value, str):
+        value = _SECRET.sub("<chiffré>", value)
+        return value if len(value) <= _MAX_VALUE_LENGTH else value[:_MAX_VALUE_LENGTH] + "…"
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def normalize(statement):
+    """Forme canonique d'une requête : littéraux et paramètres remplacés, listes IN repliées"""
+    text = _STRING.sub("?", statement)
+    text = _PLACEHOLDER.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _SPACES.sub(" ", text).strip()
+    return _IN_LIST.sub("(...)", text)
+
+
+def explainable(statement):
+    """Vrai pour une lecture sans effet de bord (SELECT / WITH sans verrou, séquence ni écriture)"""
+    return bool(_EXPLAINABLE.match(statement)) and not _SIDE_EFFECTS.search(statement)
+
+
+class SlowQueryRecorder:
+    """Journal des requêtes plus lentes que `threshold_ms`, dans un fichier JSONL à rotation.
+
+    Chaque entrée contient la requête, ses paramètres (valeurs chiffrées masquées),
+    la commande CLI en cours et, sous Postgres, pour une partie des SELECT,
+    le plan EXPLAIN (ANALYZE, BUFFERS).
+    """
+
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, path=SLOW_QUERY_LOG, explain_rate=SLOW_QUERY_EXPLAIN_RATE,
+                 max_bytes=SLOW_QUERY_LOG_MAX_BYTES, backups=SLOW_QUERY_LOG_BACKUPS):
+        self.threshold_ms = threshold_ms
+        self.path = path
+        self.explain_rate = explain_rate
+        self.logger = logging.getLogger(f"crm.slow_queries.{id(self)}")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self._handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                             delay=True, encoding="utf-8")
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger.addHandler(self._handler)
+        self._targets = []
+
+    def install(self, target=Engine):
+        event.listen(target, "before_cursor_execute", self._before)
+        event.listen(target, "after_cursor_execute", self._after)
+        self._targets.append(target)
+        return self
+
+    def uninstall(self):
+        for target in self._targets:
+            event.remove(target, "before_cursor_execute", self._before)
+            event.remove(target, "after_cursor_execute", self._after)
+        self._targets = []
+        self._handler.close()
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slowlog_started", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("slowlog_started")
+        if not started:
+            return
+        duration_ms = (time.perf_counter() - started.pop()) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+        entry = {
+            "at": datetime.utcnow().isoformat(timespec="seconds"),
+            "duration_ms": round(duration_ms, 2),
+            "command": current_command_name(),
+            "dialect": conn.dialect.name,
+            "statement": _SECRET.sub("<chiffré>", statement),
+            "normalized": normalize(_SECRET.sub("<chiffré>", statement)),
+            "parameters": redact(parameters),
+            "executemany": executemany,
+            "plan": None,
+        }
+        if self._should_explain(conn, statement, executemany):
+            entry["plan"] = self._explain(cursor, statement, parameters)
+        self.logger.info(json.dumps(entry, default=str, ensure_ascii=False))
+
+    def _should_explain(self, conn, statement, executemany):
+        return (conn.dialect.name == "postgresql" and not executemany
+                and explainable(statement)
+                and random.random() < self.explain_rate)
+
+    def _explain(self, cursor, statement, parameters):
+        """Rejoue la requête sous EXPLAIN ANALYZE dans un savepoint, via le curseur DBAPI
+        (pas d'événement SQLAlchemy, et une erreur n'interrompt pas la transaction).
+        Le savepoint est toujours annulé : rien de la seconde exécution n'est conservé."""
+        raw = cursor.connection.cursor()
+        try:
+            raw.execute("SAVEPOINT crm_slowlog")
+            try:
+                raw.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+                return "\n".join(row[0] for row in raw.fetchall())
+            except Exception as e:
+                return f"EXPLAIN impossible : {e}"
+            finally:
+                raw.execute("ROLLBACK TO SAVEPOINT crm_slowlog")
+                raw.execute("RELEASE SAVEPOINT crm_slowlog")
+        except Exception:
+            return None
+        finally:
+            raw.close()
+
+
+def read_entries(path=SLOW_QUERY_LOG):
+    """Entrées du journal et de ses fichiers de rotation"""
+    for filename in sorted(glob.glob(f"{glob.escape(path)}*"), reverse=True):
+        with open(filename, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def summarize(entries, top=20):
+    """Regroupe les entrées par requête normalisée, triées par temps total"""
+    groups = {}
+    for entry in entries:
+        group = groups.setdefault(entry["normalized"], {"durations": [], "commands": set(), "plans": 0,
+                                                        "seq_scans": 0, "example": entry})
+        group["durations"].append(entry["duration_ms"])
+        if entry.get("command"):
+            group["commands"].add(entry["command"])
+        if entry.get("plan"):
+            group["plans"] += 1
+            group["seq_scans"] += "Seq Scan" in entry["plan"]
+            group["example"] = entry
+
+    summary = []
+    for normalized, group in groups.items():
+        durations = np.array(group["durations"])
+        summary.append({
+            "normalized": normalized,
+            "count": int(len(durations)),
+            "total_ms": round(float(durations.sum()), 2),
+            "mean_ms": round(float(durations.mean()), 2),
+            "p95_ms": round(float(np.percentile(durations, 95)), 2),
+            "max_ms": round(float(durations.max()), 2),
+            "commands": sorted(group["commands"]),
+            "plans": group["plans"],
+            "seq_scans": group["seq_scans"],
+            "example_plan": group["example"].get("plan"),
+        })
+    summary.sort(key=lambda s: s["total_ms"], reverse=True)
+    return summary[:top]
+
+
+recorder = SlowQueryRecorder().install() if SLOW_QUERY_LOG and SLOW_QUERY_MS >= 0 else None
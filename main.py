@@ -1,9 +1,13 @@
+import click
 import questionary
 from crm.cli import add_user, delete_user, update_user, list_users
 from crm.cli import add_event, update_event, list_events_no_support, list_events_support
 from crm.cli import add_client, update_client
 from crm.cli import add_contract, update_contract, list_contracts_unsigned_unpaid
 from crm.cli import add_role, login, logout, whoami
+from crm.cli import search
+from crm.profiling import enable_cpu_profiling, enable_memory_profiling
+from crm.sessions import enable_session_debug
 import sys
 import sentry_sdk
 import os
@@ -26,6 +30,19 @@ def simulate_crash():
         print("Exception capturée et envoyée à Sentry./n")
 
 
+def run(command):
+    """Exécute une commande click et revient au menu : en mode autonome, click termine
+    le processus (SystemExit) à la fin de chaque commande"""
+    try:
+        command.main(args=[], prog_name=command.name, standalone_mode=False)
+    except click.ClickException as e:
+        e.show()
+    except click.Abort:
+        print("Action annulée, retour au menu.")
+    except SystemExit:
+        print("Action terminée, retour au menu.")
+
+
 def menu_admin():
     while True:
         choix = questionary.select(
@@ -40,13 +57,13 @@ def menu_admin():
             ]).ask()
 
         if choix == "Ajouter un role":
-            add_role()
+            run(add_role)
         elif choix == "Se connecter":
-            login()
+            run(login)
         elif choix == "Se déconnecter":
-            logout()
+            run(logout)
         elif choix == "Qui est connecté ?":
-            whoami()
+            run(whoami)
         elif choix == "Retour au menu principal":
             break
         elif choix == "Quitter":
@@ -68,18 +85,16 @@ def menu_users():
             ]).ask()
 
         if choix == "Ajouter un utilisateur":
-            add_user()
+            run(add_user)
         elif choix == "Supprimer un utilisateur":
             try:
-                delete_user()
-            except SystemExit:
-                print("Action terminée, retour au menu.")
+                run(delete_user)
             except Exception as e:
                 print(f"Erreur inattendue : {e}")
         elif choix == "Modifier un utilisateur":
-            update_user()
+            run(update_user)
         elif choix == "Lister les utilisateurs":
-            list_users()
+            run(list_users)
         else:
             print("Au revoir!")
             break
@@ -99,13 +114,13 @@ def menu_events():
             ]).ask()
 
         if choix == "Ajouter un événement":
-            add_event()
+            run(add_event)
         elif choix == "Modifier un événement":
-            update_event()
+            run(update_event)
         elif choix == "Afficher événements sans support":
-            list_events_no_support()
+            run(list_events_no_support)
         elif choix == "Afficher événements pour support":
-            list_events_support()
+            run(list_events_support)
         elif choix == "Retour au menu principal":
             break
         elif choix == "Quitter":
@@ -125,9 +140,9 @@ def menu_clients():
             ]).ask()
 
         if choix == "Ajouter un client":
-            add_client()
+            run(add_client)
         elif choix == "Modifier un client":
-            update_client()
+            run(update_client)
         elif choix == "Retour au menu principal":
             break
         elif choix == "Quitter":
@@ -148,11 +163,11 @@ def menu_contracts():
             ]).ask()
 
         if choix == "Ajouter un contrat":
-            add_contract()
+            run(add_contract)
         elif choix == "Modifier un contrat":
-            update_contract()
+            run(update_contract)
         elif choix == "Afficher contrats non signés ou non payés":
-            list_contracts_unsigned_unpaid()
+            run(list_contracts_unsigned_unpaid)
         elif choix == "Retour au menu principal":
             break
         elif choix == "Quitter":
@@ -171,6 +186,7 @@ def main():
                 "Événements",
                 "Clients",
                 "Contrats",
+                "Rechercher",
                 "Quitter"
             ]).ask()
 
@@ -184,6 +200,8 @@ def main():
             menu_contracts()
         elif choix == "Admin":
             menu_admin()
+        elif choix == "Rechercher":
+            run(search)
         elif choix == "Retour au menu principal":
             break
         elif choix == "Quitter":
@@ -192,6 +210,16 @@ def main():
 
 
 if __name__ == "__main__":
+    # Options propres au menu (les commandes sont appelées sans arguments)
+    if "--profile-mem" in sys.argv:
+        sys.argv.remove("--profile-mem")
+        enable_memory_profiling(os.getenv("CRM_PROFILE_MEM_JSON"))
+    if "--profile-cpu" in sys.argv:
+        sys.argv.remove("--profile-cpu")
+        enable_cpu_profiling()
+    if "--debug-sessions" in sys.argv:
+        sys.argv.remove("--debug-sessions")
+        enable_session_debug()
     try:
         main()
     except Exception as e:
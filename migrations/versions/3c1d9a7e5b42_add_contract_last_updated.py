@@ -0,0 +1,28 @@
+"""Add last_updated to contracts
+
+Revision ID: 3c1d9a7e5b42
+Revises: 69efaf8ffcb0
+Create Date: 2026-10-19 09:12:41.218734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1d9a7e5b42'
+down_revision: Union[str, Sequence[str], None] = '69efaf8ffcb0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('contracts', sa.Column('last_updated', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('contracts', 'last_updated')
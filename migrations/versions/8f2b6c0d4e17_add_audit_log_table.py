@@ -0,0 +1,44 @@
+"""Add audit_log table
+
+Revision ID: 8f2b6c0d4e17
+Revises: 3c1d9a7e5b42
+Create Date: 2026-10-19 10:03:27.540112
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f2b6c0d4e17'
+down_revision: Union[str, Sequence[str], None] = '3c1d9a7e5b42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'audit_log',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('actor', sa.String(), nullable=True),
+        sa.Column('action', sa.String(), nullable=False),
+        sa.Column('entity', sa.String(), nullable=True),
+        sa.Column('entity_id', sa.Integer(), nullable=True),
+        sa.Column('details', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_audit_log_created_at', 'audit_log', ['created_at'])
+    op.create_index('ix_audit_log_actor_created_at', 'audit_log', ['actor', 'created_at'])
+    op.create_index('ix_audit_log_entity_created_at', 'audit_log', ['entity', 'entity_id', 'created_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_audit_log_entity_created_at', table_name='audit_log')
+    op.drop_index('ix_audit_log_actor_created_at', table_name='audit_log')
+    op.drop_index('ix_audit_log_created_at', table_name='audit_log')
+    op.drop_table('audit_log')
@@ -0,0 +1,36 @@
+"""Add events.last_updated and last_updated indexes for incremental sync
+
+Revision ID: a2c7e9d4f158
+Revises: f0d5a3b8c271
+Create Date: 2026-10-19 14:21:07.418233
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a2c7e9d4f158'
+down_revision: Union[str, Sequence[str], None] = 'f0d5a3b8c271'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXED_TABLES = ['clients', 'contracts', 'events']
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('events', sa.Column('last_updated', sa.DateTime(), nullable=True))
+    op.add_column('events_archive', sa.Column('last_updated', sa.DateTime(), nullable=True))
+    for table in INDEXED_TABLES:
+        op.create_index(op.f(f'ix_{table}_last_updated'), table, ['last_updated'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in reversed(INDEXED_TABLES):
+        op.drop_index(op.f(f'ix_{table}_last_updated'), table_name=table)
+    op.drop_column('events_archive', 'last_updated')
+    op.drop_column('events', 'last_updated')
@@ -0,0 +1,37 @@
+"""Stamp last_updated with the database server clock
+
+Revision ID: a9d3f6b2e815
+Revises: c8e2a5f7d316
+Create Date: 2026-10-20 09:42:18.305617
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from crm.models import utcnow
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9d3f6b2e815'
+down_revision: Union[str, Sequence[str], None] = 'c8e2a5f7d316'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+STAMPED_TABLES = ['clients', 'contracts', 'events']
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Les insertions hors ORM (imports, restaurations) reçoivent aussi l'heure du serveur
+    for table in STAMPED_TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('last_updated', existing_type=sa.DateTime(), server_default=utcnow())
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in reversed(STAMPED_TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('last_updated', existing_type=sa.DateTime(), server_default=None)
@@ -0,0 +1,58 @@
+"""Add backfill checkpoints and backfill last_updated in batches
+
+Revision ID: b3f8d1e6a049
+Revises: f7a3c2e8d519
+Create Date: 2026-10-19 20:12:47.093215
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from crm.backfill import run_backfill
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3f8d1e6a049'
+down_revision: Union[str, Sequence[str], None] = 'f7a3c2e8d519'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _table(name, *columns):
+    return sa.table(name, sa.column('id', sa.Integer), sa.column('last_updated', sa.DateTime), *columns)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'backfill_checkpoints',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('table_name', sa.String(), nullable=False),
+        sa.Column('last_key', sa.Integer(), nullable=False),
+        sa.Column('rows_done', sa.Integer(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+    # Lignes antérieures à last_updated : un commit par lot, hors de la transaction de migration
+    now = datetime.utcnow()
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        for name in ('clients', 'contracts'):
+            table = _table(name, sa.column('created_at', sa.DateTime))
+            run_backfill(connection, f"{revision}_{name}_last_updated", table,
+                         values={'last_updated': sa.func.coalesce(table.c.created_at, now)},
+                         where=(table.c.last_updated.is_(None),))
+        events = _table('events')
+        run_backfill(connection, f"{revision}_events_last_updated", events,
+                     values={'last_updated': now}, where=(events.c.last_updated.is_(None),))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('backfill_checkpoints')
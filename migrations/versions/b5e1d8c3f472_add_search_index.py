@@ -0,0 +1,47 @@
+"""Create the full-text search index (previously created at runtime)
+
+Revision ID: b5e1d8c3f472
+Revises: e4b7c2a9d058
+Create Date: 2026-10-20 11:02:36.741950
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5e1d8c3f472'
+down_revision: Union[str, Sequence[str], None] = 'e4b7c2a9d058'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # L'ancien index (créé à l'exécution) contenait les champs chiffrés en clair :
+    # il est supprimé, à reconstruire ensuite avec `search --rebuild`
+    op.execute("DROP TABLE IF EXISTS search_index")
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute(
+            "CREATE VIRTUAL TABLE search_index USING fts5("
+            "entity UNINDEXED, entity_id UNINDEXED, body, keys, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(
+        "CREATE TABLE search_index ("
+        "entity VARCHAR(16) NOT NULL, "
+        "entity_id INTEGER NOT NULL, "
+        "body TEXT NOT NULL, "
+        "keys TEXT NOT NULL, "
+        "document TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', body || ' ' || keys)) STORED, "
+        "PRIMARY KEY (entity, entity_id))"
+    )
+    op.execute("CREATE INDEX ix_search_index_document ON search_index USING GIN (document)")
+    op.execute("CREATE INDEX ix_search_index_body_trgm ON search_index USING GIN (body gin_trgm_ops)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TABLE IF EXISTS search_index")
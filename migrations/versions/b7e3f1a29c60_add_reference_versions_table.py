@@ -0,0 +1,33 @@
+"""Add reference_versions table
+
+Revision ID: b7e3f1a29c60
+Revises: 8f2b6c0d4e17
+Create Date: 2026-10-19 10:48:05.903217
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3f1a29c60'
+down_revision: Union[str, Sequence[str], None] = '8f2b6c0d4e17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'reference_versions',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('reference_versions')
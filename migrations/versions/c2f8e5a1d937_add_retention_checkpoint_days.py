@@ -0,0 +1,29 @@
+"""Record the retention period on retention checkpoints
+
+Revision ID: c2f8e5a1d937
+Revises: f3c9a1e7b264
+Create Date: 2026-10-20 12:26:44.180593
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2f8e5a1d937'
+down_revision: Union[str, Sequence[str], None] = 'f3c9a1e7b264'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NULL pour les points de reprise existants : repris sans vérification
+    op.add_column('retention_checkpoints', sa.Column('days', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('retention_checkpoints', 'days')
@@ -0,0 +1,36 @@
+"""Add change_log table for the changes-since feed
+
+Revision ID: c5f1b8e3a694
+Revises: a2c7e9d4f158
+Create Date: 2026-10-19 15:02:39.551806
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5f1b8e3a694'
+down_revision: Union[str, Sequence[str], None] = 'a2c7e9d4f158'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'change_log',
+        sa.Column('seq', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('changed_at', sa.DateTime(), nullable=False),
+        sa.Column('entity', sa.String(), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('operation', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('seq'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('change_log')
@@ -0,0 +1,41 @@
+"""Add blind-index and MinHash columns to clients for duplicate detection
+
+Revision ID: c8e2a5f7d316
+Revises: b3f8d1e6a049
+Create Date: 2026-10-19 21:03:55.612408
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8e2a5f7d316'
+down_revision: Union[str, Sequence[str], None] = 'b3f8d1e6a049'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Colonnes remplies à l'écriture ; l'existant est indexé par lots au premier `dedup`
+    op.add_column('clients', sa.Column('email_bidx', sa.String(length=32), nullable=True))
+    op.add_column('clients', sa.Column('phone_bidx', sa.String(length=32), nullable=True))
+    op.add_column('clients', sa.Column('name_bidx', sa.String(length=32), nullable=True))
+    op.add_column('clients', sa.Column('name_minhash', sa.LargeBinary(), nullable=True))
+    op.create_index(op.f('ix_clients_email_bidx'), 'clients', ['email_bidx'], unique=False)
+    op.create_index(op.f('ix_clients_phone_bidx'), 'clients', ['phone_bidx'], unique=False)
+    op.create_index(op.f('ix_clients_name_bidx'), 'clients', ['name_bidx'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_clients_name_bidx'), table_name='clients')
+    op.drop_index(op.f('ix_clients_phone_bidx'), table_name='clients')
+    op.drop_index(op.f('ix_clients_email_bidx'), table_name='clients')
+    op.drop_column('clients', 'name_minhash')
+    op.drop_column('clients', 'name_bidx')
+    op.drop_column('clients', 'phone_bidx')
+    op.drop_column('clients', 'email_bidx')
@@ -0,0 +1,73 @@
+"""Add retention archive tables
+
+Revision ID: d4a8e2c6b913
+Revises: b7e3f1a29c60
+Create Date: 2026-10-19 11:37:52.614870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a8e2c6b913'
+down_revision: Union[str, Sequence[str], None] = 'b7e3f1a29c60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'contracts_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('unique_id', sa.String(), nullable=True),
+        sa.Column('client_id', sa.Integer(), nullable=True),
+        sa.Column('sales_contact', sa.String(), nullable=True),
+        sa.Column('amount_total', sa.Float(), nullable=True),
+        sa.Column('amount_remaining', sa.Float(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('last_updated', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_contracts_archive_archived_at', 'contracts_archive', ['archived_at'])
+    op.create_table(
+        'events_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('contract_id', sa.Integer(), nullable=True),
+        sa.Column('client_name', sa.String(), nullable=True),
+        sa.Column('client_contact', sa.String(), nullable=True),
+        sa.Column('event_date_start', sa.DateTime(), nullable=True),
+        sa.Column('event_date_end', sa.DateTime(), nullable=True),
+        sa.Column('support_contact', sa.String(), nullable=True),
+        sa.Column('location', sa.String(), nullable=True),
+        sa.Column('attendees', sa.Integer(), nullable=True),
+        sa.Column('notes', sa.String(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_events_archive_archived_at', 'events_archive', ['archived_at'])
+    op.create_table(
+        'retention_checkpoints',
+        sa.Column('policy', sa.String(), nullable=False),
+        sa.Column('cutoff', sa.DateTime(), nullable=False),
+        sa.Column('last_contract_id', sa.Integer(), nullable=False),
+        sa.Column('contracts_archived', sa.Integer(), nullable=False),
+        sa.Column('events_archived', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('policy'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('retention_checkpoints')
+    op.drop_index('ix_events_archive_archived_at', table_name='events_archive')
+    op.drop_table('events_archive')
+    op.drop_index('ix_contracts_archive_archived_at', table_name='contracts_archive')
+    op.drop_table('contracts_archive')
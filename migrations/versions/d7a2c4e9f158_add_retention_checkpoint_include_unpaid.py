@@ -0,0 +1,29 @@
+"""Record the unpaid-contracts rule on retention checkpoints
+
+Revision ID: d7a2c4e9f158
+Revises: c2f8e5a1d937
+Create Date: 2026-10-20 16:02:37.514208
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7a2c4e9f158'
+down_revision: Union[str, Sequence[str], None] = 'c2f8e5a1d937'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NULL pour les points de reprise existants : repris sans vérification
+    op.add_column('retention_checkpoints', sa.Column('include_unpaid', sa.Boolean(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('retention_checkpoints', 'include_unpaid')
@@ -0,0 +1,27 @@
+"""Index change_log by entity and sequence
+
+Revision ID: d9e4a7c1b352
+Revises: c5f1b8e3a694
+Create Date: 2026-10-19 16:48:12.730415
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9e4a7c1b352'
+down_revision: Union[str, Sequence[str], None] = 'c5f1b8e3a694'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_change_log_entity_seq', 'change_log', ['entity', 'seq'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_change_log_entity_seq', table_name='change_log')
@@ -0,0 +1,38 @@
+"""Add reminders_sent table for the event reminder scheduler
+
+Revision ID: e2b6f9a4c7d1
+Revises: d9e4a7c1b352
+Create Date: 2026-10-19 17:20:51.093672
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2b6f9a4c7d1'
+down_revision: Union[str, Sequence[str], None] = 'd9e4a7c1b352'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'reminders_sent',
+        sa.Column('event_id', sa.Integer(), nullable=False),
+        sa.Column('window_name', sa.String(), nullable=False),
+        sa.Column('event_date_start', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=False),
+        sa.Column('recipient', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('event_id', 'window_name', 'event_date_start'),
+    )
+    op.create_index(op.f('ix_reminders_sent_event_date_start'), 'reminders_sent', ['event_date_start'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_reminders_sent_event_date_start'), table_name='reminders_sent')
+    op.drop_table('reminders_sent')
@@ -0,0 +1,67 @@
+"""Add contracts.paid_at for payoff forecasting
+
+Revision ID: e4b7c2a9d058
+Revises: a9d3f6b2e815
+Create Date: 2026-10-20 10:17:53.904126
+
+"""
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b7c2a9d058'
+down_revision: Union[str, Sequence[str], None] = 'a9d3f6b2e815'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+contracts = sa.table('contracts', sa.column('id', sa.Integer), sa.column('amount_remaining', sa.Float),
+                     sa.column('last_updated', sa.DateTime), sa.column('paid_at', sa.DateTime))
+audit_log = sa.table('audit_log', sa.column('id', sa.Integer), sa.column('created_at', sa.DateTime),
+                     sa.column('action', sa.String), sa.column('entity', sa.String),
+                     sa.column('entity_id', sa.Integer), sa.column('details', sa.Text))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('contracts', sa.Column('paid_at', sa.DateTime(), nullable=True))
+    op.add_column('contracts_archive', sa.Column('paid_at', sa.DateTime(), nullable=True))
+
+    # Contrats déjà soldés : dernier passage à 0 du reste dû d'après le journal d'audit,
+    # à défaut last_updated (meilleure estimation disponible)
+    op.execute(contracts.update().where(contracts.c.amount_remaining <= 0).values(paid_at=contracts.c.last_updated))
+    bind = op.get_bind()
+    paid_since = {}
+    history = bind.execute(
+        sa.select(audit_log.c.entity_id, audit_log.c.created_at, audit_log.c.details)
+        .where(audit_log.c.entity == 'contract', audit_log.c.entity_id.isnot(None),
+               audit_log.c.action.in_(['contract.create', 'contract.update']))
+        .order_by(audit_log.c.created_at, audit_log.c.id)
+    )
+    for entity_id, created_at, details in history:
+        try:
+            remaining = json.loads(details or '{}').get('amount_remaining')
+        except ValueError:
+            continue
+        if remaining is None:
+            continue
+        if float(remaining) <= 0:
+            paid_since.setdefault(entity_id, created_at)
+        else:
+            paid_since.pop(entity_id, None)
+    if paid_since:
+        bind.execute(
+            contracts.update()
+            .where(contracts.c.id == sa.bindparam('_id'), contracts.c.amount_remaining <= 0)
+            .values(paid_at=sa.bindparam('_paid_at')),
+            [{'_id': entity_id, '_paid_at': paid_at} for entity_id, paid_at in paid_since.items()],
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('contracts_archive', 'paid_at')
+    op.drop_column('contracts', 'paid_at')
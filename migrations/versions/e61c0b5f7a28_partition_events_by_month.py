@@ -0,0 +1,83 @@
+"""Partition events by month on event_date_start
+
+Revision ID: e61c0b5f7a28
+Revises: d4a8e2c6b913
+Create Date: 2026-10-19 12:21:09.377415
+
+Sous Postgres, la table events devient une table partitionnée par mois
+(RANGE sur event_date_start). Les lignes existantes sont recopiées dans les
+partitions, puis l'ancienne table est supprimée. La clé primaire devient
+(id, event_date_start) : Postgres impose que la clé de partition en fasse partie.
+Les autres bases reçoivent seulement l'index sur event_date_start.
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e61c0b5f7a28'
+down_revision: Union[str, Sequence[str], None] = 'd4a8e2c6b913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+
+def _add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        op.create_index('ix_events_event_date_start', 'events', ['event_date_start'])
+        return
+
+    op.execute("ALTER TABLE events RENAME TO events_unpartitioned")
+    op.execute("ALTER TABLE events_unpartitioned RENAME CONSTRAINT events_pkey TO events_unpartitioned_pkey")
+    op.execute(
+        "CREATE TABLE events (LIKE events_unpartitioned INCLUDING DEFAULTS) "
+        "PARTITION BY RANGE (event_date_start)"
+    )
+    op.execute("ALTER TABLE events ADD PRIMARY KEY (id, event_date_start)")
+    op.execute("ALTER TABLE events ADD FOREIGN KEY (contract_id) REFERENCES contracts (id)")
+    op.execute("ALTER SEQUENCE events_id_seq OWNED BY events.id")
+    op.execute("CREATE INDEX ix_events_event_date_start ON events (event_date_start)")
+    op.execute("CREATE INDEX ix_events_support_contact ON events (support_contact)")
+
+    # Une partition par mois, du plus ancien événement jusqu'à MONTHS_AHEAD mois dans le futur
+    oldest = bind.exec_driver_sql("SELECT min(event_date_start) FROM events_unpartitioned").scalar()
+    today = datetime.utcnow()
+    month = datetime((oldest or today).year, (oldest or today).month, 1)
+    last = _add_months(datetime(today.year, today.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        end = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE events_y{month.year}m{month.month:02d} PARTITION OF events "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        )
+        month = end
+    op.execute("CREATE TABLE events_default PARTITION OF events DEFAULT")
+
+    op.execute("INSERT INTO events SELECT * FROM events_unpartitioned")
+    op.execute("DROP TABLE events_unpartitioned")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        op.drop_index('ix_events_event_date_start', table_name='events')
+        return
+
+    op.execute("ALTER TABLE events RENAME TO events_partitioned")
+    op.execute("CREATE TABLE events (LIKE events_partitioned INCLUDING DEFAULTS)")
+    op.execute("ALTER TABLE events ADD PRIMARY KEY (id)")
+    op.execute("ALTER TABLE events ADD FOREIGN KEY (contract_id) REFERENCES contracts (id)")
+    op.execute("INSERT INTO events SELECT * FROM events_partitioned")
+    op.execute("ALTER SEQUENCE events_id_seq OWNED BY events.id")
+    op.execute("DROP TABLE events_partitioned CASCADE")
@@ -0,0 +1,32 @@
+"""Add version_id columns for optimistic locking
+
+Revision ID: f0d5a3b8c271
+Revises: e61c0b5f7a28
+Create Date: 2026-10-19 13:05:44.120958
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f0d5a3b8c271'
+down_revision: Union[str, Sequence[str], None] = 'e61c0b5f7a28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ['clients', 'contracts', 'events', 'contracts_archive', 'events_archive']
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in TABLES:
+        op.add_column(table, sa.Column('version_id', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in reversed(TABLES):
+        op.drop_column(table, 'version_id')
@@ -0,0 +1,29 @@
+"""Add clients.dedup_keys_version to track stale duplicate-detection keys
+
+Revision ID: f3c9a1e7b264
+Revises: b5e1d8c3f472
+Create Date: 2026-10-20 11:48:09.517382
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3c9a1e7b264'
+down_revision: Union[str, Sequence[str], None] = 'b5e1d8c3f472'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NULL : clés recalculées une fois au prochain `dedup`
+    op.add_column('clients', sa.Column('dedup_keys_version', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('clients', 'dedup_keys_version')
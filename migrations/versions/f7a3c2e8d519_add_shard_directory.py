@@ -0,0 +1,42 @@
+"""Add shard directory and global id sequences
+
+Revision ID: f7a3c2e8d519
+Revises: e2b6f9a4c7d1
+Create Date: 2026-10-19 18:05:26.418870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7a3c2e8d519'
+down_revision: Union[str, Sequence[str], None] = 'e2b6f9a4c7d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'shard_map',
+        sa.Column('client_id', sa.Integer(), nullable=False),
+        sa.Column('shard', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('client_id'),
+    )
+    op.create_index(op.f('ix_shard_map_shard'), 'shard_map', ['shard'], unique=False)
+    op.create_table(
+        'id_sequences',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('next_id', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('id_sequences')
+    op.drop_index(op.f('ix_shard_map_shard'), table_name='shard_map')
+    op.drop_table('shard_map')
@@ -1,6 +1,7 @@
 import pytest
+import click
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select
 from sqlalchemy.orm import sessionmaker
 from crm.cli import generate_next_employee_number, prompt_until_valid
 from crm.models import Base, User, Role, Client, Contract, Event
@@ -234,12 +235,7 @@ def test_list_events_no_support(runner, monkeypatch):
 
 def test_list_users_only_for_gestion(runner, session_mock):
     session = session_mock
-    mock_user = MagicMock()
-    mock_user.id = 1
-    mock_user.name = "Admin"
-    mock_user.email = "admin@test.com"
-    mock_user.role.name = "gestion"
-    session.query.return_value.all.return_value = [mock_user]
+    session.execute.return_value = [(1, "EMP001", "Admin", "admin@test.com", "gestion")]
 
     result = runner.invoke(cli.list_users)
     assert "Admin (admin@test.com)" in result.output
@@ -305,3 +301,957 @@ def test_list_all(runner, monkeypatch):
     session.delete(client)
     session.commit()
     session.close()
+
+
+def _create_event(session, notes="Prévoir projecteur", location="Paris", company="ACME"):
+    client = Client(name="Client Recherche", email=f"client+{uuid.uuid4()}@example.com",
+                    phone="0102030405", company=company, sales_contact="SalesUser")
+    session.add(client)
+    session.commit()
+    contract = Contract(unique_id=str(uuid.uuid4()), client_id=client.id, sales_contact="SalesUser",
+                        amount_total=1000, amount_remaining=0, status="signed")
+    session.add(contract)
+    session.commit()
+    event = Event(contract_id=contract.id, client_name=client.name, event_date_start=datetime.utcnow(),
+                  event_date_end=datetime.utcnow() + timedelta(days=1), location=location, notes=notes)
+    session.add(event)
+    session.commit()
+    return client, contract, event
+
+
+def test_search_index_ranked_and_incremental(db_session):
+    from crm.search import search
+    client, _, event = _create_event(db_session, notes="Prévoir projecteur et wifi", company="Chocolaterie")
+
+    hits = search(db_session, "projec")
+    assert [(h.entity, h.entity_id) for h in hits] == [("event", event.id)]
+    assert search(db_session, "chocolat")[0].entity_id == client.id
+
+    # Mise à jour incrémentale de l'index à l'écriture
+    event.notes = "Traiteur végétarien"
+    db_session.commit()
+    assert search(db_session, "projecteur") == []
+    assert search(db_session, "vegetarien")[0].entity_id == event.id
+
+    db_session.delete(event)
+    db_session.commit()
+    assert search(db_session, "traiteur") == []
+
+    # Champ chiffré : retrouvé par mot entier, sans que son texte soit écrit dans l'index
+    from sqlalchemy import text as sa_text
+    from crm.auth import encrypt_data
+    client.company = encrypt_data("Brasserie Dupont")
+    db_session.commit()
+    assert search(db_session, "dupont")[0].entity_id == client.id
+    assert db_session.execute(sa_text("SELECT count(*) FROM search_index WHERE body LIKE '%Dupont%'")).scalar() == 0
+
+    # Droits : un commercial ne voit que ses clients
+    assert [h.entity_id for h in search(db_session, "dupont", user={"name": "SalesUser", "role": "commercial"})] \
+        == [client.id]
+    assert search(db_session, "dupont", user={"name": "Autre", "role": "commercial"}) == []
+
+
+def test_bulk_update_contracts_scoped_to_role(db_session):
+    from crm.services import bulk_update_contracts
+    _, mine, _ = _create_event(db_session)
+    other = Contract(unique_id=str(uuid.uuid4()), client_id=mine.client_id, sales_contact="Autre",
+                     amount_total=500, amount_remaining=500, status="pending")
+    db_session.add(other)
+    db_session.commit()
+
+    commercial = {"name": "SalesUser", "role": "commercial"}
+    summary = bulk_update_contracts(db_session, commercial, ids=[mine.id, other.id], new_status="cancelled")
+    db_session.commit()
+    assert summary["ids"] == [mine.id]
+    assert summary["by_status"] == {"cancelled": 1}
+
+    gestion = {"name": "Manager", "role": "gestion"}
+    summary = bulk_update_contracts(db_session, gestion, status="pending", new_amount_remaining=0)
+    db_session.commit()
+    assert summary["ids"] == [other.id]
+    db_session.refresh(other)
+    assert other.amount_remaining == 0
+    assert other.last_updated is not None
+    assert other.paid_at is not None
+    other.amount_remaining = 100
+    db_session.commit()
+    assert other.paid_at is None
+
+    support = {"name": "Support", "role": "support"}
+    assert bulk_update_contracts(db_session, support, new_status="new")["count"] == 0
+
+
+def test_audit_writer_batches_and_flushes(tmp_path):
+    from crm.audit import AuditWriter, query_audit_log
+    audit_engine = create_engine(f"sqlite:///{tmp_path / 'audit.db'}")
+    Base.metadata.create_all(bind=audit_engine)
+
+    writer = AuditWriter(audit_engine, batch_size=10, max_queue=5, flush_interval=0.05)
+    for i in range(25):
+        writer.log("Manager", "contract.update", "contract", i, status="signed")
+    writer.log("Alice", "user.create", "user", 99)
+    writer.close()
+
+    session = sessionmaker(bind=audit_engine)()
+    assert len(query_audit_log(session, limit=1000)) == 26
+    alice = query_audit_log(session, actor="Alice")
+    assert [(a.action, a.entity_id) for a in alice] == [("user.create", 99)]
+    assert len(query_audit_log(session, entity="contract", entity_id=3)) == 1
+    session.close()
+
+    # Base indisponible : nouvelles tentatives, puis fichier local rejoué à la première écriture réussie
+    from unittest.mock import patch
+    spool = tmp_path / "audit_spool.jsonl"
+    writer = AuditWriter(audit_engine, flush_interval=0.05, retry_delay=0, spool_path=str(spool))
+    insert_batch = writer._insert
+    with patch.object(writer, "_insert", side_effect=RuntimeError("base indisponible")) as failing:
+        writer.log("Alice", "client.update", "client", 1)
+        writer.flush()
+    assert failing.call_count == writer.retries + 1
+    assert (writer.spooled, len(spool.read_text().splitlines())) == (1, 1)
+    writer._insert = insert_batch
+    writer.log("Alice", "client.update", "client", 2)
+    writer.close()
+    assert (writer.spooled, spool.exists()) == (0, False)
+    session = sessionmaker(bind=audit_engine)()
+    assert len(query_audit_log(session, actor="Alice", entity="client")) == 2
+    session.close()
+
+
+def test_routing_session_reads_from_replica(tmp_path):
+    import click
+    from crm.database import ReplicaRouter, RoutingSession
+    primary = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    for bind, name in ((primary, "primaire"), (replica, "replique")):
+        Base.metadata.create_all(bind=bind)
+        with sessionmaker(bind=bind)() as s:
+            s.add(Role(name=name))
+            s.commit()
+
+    router = ReplicaRouter(primary, [replica], "list-all", read_your_writes=60, state_file=None)
+    Session = sessionmaker(bind=primary, class_=RoutingSession, router=router)
+
+    def role_names(command):
+        with click.Context(click.Command(command)):
+            with Session() as s:
+                return [r.name for r in s.query(Role).all()]
+
+    assert role_names("list-all") == ["replique"]
+    assert role_names("add-role") == ["primaire"]
+
+    # Lecture de ses propres écritures : la réplique est ignorée juste après un commit
+    with click.Context(click.Command("list-all")):
+        with Session() as s:
+            s.add(Role(name="nouveau"))
+            s.commit()
+    assert role_names("list-all") == ["primaire", "nouveau"]
+
+    # Connexion sans requête (écritures hors ORM) et session ayant écrit : base principale
+    router.last_write = 0.0
+    with click.Context(click.Command("list-all")):
+        with Session() as s:
+            assert s.connection().engine is primary
+        with Session() as s:
+            assert [r.name for r in s.query(Role).all()] == ["replique"]
+            s.add(Role(name="épinglé"))
+            s.flush()
+            assert "épinglé" in [r.name for r in s.query(Role).all()]
+            s.rollback()
+            assert [r.name for r in s.query(Role).all()] == ["primaire", "nouveau"]
+
+    # Réplique injoignable : repli sur la base principale
+    router = ReplicaRouter(primary, [create_engine(f"sqlite:///{tmp_path / 'absent' / 'x.db'}")],
+                           "list-all", read_your_writes=0, state_file=None)
+    Session = sessionmaker(bind=primary, class_=RoutingSession, router=router)
+    assert role_names("list-all") == ["primaire", "nouveau"]
+
+
+def test_reference_cache_revalidates_on_version_bump(db_session):
+    from sqlalchemy import event as sa_event, update as sa_update
+    from crm.cache import ReferenceCache
+    from crm.models import ReferenceVersion
+    cache = ReferenceCache(session_factory=TestingSessionLocal, revalidate_seconds=0)
+    assert cache.role(db_session, "test").name == "test"
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    sa_event.listen(engine, "before_cursor_execute", record)
+    try:
+        # Versions inchangées : une seule lecture de la table des versions
+        assert cache.role(db_session, "test").name == "test"
+        assert len(statements) == 1 and "reference_versions" in statements[0]
+    finally:
+        sa_event.remove(engine, "before_cursor_execute", record)
+
+    # Une écriture sur Role incrémente la version : le cache se recharge
+    get_or_create_role(db_session, "support")
+    user = User(name="Support Guy", email="support@example.com", employee_number="EMP900",
+                role=db_session.query(Role).filter_by(name="support").one(), hashed_password="x")
+    db_session.add(user)
+    db_session.commit()
+    assert [u.name for u in cache.users_with_role("support")] == ["Support Guy"]
+
+    # Écriture faite par un autre processus : seul le numéro de version change
+    cache.revalidate_seconds = 3600
+    db_session.execute(sa_update(ReferenceVersion).values(version=ReferenceVersion.version + 1))
+    db_session.query(User).filter_by(id=user.id).update({"name": "Renommé"}, synchronize_session=False)
+    db_session.commit()
+    assert [u.name for u in cache.users_with_role("support")] == ["Support Guy"]
+    cache.invalidate()
+    assert [u.name for u in cache.users_with_role("support")] == ["Renommé"]
+
+
+def test_client_update_propagates_to_events(db_session):
+    from sqlalchemy import update as sa_update
+    from crm.propagation import resync_all_events
+    from crm.search import search
+    client, _, event = _create_event(db_session)
+
+    client.name = "Nouveau Nom"
+    client.phone = "0600000000"
+    db_session.commit()
+    db_session.refresh(event)
+    assert event.client_name == "Nouveau Nom"
+    assert event.client_contact == f"0600000000 | {client.email}"
+    assert search(db_session, "nouveau")[0].entity_id == event.id
+
+    # Copie désynchronisée hors ORM : la commande de réparation la corrige
+    db_session.execute(sa_update(Event).values(client_name="Obsolète"))
+    db_session.commit()
+    assert resync_all_events(db_session, chunk_size=1) == 1
+    db_session.refresh(event)
+    assert event.client_name == "Nouveau Nom"
+
+
+def test_retention_archives_in_resumable_batches(db_session):
+    from sqlalchemy import func, select as sa_select
+    from crm.models import contracts_archive, events_archive
+    from crm.retention import run_retention
+    old = datetime.utcnow() - timedelta(days=1000)
+    contracts = []
+    for remaining in (0, 0, 0, 100):
+        _, contract, event = _create_event(db_session)
+        contract.created_at = old
+        contract.amount_remaining = remaining
+        event.event_date_end = old
+        contracts.append(contract)
+    db_session.commit()
+    unpaid_id = contracts[-1].id
+
+    checkpoint = run_retention(db_session, days=365, batch_size=2, sleep_seconds=0, max_batches=1)
+    assert checkpoint.finished_at is None
+    assert checkpoint.contracts_archived == 2
+
+    # Reprise avec une autre ancienneté ou règle d'impayés : refusée, sauf réinitialisation explicite
+    from crm.retention import RetentionSettingsChanged
+    with pytest.raises(RetentionSettingsChanged, match="365 jour"):
+        run_retention(db_session, days=30, batch_size=2, sleep_seconds=0)
+    with pytest.raises(RetentionSettingsChanged, match="impayés compris"):
+        run_retention(db_session, days=365, batch_size=2, sleep_seconds=0, include_unpaid=True)
+    states = []
+    checkpoint = run_retention(db_session, days=30, batch_size=2, sleep_seconds=0, max_batches=0, restart=True,
+                               on_start=lambda state, c: states.append(state))
+    assert (states, checkpoint.days, checkpoint.last_contract_id) == (["restarted"], 30, 0)
+
+    # Reprise après interruption (même ancienneté)
+    checkpoint = run_retention(db_session, days=30, batch_size=2, sleep_seconds=0,
+                               on_start=lambda state, c: states.append(state))
+    assert states[-1] == "resumed"
+    assert checkpoint.finished_at is not None
+    # Compteurs remis à zéro par --restart : seul le lot restant est compté
+    assert (checkpoint.contracts_archived, checkpoint.events_archived) == (1, 1)
+
+    assert [c.id for c in db_session.query(Contract).all()] == [unpaid_id]
+    assert db_session.query(Event).count() == 1
+    assert db_session.execute(sa_select(func.count()).select_from(contracts_archive)).scalar() == 3
+    assert db_session.execute(sa_select(func.count()).select_from(events_archive)).scalar() == 3
+
+
+def test_partition_helpers_and_date_range(db_session):
+    from crm.partitioning import add_months, partition_name, date_range_criteria
+    assert add_months(datetime(2026, 11, 15), 2) == datetime(2027, 1, 1)
+    assert partition_name("events", datetime(2027, 1, 1)) == "events_y2027m01"
+
+    _, _, event = _create_event(db_session)
+    now = datetime.utcnow()
+    in_range = db_session.query(Event).filter(
+        *date_range_criteria(Event.event_date_start, now - timedelta(days=1), now + timedelta(days=1))).all()
+    assert in_range == [event]
+    before = date_range_criteria(Event.event_date_start, end=now - timedelta(days=1))
+    assert db_session.query(Event).filter(*before).all() == []
+
+    # Les partitions sont créées à l'avance, avec un délai de verrou, et les erreurs remontent
+    from crm.partitioning import ensure_partitions
+    connection = MagicMock()
+    connection.dialect.name = "postgresql"
+    connection.exec_driver_sql.side_effect = RuntimeError("lock timeout")
+    bind = MagicMock()
+    bind.begin.return_value.__enter__.return_value = connection
+    with pytest.raises(RuntimeError):
+        ensure_partitions(bind, months_ahead=1)
+    assert "lock_timeout" in str(connection.execute.call_args_list[-1].args[0])
+
+    # Un mois déjà présent dans la partition par défaut est ignoré, les suivants sont créés
+    from sqlalchemy.exc import DBAPIError
+    conflict = DBAPIError("CREATE TABLE", {}, MagicMock(pgcode="23514"))
+    connection.exec_driver_sql.side_effect = [conflict, None]
+    last_month = add_months(datetime.utcnow(), -1)
+    names, skipped = ensure_partitions(bind, start=last_month, months_ahead=0)
+    assert (skipped, names) == ([partition_name("events", last_month)], [partition_name("events", datetime.utcnow())])
+    assert connection.begin_nested.call_count == connection.exec_driver_sql.call_count
+
+
+def test_local_replica_incremental_sync(db_session, tmp_path):
+    from crm import local_replica
+    from crm.projections import client_rows, event_rows
+    path = str(tmp_path / "local.sqlite")
+    client, _, event = _create_event(db_session)
+    other_client, _, _ = _create_event(db_session)
+    other_client.sales_contact = "Autre"
+    db_session.query(Contract).filter(Contract.client_id == other_client.id).update({"sales_contact": "Autre"})
+    db_session.commit()
+
+    commercial = {"name": "SalesUser", "role": "commercial"}
+    transferred = local_replica.sync(db_session, commercial, path=path)
+    assert (transferred["clients"], transferred["contracts"], transferred["events"]) == (1, 1, 1)
+
+    # Incrémental : les lignes modifiées sont reprises, les lignes supprimées retirées
+    client.name = "Nom Modifié"
+    db_session.commit()
+    db_session.delete(event)
+    db_session.commit()
+    local_replica.sync(db_session, commercial, path=path)
+
+    local = local_replica.local_session(path)
+    assert [c.name for c in client_rows(local)] == ["Nom Modifié"]
+    assert list(event_rows(local)) == []
+    assert {u.hashed_password for u in local.query(User)} <= {""}
+    assert local.query(Client).one().email_bidx is None
+
+    # Validation tardive : horodatée avant le repère, reprise grâce à la fenêtre de recouvrement
+    watermark = local.execute(select(local_replica.sync_state.c.watermark)
+                              .where(local_replica.sync_state.c.table_name == "clients")).scalar()
+    db_session.execute(Client.__table__.update().where(Client.id == client.id)
+                       .values(company="Validée en retard", last_updated=watermark - timedelta(seconds=60)))
+    db_session.commit()
+    local_replica.sync(db_session, commercial, path=path)
+    local.expire_all()
+    assert local.query(Client).one().company == "Validée en retard"
+    local.close()
+
+
+def test_changes_since_streams_deltas_in_order(db_session):
+    from crm.changefeed import changes_since
+    client, contract, event = _create_event(db_session)
+    changes = list(changes_since(db_session))
+    assert [(c["entity"], c["op"]) for c in changes] == [("client", "insert"), ("contract", "insert"),
+                                                         ("event", "insert")]
+    cursor = changes[-1]["seq"]
+
+    # La propagation (UPDATE hors ORM) apparaît aussi dans le flux
+    client.name = "Renommé"
+    db_session.commit()
+    db_session.delete(event)
+    db_session.commit()
+    changes = list(changes_since(db_session, cursor))
+    assert [(c["entity"], c["id"], c["op"]) for c in changes] == [
+        ("client", client.id, "update"), ("event", event.id, "update"), ("event", event.id, "delete")]
+    assert changes[0]["data"]["name"] == "Renommé"
+    assert changes[-1]["data"] is None
+    assert [c["id"] for c in changes_since(db_session, cursor, entities=["client"])] == [client.id]
+
+    # PostgreSQL : le numéro de séquence est attribué sous verrou, jusqu'au commit
+    from unittest.mock import MagicMock
+    from crm.changefeed import record_changes
+    connection = MagicMock()
+    connection.dialect.name = "postgresql"
+    record_changes(connection, "client", [client.id], "update")
+    lock, insert_rows = (c.args[0] for c in connection.execute.call_args_list)
+    assert "pg_advisory_xact_lock" in str(lock)
+    assert insert_rows.table.name == "change_log"
+
+
+def test_report_vectorized_aggregates(db_session):
+    from crm.reporting import load_contract_arrays, build_report
+    now = datetime(2026, 10, 1)
+    for owner, total, remaining, days in (("Alice", 1000, 0, 10), ("Alice", 500, 500, 45), ("Bob", 200, 50, 400)):
+        db_session.add(Contract(unique_id=str(uuid.uuid4()), client_id=1, sales_contact=owner, status="signed",
+                                amount_total=total, amount_remaining=remaining,
+                                created_at=now - timedelta(days=days)))
+    db_session.commit()
+
+    result = build_report(load_contract_arrays(db_session), dimensions=("commercial",), now=now)
+    assert (result["contracts"], result["amount_total"], result["amount_remaining"]) == (3, 1700.0, 550.0)
+    assert [(g["commercial"], g["amount_total"], g["collection_ratio"]) for g in result["groups"]] == [
+        ("Alice", 1500.0, 0.6667), ("Bob", 200.0, 0.75)]
+    aging = {b["bucket"]: b["amount_remaining"] for b in result["aging"]}
+    assert (aging["31-60 j"], aging["> 365 j"], aging["0-30 j"]) == (500.0, 50.0, 0.0)
+    assert result["percentiles"]["amount_total"]["p50"] == 500.0
+
+    by_month = build_report(load_contract_arrays(db_session, Contract.sales_contact == "Alice"),
+                            dimensions=("month", "status"), now=now)["groups"]
+    assert [(g["month"], g["status"], g["count"]) for g in by_month] == [
+        ("2026-08", "signed", 1), ("2026-09", "signed", 1)]
+
+
+def test_forecast_uses_payoff_curves_and_cache(db_session, tmp_path):
+    from crm.forecasting import forecast, cached_forecast
+    now = datetime(2026, 10, 1)
+    # Historique : soldés en 10 et 40 jours ; un contrat ouvert âgé de 5 jours
+    for days, paid_after in ((100, 10), (100, 40), (5, None)):
+        created = now - timedelta(days=days)
+        db_session.add(Contract(unique_id=str(uuid.uuid4()), client_id=1, sales_contact="Alice", status="signed",
+                                amount_total=1000, amount_remaining=0 if paid_after else 1000, created_at=created,
+                                paid_at=created + timedelta(days=paid_after) if paid_after else None))
+    db_session.commit()
+    # Une modification ultérieure d'un contrat soldé ne déplace pas sa date de solde
+    paid = db_session.query(Contract).filter(Contract.amount_remaining == 0).first()
+    paid_at = paid.paid_at
+    paid.status = "archived-later"
+    db_session.commit()
+    assert paid.paid_at == paid_at
+    paid.status = "signed"
+    db_session.commit()
+
+    result = forecast(db_session, months=2, now=now)
+    assert result["history"] == 2
+    assert [p["month"] for p in result["periods"]] == ["2026-10", "2026-11"]
+    # Moitié de l'historique soldée avant 36 jours (fin octobre), l'autre en novembre
+    assert [p["expected"] for p in result["periods"]] == [500.0, 500.0]
+    assert result["by_commercial"][0]["curve"] == "global"
+
+    path = str(tmp_path / "forecast.json")
+    assert cached_forecast(db_session, months=2, path=path)[1] is False
+    assert cached_forecast(db_session, months=2, path=path)[1] is True
+    db_session.query(Contract).filter(Contract.amount_remaining > 0).first().amount_remaining = 500
+    db_session.commit()
+    assert cached_forecast(db_session, months=2, path=path)[1] is False
+
+
+def test_reminders_sent_once_per_window(db_session, tmp_path):
+    from crm.reminders import FileNotifier, parse_windows, run_tick
+    now = datetime(2026, 10, 1, 9, 0)
+    windows = parse_windows("7d,1d")
+    _, _, soon = _create_event(db_session)
+    _, _, later = _create_event(db_session)
+    _, _, far = _create_event(db_session)
+    soon.event_date_start = now + timedelta(hours=5)
+    later.event_date_start = now + timedelta(days=3)
+    far.event_date_start = now + timedelta(days=30)
+    db_session.commit()
+
+    notifier = FileNotifier(str(tmp_path / "reminders.jsonl"))
+    sent = run_tick(db_session, notifier, windows, now=now)
+    assert sorted((r.event_id, r.window) for r in sent) == [(soon.id, "1d"), (later.id, "7d")]
+    assert run_tick(db_session, notifier, windows, now=now + timedelta(minutes=1)) == []
+
+    # Deux jours plus tard, `later` entre dans la fenêtre d'un jour
+    sent = run_tick(db_session, notifier, windows, now=now + timedelta(days=2, hours=1))
+    assert [(r.event_id, r.window) for r in sent] == [(later.id, "1d")]
+    with open(notifier.path) as f:
+        assert len(f.readlines()) == 3
+
+    # Un autre planificateur a enregistré le rappel entre la lecture et l'écriture : pas de doublon
+    from unittest.mock import patch
+    from crm import reminders
+    due = reminders.due_reminders(db_session, windows, now + timedelta(days=29, hours=1))
+    assert [(r.event_id, r.window) for r in due] == [(far.id, "1d")]
+    db_session.add(reminders.ReminderSent(event_id=far.id, window_name="1d", event_date_start=far.event_date_start,
+                                          sent_at=now))
+    db_session.commit()
+    with patch.object(reminders, "due_reminders", return_value=due):
+        assert run_tick(db_session, notifier, windows, now=now + timedelta(days=29, hours=1)) == []
+    with open(notifier.path) as f:
+        assert len(f.readlines()) == 3
+
+
+def test_sharded_session_routing_and_rebalance(tmp_path):
+    from sqlalchemy import func, select as sa_select
+    from crm import sharding
+    directory = create_engine(f"sqlite:///{tmp_path / 'directory.db'}")
+    router = sharding.ShardRouter(directory, {name: f"sqlite:///{tmp_path / name}.db" for name in ("a", "b")})
+    router.create_all()
+    Session = sharding.sharded_sessionmaker(router)
+    owners = {}
+    for i in range(50):
+        owners.setdefault(router.shard_for_owner(f"Commercial {i}"), f"Commercial {i}")
+
+    session = Session()
+    clients = {shard: Client(name=f"Client {shard}", email=f"{shard}@example.com", sales_contact=owner)
+               for shard, owner in owners.items()}
+    session.add_all(clients.values())
+    session.commit()
+    client_ids = {shard: c.id for shard, c in clients.items()}
+    contract = Contract(unique_id=str(uuid.uuid4()), client_id=client_ids["a"], sales_contact=owners["a"],
+                        amount_total=100, amount_remaining=0, status="signed")
+    session.add(contract)
+    session.commit()
+    session.add(Event(contract_id=contract.id, client_name="Client a", event_date_start=datetime.utcnow(),
+                      event_date_end=datetime.utcnow()))
+    session.commit()
+    session.close()
+
+    def count(shard, model):
+        with router.engines[shard].connect() as connection:
+            return connection.execute(sa_select(func.count()).select_from(model.__table__)).scalar()
+
+    # Écritures sur le shard du client, lectures globales par scatter-gather
+    assert [count("a", m) for m in (Client, Contract, Event)] == [1, 1, 1]
+    assert [count("b", m) for m in (Client, Contract, Event)] == [1, 0, 0]
+    session = Session()
+    assert sorted(c.name for c in session.query(Client)) == ["Client a", "Client b"]
+    client = session.get(Client, client_ids["a"])
+    client.name = "Renommé"
+    session.commit()
+    assert session.query(Event).one().client_name == "Renommé"
+
+    # Flux de modifications : une seule séquence, sur l'annuaire, pour tous les shards
+    from crm.changefeed import changes_since
+    from crm.forecasting import contracts_sequence
+    from crm.models import ChangeLog
+    changes = list(changes_since(session))
+    assert [(c["entity"], c["op"]) for c in changes] == [
+        ("client", "insert"), ("client", "insert"), ("contract", "insert"), ("event", "insert"),
+        ("client", "update"), ("event", "update")]
+    assert changes[-1]["data"]["client_name"] == "Renommé"
+    assert contracts_sequence(session) == changes[2]["seq"]
+    assert [count(shard, ChangeLog) for shard in ("a", "b")] == [0, 0]
+    session.close()
+
+    # Un autre processus garde l'emplacement en cache jusqu'au changement de version de l'annuaire
+    other = sharding.ShardRouter(directory, {name: f"sqlite:///{tmp_path / name}.db" for name in ("a", "b")},
+                                 revalidate_seconds=0)
+    assert other.client_shard(client_ids["a"]) == "a"
+    assert sharding.move_client(router, client_ids["a"], "b") == 3
+    assert other.client_shard(client_ids["a"]) == "b"
+    assert [count("a", m) for m in (Client, Contract, Event)] == [0, 0, 0]
+    assert sharding.shard_counts(router) == {"a": 0, "b": 2}
+    session = Session()
+    assert session.get(Client, client_ids["a"]).contracts[0].events[0].client_name == "Renommé"
+    session.close()
+
+    assert len(sharding.rebalance(router)) == 1
+    assert sharding.shard_counts(router) == {"a": 1, "b": 1}
+
+    # Écriture concurrente sur la source pendant la copie : déplacement refusé, rien n'est perdu
+    source = router.client_shard(client_ids["a"])
+    target = next(name for name in router.names if name != source)
+
+    def concurrent_write(connection, event_ids):
+        with router.engines[source].begin() as source_connection:
+            source_connection.execute(Client.__table__.update().values(company="Écrit pendant le déplacement"))
+
+    with patch.object(sharding, "reindex_events", side_effect=concurrent_write):
+        with pytest.raises(sharding.ClientMoved):
+            sharding.move_client(router, client_ids["a"], target)
+    assert router.client_shard(client_ids["a"]) == source
+    assert sharding.move_client(router, client_ids["a"], target) == 3
+    session = Session()
+    assert session.get(Client, client_ids["a"]).company == "Écrit pendant le déplacement"
+    session.close()
+    assert sharding.move_client(router, client_ids["a"], source) == 3
+
+    # Les écritures hors ORM parcourent tous les shards ; une connexion sans shard est refusée
+    from crm.propagation import resync_all_events
+    from crm.retention import run_retention
+    from crm.search import rebuild_search_index, search
+    session = Session()
+    with pytest.raises((ValueError, AssertionError)):
+        session.connection()
+    other_client = next(c for c in session.query(Client) if c.id != client_ids["a"])
+    session.add(Contract(unique_id=str(uuid.uuid4()), client_id=other_client.id,
+                         sales_contact=other_client.sales_contact, amount_total=10, amount_remaining=0))
+    session.commit()
+    assert rebuild_search_index(session) == 3
+    session.commit()
+    assert [hit.entity for hit in search(session, "Renommé")] == ["event"]
+    assert resync_all_events(session) == 0
+    for engine_ in router.engines.values():
+        with engine_.begin() as connection:
+            connection.execute(Contract.__table__.update().values(created_at=datetime.utcnow() - timedelta(days=1)))
+    checkpoint = run_retention(session, days=0, sleep_seconds=0)
+    assert (checkpoint.contracts_archived, checkpoint.events_archived) == (2, 1)
+    assert [count(shard, Contract) for shard in ("a", "b")] == [0, 0]
+
+    # Fusion de doublons : sur le shard du client conservé, refusée entre deux shards
+    from crm.dedup import merge_clients
+    twin = Client(name="Jumeau", email="twin@example.com", sales_contact=other_client.sales_contact)
+    session.add(twin)
+    session.commit()
+    with pytest.raises(ValueError, match="autre shard"):
+        merge_clients(session, client_ids["a"], [other_client.id])
+    assert merge_clients(session, other_client.id, [twin.id])["removed"] == [twin.id]
+    session.commit()
+    assert count("a", Client) + count("b", Client) == 2
+
+    # Doublons exacts sur deux shards différents : comptés sur l'ensemble des shards
+    from crm.dedup import exact_groups
+    other_shard = next(name for name in router.names if name != router.client_shard(client_ids["a"]))
+    copy = Client(name="Copie", email="a@example.com", sales_contact=owners[other_shard])
+    session.add(copy)
+    session.commit()
+    assert router.client_shard(copy.id) == other_shard
+    assert ("email", sorted([client_ids["a"], copy.id])) in list(exact_groups(session))
+    session.close()
+
+
+def test_profile_mem_reports_peak_sites_and_open_sessions(tmp_path):
+    import json
+    from crm import profiling
+    path = tmp_path / "mem.jsonl"
+    profiler = profiling.MemoryProfiler(json_path=str(path), echo=False)
+    leaked = []
+
+    def leaky():
+        session = TestingSessionLocal()
+        session.begin()
+        leaked.append(session)
+        return [bytearray(1024) for _ in range(200)]
+
+    try:
+        kept = profiler.run("leaky", leaky)
+        profiler.run("leaky", leaky)
+    finally:
+        for session in leaked:
+            session.close()
+        profiling.disable_memory_profiling()
+
+    first, second = [json.loads(line) for line in path.read_text().splitlines()]
+    assert first["command"] == "leaky" and first["peak_over_baseline_kib"] >= 200
+    assert first["top"] and first["growth_since_previous"] == []
+    assert second["growth_since_previous"] and second["open_sessions"] >= 2
+    assert len(kept) == 200
+
+
+def test_menu_runs_several_commands_and_compares_memory(tmp_path):
+    import json
+    import main
+    from crm import profiling
+    path = tmp_path / "mem.jsonl"
+    profiling.enable_memory_profiling(str(path), echo=False)
+    choices = iter(["Qui est connecté ?", "Qui est connecté ?", "Retour au menu principal"])
+    try:
+        with patch.object(main.questionary, "select") as select:
+            select.return_value.ask.side_effect = lambda: next(choices)
+            main.menu_admin()
+    finally:
+        profiling.disable_memory_profiling()
+    reports = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [r["command"] for r in reports] == ["whoami", "whoami"]
+    assert "growth_since_previous" in reports[1]
+
+
+def test_profile_cpu_collapsed_stacks_and_categories(tmp_path):
+    from argon2 import PasswordHasher
+    from crm.auth import encrypt_data
+    from crm.profiling import CpuProfiler
+
+    def work():
+        for _ in range(3):
+            PasswordHasher().hash("secret")
+        for _ in range(2000):
+            encrypt_data("client@example.com")
+
+    profiler = CpuProfiler(output_dir=str(tmp_path), interval=0.001, echo=False)
+    profiler.run("work", work)
+    report = profiler.reports[0]
+    assert report["samples"] > 0 and report["top_self"]
+    assert {"argon2", "fernet"} <= set(report["categories"])
+    with open(report["collapsed"]) as f:
+        line = f.readline()
+    assert ";" in line and line.rstrip().rsplit(" ", 1)[1].isdigit()
+
+
+def test_slow_query_log_redacts_and_summarizes(tmp_path):
+    from sqlalchemy import text
+    from crm.auth import encrypt_data
+    from crm.slowlog import SlowQueryRecorder, read_entries, summarize
+    path = str(tmp_path / "slow.log")
+    db = create_engine("sqlite://")
+    recorder = SlowQueryRecorder(threshold_ms=0, path=path).install(db)
+    secret = encrypt_data("0601020304")
+    try:
+        with db.connect() as connection:
+            for value in (1, 2, 3):
+                connection.execute(text("SELECT :a + 1 WHERE :b IS NOT NULL"), {"a": value, "b": secret})
+            connection.execute(text("SELECT 1 WHERE 2 IN (1, 2, 3)"))
+    finally:
+        recorder.uninstall()
+
+    entries = list(read_entries(path))
+    assert len(entries) == 4
+    assert entries[0]["parameters"] == [1, "<chiffré>"]
+    assert secret not in open(path).read()
+    summary = summarize(entries)
+    assert [s["count"] for s in summary] in ([3, 1], [1, 3])
+    assert {s["normalized"] for s in summary} == {"SELECT ? + ? WHERE ? IS NOT NULL", "SELECT ? WHERE ? IN (...)"}
+
+    # EXPLAIN ANALYZE exécute la requête : seules les lectures pures sont rejouées
+    from crm.slowlog import explainable
+    assert explainable("  with recent as (select 1) select * from recent")
+    assert explainable("SELECT last_updated FROM clients")
+    assert not explainable("SELECT pg_advisory_xact_lock(42)")
+    assert not explainable("SELECT id FROM contracts WHERE id = 1 FOR UPDATE")
+    assert not explainable("SELECT nextval('change_log_seq_seq')")
+    assert not explainable("WITH moved AS (DELETE FROM events RETURNING *) SELECT count(*) FROM moved")
+    assert not explainable("UPDATE clients SET name = 'x'")
+
+
+def test_backfill_resumes_from_checkpoint(tmp_path):
+    from sqlalchemy import insert, select
+    from crm.backfill import checkpoints, run_backfill
+    db = create_engine(f"sqlite:///{tmp_path / 'backfill.db'}")
+    Base.metadata.create_all(db)
+    clients = Client.__table__
+    with db.begin() as connection:
+        connection.execute(insert(clients), [
+            {"id": i, "name": f"C{i}", "created_at": datetime(2024, 1, i), "last_updated": None} for i in range(1, 8)
+        ])
+    values = {"last_updated": clients.c.created_at}
+    where = (clients.c.last_updated.is_(None),)
+
+    # Interruption après deux lots : l'avancement est conservé
+    assert run_backfill(db, "test", clients, values=values, where=where, batch_size=3,
+                        rows_per_second=0, max_batches=2) == 6
+    with db.connect() as connection:
+        assert connection.execute(select(checkpoints.c.last_key)).scalar() == 6
+        assert connection.execute(select(clients.c.id).where(*where)).scalars().all() == [7]
+
+    with db.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        assert run_backfill(connection, "test", clients, values=values, where=where, batch_size=3,
+                            rows_per_second=0) == 7
+    with db.connect() as connection:
+        assert connection.execute(select(checkpoints.c.finished_at)).scalar() is not None
+        assert connection.execute(select(clients.c.last_updated).where(clients.c.id == 7)).scalar() == \
+            datetime(2024, 1, 7)
+    # Reprise déjà terminée : rien n'est rejoué
+    assert run_backfill(db, "test", clients, values={"name": "X"}, rows_per_second=0) == 7
+
+
+def test_load_test_mix_and_summary():
+    from collections import Counter
+    from benchmarks.load_test import parse_mix, summarize
+    assert parse_mix("add-client=2, list-all") == {"add-client": 2.0, "list-all": 1.0}
+    with pytest.raises(click.BadParameter):
+        parse_mix("drop-table=1")
+
+    def stats(latencies, errors):
+        return {"update-contract": {"latencies": latencies, "write_ms": [1.0] * len(latencies),
+                                    "errors": Counter(errors), "skipped": 0}}
+    summary = summarize([stats([10.0, 20.0], {}), stats([30.0], {"conflit_version": 1})], wall_seconds=2)
+    op = summary["operations"]["update-contract"]
+    assert op["ok"] == 3 and op["errors"] == {"conflit_version": 1}
+    assert op["error_rate"] == 0.25 and op["throughput_per_s"] == 1.5
+    assert op["latency_ms"]["p50"] == 20.0
+    assert summary["throughput_per_s"] == 1.5
+
+
+def test_dedup_blind_indexes_lsh_and_merge(db_session):
+    from sqlalchemy import delete, insert, select, update
+    from crm.auth import encrypt_data
+    from crm.dedup import find_clusters, index_missing, merge_clients
+    from crm.models import ChangeLog
+    jean = Client(name=encrypt_data("Jean Dupont"), email=encrypt_data("jean@acme.fr"),
+                  phone=encrypt_data("0601020304"), company="Acme")
+    typo = Client(name=encrypt_data("Dupond Jean"), email=encrypt_data("Jean+crm@ACME.fr"),
+                  phone=encrypt_data("+33 6 01 02 03 04"), company="ACME SARL")
+    other = Client(name=encrypt_data("Marie Curie"), email=encrypt_data("marie@radium.fr"),
+                   phone=encrypt_data("0700000000"), company="Radium")
+    db_session.add_all([jean, typo, other])
+    db_session.commit()
+    assert jean.email_bidx == typo.email_bidx and jean.phone_bidx == typo.phone_bidx
+    assert encrypt_data("jean@acme.fr") not in (jean.email_bidx, jean.name_minhash)
+
+    # Client inséré hors ORM : indexé par lots avant la recherche
+    db_session.execute(insert(Client).values(id=10, name=encrypt_data("jean dupont"), company="ACME"))
+    db_session.commit()
+    assert index_missing(engine) == 1
+    # Nom fait de mots ignorés : clés vides mais à jour, le client n'est pas repris à chaque passage
+    db_session.execute(insert(Client).values(id=11, name=encrypt_data("SARL"), company="SA"))
+    db_session.commit()
+    assert index_missing(engine) == 1
+    assert index_missing(engine) == 0
+    # UPDATE hors ORM des champs sources : clés périmées, recalculées au passage suivant ;
+    # une modification ORM qui ne touche pas les sources garde la version
+    db_session.execute(update(Client).where(Client.id == 11).values(name=encrypt_data("Jean Dupont")))
+    other.sales_contact = "Marie"
+    db_session.commit()
+    assert index_missing(engine) == 1
+    db_session.execute(delete(Client).where(Client.id == 11))
+    db_session.commit()
+
+    clusters, stats = find_clusters(db_session)
+    assert stats["clients"] == 4
+    assert [c["ids"] for c in clusters] == [[jean.id, typo.id, 10]]
+    assert {"email", "phone", "name", "similar"} <= set(clusters[0]["reasons"])
+
+    contract = Contract(unique_id=str(uuid.uuid4()), client_id=typo.id, amount_total=100, amount_remaining=0)
+    db_session.add(contract)
+    db_session.commit()
+    result = merge_clients(db_session, jean.id, [typo.id, 10])
+    db_session.commit()
+    assert result["contracts"] == [contract.id]
+    db_session.refresh(contract)
+    assert contract.client_id == jean.id
+    assert db_session.query(Client).count() == 2
+    deleted = db_session.execute(select(ChangeLog.entity_id).where(ChangeLog.operation == "delete")).scalars()
+    assert sorted(deleted) == [typo.id, 10]
+
+
+def test_run_batch_savepoints_refs_and_roles(db_session):
+    import json as jsonlib
+    from crm.batch import read_operations, run_batch
+    commercial = {"name": "Alice", "role": "commercial"}
+    lines = [
+        jsonlib.dumps({"op": "create_client", "ref": "c", "name": "Jean", "email": "jean@acme.fr",
+                       "phone": "0601020304", "company": "Acme"}),
+        jsonlib.dumps({"op": "create_client", "name": "Bob", "email": "pas-un-email", "phone": "1",
+                       "company": "X"}),
+        "# commentaire",
+        jsonlib.dumps({"op": "update_client", "id": "$c", "company": "Acme SA"}),
+        jsonlib.dumps({"op": "create_contract", "client_id": "$c", "amount_total": 10,
+                       "amount_remaining": 0, "status": "signed"}),
+        "{pas du json",
+        "[1, 2]",
+        '"x"',
+    ]
+    results = list(run_batch(db_session, commercial, read_operations(lines), batch_size=2))
+    assert [(r["line"], r["status"]) for r in results] == [
+        (1, "ok"), (2, "error"), (4, "ok"), (5, "error"), (6, "error"), (7, "error"), (8, "error")]
+    assert "Objet JSON attendu" in results[5]["error"]
+    assert "Email invalide" in results[1]["error"]
+    assert "Accès refusé" in results[3]["error"]
+    clients = db_session.query(Client).all()
+    assert len(clients) == 1 and clients[0].id == results[0]["id"]
+
+    gestion = {"name": "Gaston", "role": "gestion"}
+    ops = [(1, {"op": "create_contract", "client_id": clients[0].id, "amount_total": 10,
+                "amount_remaining": 5, "status": "signed"})]
+    assert [r["status"] for r in run_batch(db_session, gestion, ops, dry_run=True)] == ["ok"]
+    assert db_session.query(Contract).count() == 0
+    results = list(run_batch(db_session, gestion, ops + [(2, {"op": "delete_all"})], stop_on_error=True))
+    assert [r["status"] for r in results] == ["ok", "error"]
+    assert db_session.query(Contract).count() == 1
+
+    # Une référence créée dans un lot annulé n'est plus utilisable (son ID peut être réattribué)
+    from sqlalchemy.exc import SQLAlchemyError
+    client_op = {"op": "create_client", "name": "Zoé", "email": "zoe@acme.fr", "phone": "0601020305",
+                 "company": "Zed"}
+    ops = [(1, {**client_op, "ref": "z"}), (2, {"op": "update_client", "id": "$z", "company": "Piège"})]
+    results = list(run_batch(db_session, commercial, ops, batch_size=1, dry_run=True))
+    assert [r["status"] for r in results] == ["ok", "error"] and "Référence annulée" in results[1]["error"]
+
+    real_commit, commits = db_session.commit, []
+
+    def commit_failing_once():
+        commits.append(1)
+        if len(commits) == 1:
+            raise SQLAlchemyError("disque plein")
+        real_commit()
+
+    ops = [(1, {**client_op, "ref": "z"}), (2, client_op),
+           (3, {"op": "update_client", "id": "$z", "company": "Piège"})]
+    with patch.object(db_session, "commit", side_effect=commit_failing_once):
+        results = list(run_batch(db_session, commercial, ops, batch_size=1))
+    assert [r["status"] for r in results] == ["error", "ok", "error"]
+    assert db_session.get(Client, results[1]["id"]).company == "Zed"
+
+
+def test_services_rules_shared_by_commands_and_batch(db_session):
+    from crm import services
+    from crm.batch import run_batch
+    _, contract, event = _create_event(db_session)
+    other = {"name": "Autre", "role": "commercial"}
+    with pytest.raises(ValueError, match="Email invalide"):
+        services.create_client(db_session, other, "Jean", "pas-un-email", "0601020304", "Acme")
+    with pytest.raises(ValueError, match="vos propres contrats"):
+        services.editable_contract(db_session, other, contract.id)
+    with pytest.raises(ValueError, match="date de fin"):
+        services.event_changes(event, end=event.event_date_start - timedelta(days=1))
+    with pytest.raises(ValueError, match="Contact support invalide"):
+        services.event_changes(event, support_contact="Inconnu")
+    changes = services.contract_changes(status="signed", amount_remaining="0")
+    assert changes == {"amount_remaining": 0.0, "status": "signed"}
+
+    # run-batch passe par les mêmes fonctions, donc par les mêmes refus
+    ops = [(1, {"op": "update_contract", "id": contract.id, "status": "cancelled"})]
+    result, = run_batch(db_session, other, ops)
+    assert result["error"] == "Vous ne pouvez modifier que vos propres contrats."
+
+
+def test_session_scope_leak_detector_and_pool_metrics(tmp_path):
+    from sqlalchemy import text
+    from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+    from sqlalchemy.pool import QueuePool
+    from crm.sessions import PoolMetrics, SessionLeakDetector, session_scope
+    pooled = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=QueuePool, pool_size=1,
+                           max_overflow=0, pool_timeout=0.05)
+    factory = sessionmaker(bind=pooled)
+    metrics = PoolMetrics().install(pooled)
+    detector = SessionLeakDetector(echo=False).install()
+    try:
+        with pytest.raises(ValueError):
+            with session_scope(factory) as session:
+                session.execute(text("select 1"))
+                raise ValueError("boom")
+        assert not session.in_transaction()
+
+        leaked = factory()
+        leaked.execute(text("select 1"))
+        with pytest.raises(PoolTimeoutError):
+            pooled.connect()
+        detector.run("demo", lambda: None)
+        report = detector.reports[-1]
+        assert [(leak["state"], leak["command"]) for leak in report["leaks"]] == [("open", None)]
+        assert "test_session_scope_leak_detector_and_pool_metrics" in report["leaks"][0]["stack"]
+
+        del leaked
+        assert [leak["state"] for leak in detector.leaks()] == ["collected"]
+        assert detector.leaks() == []
+    finally:
+        detector.uninstall()
+    stats, = metrics.snapshot()
+    assert stats["checkouts"] == 2 and stats["timeouts"] == 1
+    assert stats["max_checked_out"] == 1 and stats["checked_out"] == 0
+    assert stats["wait_ms_max"] >= 50
+
+
+def test_metrics_textfile_accumulates_across_processes(tmp_path):
+    from crm.auth import encrypt_data
+    from crm.metrics import CRYPTO_OPERATIONS, Registry, parse_textfile, write_textfile
+    before = CRYPTO_OPERATIONS.value(operation="encrypt")
+    encrypt_data("x")
+    assert CRYPTO_OPERATIONS.value(operation="encrypt") == before + 1
+
+    path = str(tmp_path / "crm.prom")
+
+    def process(latency, pool_max):
+        registry = Registry()
+        commands = registry.histogram("crm_demo_seconds", "Durée.", ("command",), buckets=(0.1, 1))
+        statements = registry.counter("crm_demo_statements_total", "Requêtes.", ("command",))
+        checked_out = registry.gauge("crm_demo_checked_out", "Connexions.")
+        commands.observe(latency, command='list-"all"')
+        statements.inc(3, command='list-"all"')
+        checked_out.set(pool_max)
+        write_textfile(path, registry)
+        write_textfile(path, registry)  # rien de nouveau : pas de double comptage
+
+    process(0.05, 4)
+    process(0.5, 2)
+
+    with open(path) as f:
+        text = f.read()
+    series = parse_textfile(text)
+    labels = (("command", 'list-"all"'),)
+    assert series["crm_demo_statements_total", labels] == 6
+    assert series["crm_demo_seconds_bucket", labels + (("le", "0.1"),)] == 1
+    assert series["crm_demo_seconds_bucket", labels + (("le", "+Inf"),)] == 2
+    assert series["crm_demo_seconds_count", labels] == 2
+    assert series["crm_demo_seconds_sum", labels] == pytest.approx(0.55)
+    assert series["crm_demo_checked_out", ()] == 2
+    assert "# TYPE crm_demo_seconds histogram" in text
+    assert 'crm_demo_statements_total{command="list-\\"all\\""} 6' in text